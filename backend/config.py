@@ -79,6 +79,10 @@ class Settings:
         - AI_ENABLED: 是否启用AI功能 (布尔值)
         - AVAILABLE_VISION_MODELS: 可用的视觉模型列表 (字符串列表)
         - DB_PATH: 数据库路径 (字符串)
+        - SQLITE_CACHE_SIZE_MB: 每个SQLite连接的页缓存大小(MB) (浮点数)
+        - SQLITE_MMAP_SIZE_MB: SQLite内存映射读取的最大字节数(MB) (浮点数)
+        - SQLITE_CACHED_STATEMENTS: 每个SQLite连接缓存的预编译语句数量 (整数)
+        - IMAGE_COUNT_CACHE_SECONDS: 图片列表总数的缓存秒数，0表示不缓存，缓存只在本进程写入后失效 (整数)
         - DESCRIPTION_INDEX_PATH: 描述向量索引文件路径 (字符串)
         - HOST: 服务器主机地址 (字符串)
         - PORT: 服务器端口号 (整数)
@@ -86,19 +90,51 @@ class Settings:
         - IMAGE_VECTOR_CACHE_DIR: 图像向量缓存目录 (字符串)
         - MAX_CACHE_SIZE_GB: 最大缓存大小(GB) (浮点数，存储时为GB单位，使用时转换为字节)
         - MODEL_PATH: 模型路径 (字符串)
+        - EMBEDDING_BATCH_SIZE: 跨请求合并编码的最大批大小，小于等于1时不合并 (整数)
+        - EMBEDDING_BATCH_WAIT_MS: 凑批时最多等待的毫秒数 (浮点数)
+        - INFERENCE_WORKERS: 异步接口执行编码和检索的线程数 (正整数)
+        - INGEST_WORKERS: 上传、编辑和删除图片的线程数 (正整数)
+        - EMBEDDING_SERVICE_ADDRESS: 独立嵌入服务地址，"host:port"或Unix套接字路径，为空时在本进程加载模型 (字符串)
+        - EMBEDDING_SERVICE_WORKERS: 嵌入服务的工作进程数，即模型副本数量 (整数)
+        - EMBEDDING_SERVICE_AUTHKEY: 嵌入服务连接的认证密钥，使用嵌入服务时必须设置 (字符串)
+        - EMBEDDING_SERVICE_TIMEOUT: 嵌入服务中单个编码请求最多等待的秒数 (浮点数)
+        - EMBEDDING_BACKEND: 编码推理后端，torch、torch_int8或onnx (字符串)
+        - ONNX_MODEL_DIR: ONNX模型导出目录 (字符串)
         - OPENAI_API_BASE: OpenAI API基础URL (字符串)
         - OPENAI_API_KEY: OpenAI API密钥 (字符串)
         - TEXT_VECTOR_CACHE_DIR: 文本向量缓存目录 (字符串)
         - TITLE_INDEX_PATH: 标题向量索引文件路径 (字符串)
         - UPLOAD_DIR: 上传图片存储目录 (字符串)
         - USE_CACHE: 是否使用缓存 (布尔值)
+        - VECTOR_MEMORY_CACHE_MB: 每个向量缓存目录在进程内LRU缓存的大小上限(MB) (浮点数)
         - UUID_MAP_PATH: UUID映射文件路径 (字符串)
+        - TITLE_INDEX_TYPE / DESCRIPTION_INDEX_TYPE / IMAGE_INDEX_TYPE: 各向量索引结构，flat、hnsw、ivf_flat或ivf_pq (字符串)
+        - HNSW_M / HNSW_EF_CONSTRUCTION / HNSW_EF_SEARCH: HNSW索引的构建和查询参数 (整数)
+        - IVF_NLIST / IVF_NPROBE: IVF索引的聚类中心数量和查询时探查的聚类数量 (整数)
+        - TITLE_INDEX_ENCODING / DESCRIPTION_INDEX_ENCODING / IMAGE_INDEX_ENCODING: 各向量索引的存储编码，float32、fp16、sq8或pq (字符串)
+        - PQ_M / PQ_NBITS: 乘积量化的子空间数量和每个子空间的编码位数 (整数)
+        - RERANK_FACTOR: 压缩索引的候选倍数，用全精度向量重排序，小于等于1时不重排序 (整数)
+        - VECTOR_INDEX_MMAP: 是否以只读内存映射方式加载向量索引 (布尔值)
+        - VECTOR_INDEX_READ_ONLY: 是否以只读方式加载向量索引，不参与写入 (布尔值)
+        - VECTOR_CHECKPOINT_MUTATIONS: 向量变更日志积累多少条记录后将索引完整写盘 (整数)
+        - VECTOR_CHECKPOINT_INTERVAL: 后台检查点的时间窗口，单位秒 (整数)
+        - INDEX_SNAPSHOT_KEEP: 保留的索引版本数量，用于回滚 (整数)
         - VECTOR_DIM: 向量维度 (整数)
         - VISION_MODEL: 当前使用的视觉模型 (字符串)
         """
         # 模型相关配置
         self.MODEL_PATH = ""  # 用于向量编码的模型路径，例如: "C:/models/jina-clip-v2"
         self.VECTOR_DIM = 1024  # 向量维度，大多数CLIP模型为1024
+        self.EMBEDDING_BATCH_SIZE = 32  # 并发的单条编码请求合并成批的最大条数，设为1关闭合并
+        self.EMBEDDING_BATCH_WAIT_MS = 5  # 凑批最多等待的毫秒数，等待越长批越满、单次延迟越高
+        self.INFERENCE_WORKERS = 4  # 检索和编码线程池大小，请求处理中的推理都放到这里，不阻塞事件循环
+        self.INGEST_WORKERS = 8  # 上传、编辑和删除图片的线程池大小，与检索线程池分开；一批编码中来自上传的图片最多这么多张
+        self.EMBEDDING_SERVICE_ADDRESS = ""  # 独立嵌入服务地址，例如: "127.0.0.1:6100"；为空时每个API进程各自加载模型
+        self.EMBEDDING_SERVICE_WORKERS = 1  # 嵌入服务的工作进程数，每个进程加载一份模型
+        self.EMBEDDING_SERVICE_AUTHKEY = ""  # 嵌入服务连接的认证密钥，服务和API进程需一致；使用嵌入服务时必须设置为随机字符串
+        self.EMBEDDING_SERVICE_TIMEOUT = 120  # 嵌入服务中单个编码请求最多等待的秒数，超时返回错误（包含工作进程重启后加载模型的时间）
+        self.EMBEDDING_BACKEND = "torch"  # 编码推理后端: torch（全精度）、torch_int8（动态int8量化）或onnx（ONNX Runtime）
+        self.ONNX_MODEL_DIR = "./data/models/onnx"  # onnx后端的模型导出目录，文件不存在时首次使用自动导出
         
         # 图片存储相关配置
         self.UPLOAD_DIR = ""  # 上传图片存储目录，例如: "./data/images"
@@ -109,14 +145,40 @@ class Settings:
         self.IMAGE_INDEX_PATH = ""  # 图像向量索引文件，例如: "./data/faiss/image_vectors.faiss"
         self.UUID_MAP_PATH = ""  # UUID映射文件，例如: "./data/faiss/uuid_map.pickle"
         
+        # 索引结构设置，修改后需调用 vector_db.rebuild_indices() 重建索引
+        self.TITLE_INDEX_TYPE = "flat"  # 标题向量索引结构: flat(精确)、hnsw、ivf_flat、ivf_pq
+        self.DESCRIPTION_INDEX_TYPE = "flat"  # 描述向量索引结构
+        self.IMAGE_INDEX_TYPE = "flat"  # 图像向量索引结构
+        self.HNSW_M = 32  # HNSW每个节点的邻居数，越大召回越高、内存越多
+        self.HNSW_EF_CONSTRUCTION = 200  # HNSW构建时的搜索宽度
+        self.HNSW_EF_SEARCH = 64  # HNSW查询时的搜索宽度，越大召回越高、查询越慢
+        self.IVF_NLIST = 1024  # IVF聚类中心数量上限，实际数量受训练样本数限制
+        self.IVF_NPROBE = 16  # IVF查询时探查的聚类数量，越大召回越高、查询越慢
+        self.TITLE_INDEX_ENCODING = "float32"  # 标题向量存储编码: float32、fp16、sq8、pq
+        self.DESCRIPTION_INDEX_ENCODING = "float32"  # 描述向量存储编码
+        self.IMAGE_INDEX_ENCODING = "float32"  # 图像向量存储编码
+        self.PQ_M = 64  # 乘积量化子空间数量，必须能整除VECTOR_DIM
+        self.PQ_NBITS = 8  # 乘积量化每个子空间的编码位数
+        self.RERANK_FACTOR = 4  # 压缩索引多取的候选倍数，用磁盘上的全精度向量重排序
+        self.VECTOR_INDEX_MMAP = False  # 以内存映射加载索引，启动更快且多个工作进程共享页缓存
+        self.VECTOR_INDEX_READ_ONLY = False  # 只读加载索引，写入由持有写入锁的单个进程完成
+        self.VECTOR_CHECKPOINT_MUTATIONS = 1000  # 变更日志达到该条数时做检查点，平时每次增删只追加日志
+        self.VECTOR_CHECKPOINT_INTERVAL = 30  # 最早一条未写盘的变更超过该秒数时由后台线程写盘
+        self.INDEX_SNAPSHOT_KEEP = 3  # 每次检查点生成一个新的索引版本，保留最近几个版本用于回滚
+        
         # 数据库配置
         self.DB_PATH = ""  # SQLite数据库路径，例如: "./data/db/smartimagefinder.db"
+        self.SQLITE_CACHE_SIZE_MB = 64  # 每个线程的数据库连接的页缓存大小
+        self.SQLITE_MMAP_SIZE_MB = 256  # 通过内存映射读取数据库文件的上限，0表示不使用内存映射
+        self.SQLITE_CACHED_STATEMENTS = 256  # 每个连接缓存的预编译语句数量
+        self.IMAGE_COUNT_CACHE_SECONDS = 0  # 图片列表总数的缓存秒数，0表示不缓存；多工作进程时其他进程的写入最多延迟该秒数才反映到总数
         
         # 缓存设置
         self.TEXT_VECTOR_CACHE_DIR = ""  # 文本向量缓存目录，例如: "./data/caches/text_vector_cache"
         self.IMAGE_VECTOR_CACHE_DIR = ""  # 图像向量缓存目录，例如: "./data/caches/image_vector_cache"
         self.USE_CACHE = True  # 是否启用缓存功能
         self.MAX_CACHE_SIZE_GB = 1.5  # 最大缓存大小，单位为GB (YAML中存储为1.5，使用时需乘以2**30转换为字节)
+        self.VECTOR_MEMORY_CACHE_MB = 64  # 磁盘缓存前的进程内LRU缓存上限，单位为MB，文本和图像缓存各自独立
         
         # API设置
         self.OPENAI_API_KEY = ""  # OpenAI API密钥
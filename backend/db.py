@@ -1,14 +1,19 @@
 import sqlite3
 import json
-from typing import Dict, List, Any, Optional, Tuple
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional, Tuple, Union
 import uuid as uuid_lib
 from datetime import datetime
 import os
+import time
+import base64
+from collections import OrderedDict
 
 # 导入向量数据库模块
 from .vector_db import (
     add_title_vector, add_description_vector, add_image_vector, 
-    delete_vectors, save_indices,
+    remove_vector, delete_vectors, schedule_checkpoint,
     search_by_text as vector_search_by_text,
     search_by_image as vector_search_by_image,
     search_by_uuid as vector_search_by_uuid
@@ -17,46 +22,245 @@ from .vector_db import (
 from .config import settings
 from backend import vector_db
 
-def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect(settings.DB_PATH)
+# 每个线程一个长期复用的数据库连接
+_local = threading.local()
+
+# 没有标签的图片在标签统计中归入的默认标签
+DEFAULT_TAG = "未分类"
+
+def _connect() -> sqlite3.Connection:
+    """打开数据库连接并设置WAL模式和缓存参数"""
+    conn = sqlite3.connect(settings.DB_PATH, timeout=30, cached_statements=settings.SQLITE_CACHED_STATEMENTS)
     conn.row_factory = sqlite3.Row
+    # WAL模式下读不阻塞写、写不阻塞读；synchronous=NORMAL在WAL模式下仍保证数据库一致
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{int(settings.SQLITE_CACHE_SIZE_MB * 1024)}")  # 负数表示KB
+    conn.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE_MB * 2**20)}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+def get_db_connection():
+    """获取当前线程的数据库连接，首次调用时创建，之后一直复用，调用方不要关闭"""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != settings.DB_PATH:
+        conn = _local.conn = _connect()
+        _local.path = settings.DB_PATH
+        _local.depth = 0
     return conn
 
+@contextmanager
+def db_connection():
+    """使用当前线程的数据库连接
+    
+    可以嵌套使用；最外层退出时回滚未提交的修改，与原来关闭连接时的行为一致，
+    写操作需要自行commit
+    """
+    conn = get_db_connection()
+    _local.depth += 1
+    try:
+        yield conn
+    finally:
+        _local.depth -= 1
+        if _local.depth == 0 and conn.in_transaction:
+            conn.rollback()
+
 def init_db():
     """初始化数据库表结构"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    global fts_available
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        
+        # 创建图片表
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uuid TEXT UNIQUE NOT NULL,
+            filename TEXT NOT NULL,
+            filepath TEXT NOT NULL,
+            title TEXT,
+            description TEXT,
+            file_size INTEGER NOT NULL,
+            file_type TEXT NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            hash_value TEXT,
+            metadata TEXT,
+            tags TEXT
+        )
+        ''')
+        
+        # 创建索引
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_images_uuid ON images(uuid)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_images_created_at ON images(created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_images_updated_at ON images(updated_at)')
+        # 其余排序字段的索引，与上面两个一样隐含rowid(即id)，键集分页按(排序字段, id)直接定位
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_images_file_size ON images(file_size)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_images_filename ON images(filename)')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_title ON images(COALESCE(title, ''))")
+        
+        # 创建标签表：每个图片的每个标签一行，主键(tag, image_id)用于按标签查找图片
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_tags (
+            tag TEXT NOT NULL,
+            image_id INTEGER NOT NULL,
+            PRIMARY KEY (tag, image_id)
+        ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_image_tags_image_id ON image_tags(image_id)')
+        
+        # 创建标签计数表，由触发器随image_tags和images的增删维护，没有标签的图片计入默认标签
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tag_counts (
+            tag TEXT PRIMARY KEY,
+            count INTEGER NOT NULL
+        )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tag_counts_count ON tag_counts(count)')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_image_tags_insert AFTER INSERT ON image_tags
+        BEGIN
+            INSERT INTO tag_counts (tag, count) VALUES (NEW.tag, 1)
+                ON CONFLICT(tag) DO UPDATE SET count = count + 1;
+            -- 图片的第一个标签，不再计入默认标签
+            UPDATE tag_counts SET count = count - 1
+                WHERE tag = '{DEFAULT_TAG}' AND (SELECT COUNT(*) FROM image_tags WHERE image_id = NEW.image_id) = 1;
+            DELETE FROM tag_counts WHERE tag = '{DEFAULT_TAG}' AND count <= 0;
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_image_tags_delete AFTER DELETE ON image_tags
+        BEGIN
+            UPDATE tag_counts SET count = count - 1 WHERE tag = OLD.tag;
+            DELETE FROM tag_counts WHERE tag = OLD.tag AND count <= 0;
+            -- 图片仍然存在但已没有标签，计入默认标签
+            INSERT INTO tag_counts (tag, count) SELECT '{DEFAULT_TAG}', 1
+                WHERE EXISTS (SELECT 1 FROM images WHERE id = OLD.image_id)
+                  AND NOT EXISTS (SELECT 1 FROM image_tags WHERE image_id = OLD.image_id)
+                ON CONFLICT(tag) DO UPDATE SET count = count + 1;
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_images_insert AFTER INSERT ON images
+        BEGIN
+            INSERT INTO tag_counts (tag, count) VALUES ('{DEFAULT_TAG}', 1)
+                ON CONFLICT(tag) DO UPDATE SET count = count + 1;
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_images_delete AFTER DELETE ON images
+        WHEN NOT EXISTS (SELECT 1 FROM image_tags WHERE image_id = OLD.id)
+        BEGIN
+            UPDATE tag_counts SET count = count - 1 WHERE tag = '{DEFAULT_TAG}';
+            DELETE FROM tag_counts WHERE tag = '{DEFAULT_TAG}' AND count <= 0;
+        END
+        ''')
+        
+        # 创建标题、描述和标签的全文索引（外部内容表，内容来自images），trigram分词适用于中文
+        try:
+            cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
+                title, description, tags,
+                content='images', content_rowid='id', tokenize='trigram'
+            )
+            ''')
+            cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_images_fts_insert AFTER INSERT ON images
+            BEGIN
+                INSERT INTO images_fts (rowid, title, description, tags)
+                VALUES (NEW.id, NEW.title, NEW.description, NEW.tags);
+            END
+            ''')
+            cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_images_fts_delete AFTER DELETE ON images
+            BEGIN
+                INSERT INTO images_fts (images_fts, rowid, title, description, tags)
+                VALUES ('delete', OLD.id, OLD.title, OLD.description, OLD.tags);
+            END
+            ''')
+            cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_images_fts_update AFTER UPDATE OF title, description, tags ON images
+            BEGIN
+                INSERT INTO images_fts (images_fts, rowid, title, description, tags)
+                VALUES ('delete', OLD.id, OLD.title, OLD.description, OLD.tags);
+                INSERT INTO images_fts (rowid, title, description, tags)
+                VALUES (NEW.id, NEW.title, NEW.description, NEW.tags);
+            END
+            ''')
+            fts_available = True
+        except sqlite3.OperationalError as e:
+            print(f"当前SQLite不支持FTS5 trigram全文索引，文本搜索使用LIKE匹配: {e}")
+        
+        # 按数据库结构版本执行一次性迁移
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            _migrate_image_tags(cursor)
+            cursor.execute("PRAGMA user_version = 1")
+        if version < 2:
+            _rebuild_tag_counts(cursor)
+            cursor.execute("PRAGMA user_version = 2")
+        if version < 3 and fts_available:
+            # 为已有图片建立全文索引
+            cursor.execute("INSERT INTO images_fts (images_fts) VALUES ('rebuild')")
+            cursor.execute("PRAGMA user_version = 3")
+        
+        conn.commit()
     
-    # 创建图片表
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS images (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        uuid TEXT UNIQUE NOT NULL,
-        filename TEXT NOT NULL,
-        filepath TEXT NOT NULL,
-        title TEXT,
-        description TEXT,
-        file_size INTEGER NOT NULL,
-        file_type TEXT NOT NULL,
-        width INTEGER,
-        height INTEGER,
-        created_at TEXT NOT NULL,
-        updated_at TEXT NOT NULL,
-        hash_value TEXT,
-        metadata TEXT,
-        tags TEXT
+    print("数据库初始化完成")
+
+def _normalize_tags(tags) -> List[str]:
+    """清理标签列表：只保留非空字符串，去掉首尾空白并去重"""
+    result = []
+    for tag in tags or []:
+        if isinstance(tag, str) and tag.strip() and tag.strip() not in result:
+            result.append(tag.strip())
+    return result
+
+def _set_image_tags(cursor, image_id: int, tags):
+    """用标签列表替换image_tags表中该图片的标签"""
+    cursor.execute("DELETE FROM image_tags WHERE image_id = ?", (image_id,))
+    cursor.executemany(
+        "INSERT INTO image_tags (tag, image_id) VALUES (?, ?)",
+        [(tag, image_id) for tag in _normalize_tags(tags)]
     )
-    ''')
-    
-    # 创建索引
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_images_uuid ON images(uuid)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_images_created_at ON images(created_at)')
-    
-    conn.commit()
-    conn.close()
+
+def _migrate_image_tags(cursor):
+    """把images.tags中的JSON标签导入image_tags表"""
+    cursor.execute("SELECT id, tags FROM images WHERE tags IS NOT NULL AND tags != '[]'")
+    rows = cursor.fetchall()
+    for image_id, tags_json in rows:
+        try:
+            tags = json.loads(tags_json)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(tags, list):
+            _set_image_tags(cursor, image_id, tags)
+    if rows:
+        print(f"已将{len(rows)}张图片的标签迁移到image_tags表")
+
+def _rebuild_tag_counts(cursor):
+    """根据image_tags表重新统计tag_counts表"""
+    cursor.execute("DELETE FROM tag_counts")
+    cursor.execute("INSERT INTO tag_counts (tag, count) SELECT tag, COUNT(*) FROM image_tags GROUP BY tag")
+    cursor.execute("""
+    INSERT INTO tag_counts (tag, count)
+    SELECT ?, COUNT(*) FROM images WHERE id NOT IN (SELECT image_id FROM image_tags)
+    HAVING COUNT(*) > 0
+    ON CONFLICT(tag) DO UPDATE SET count = count + excluded.count
+    """, (DEFAULT_TAG,))
+
+def _tag_condition(tags: List[str], params: List[Any]) -> str:
+    """生成标签过滤条件（包含任一标签即可），把参数追加到params
     
-    print("数据库初始化完成")
+    通过image_tags表的主键索引按标签查找，只匹配完整标签
+    """
+    tags = _normalize_tags(tags)
+    if not tags:
+        return "0"
+    params.extend(tags)
+    return f"id IN (SELECT image_id FROM image_tags WHERE tag IN ({', '.join(['?'] * len(tags))}))"
 
 def dict_factory(cursor, row):
     """将sqlite3.Row转换为dict"""
@@ -67,146 +271,236 @@ def dict_factory(cursor, row):
 
 def get_image_by_uuid(uuid: str) -> Optional[Dict[str, Any]]:
     """通过UUID获取图片信息"""
-    conn = get_db_connection()
-    conn.row_factory = dict_factory
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM images WHERE uuid = ?", (uuid,))
-    image = cursor.fetchone()
-    
-    # 处理JSON字段
-    if image:
-        if image['tags']:
-            try:
-                image['tags'] = json.loads(image['tags'])
-            except:
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = dict_factory
+        
+        cursor.execute("SELECT * FROM images WHERE uuid = ?", (uuid,))
+        image = cursor.fetchone()
+        
+        # 处理JSON字段
+        if image:
+            if image['tags']:
+                try:
+                    image['tags'] = json.loads(image['tags'])
+                except:
+                    image['tags'] = []
+            else:
                 image['tags'] = []
-        else:
-            image['tags'] = []
-            
-        if image['metadata']:
-            try:
-                image['metadata'] = json.loads(image['metadata'])
-            except:
+                
+            if image['metadata']:
+                try:
+                    image['metadata'] = json.loads(image['metadata'])
+                except:
+                    image['metadata'] = {}
+            else:
                 image['metadata'] = {}
-        else:
-            image['metadata'] = {}
-    
-    conn.close()
+        
     return image
 
+# 图片列表允许的排序字段及对应的SQL表达式，排序字段和方向只能取这里的值
+SORT_COLUMNS = {
+    "created_at": "created_at",
+    "updated_at": "updated_at",
+    "file_size": "file_size",
+    "filename": "filename",
+    "title": "COALESCE(title, '')",
+    "id": "id",
+}
+
+# 图片总数缓存：键为过滤条件，值为(数据版本, 缓存时间, 总数)，按最近使用淘汰，最多COUNT_CACHE_MAX_ENTRIES条
+COUNT_CACHE_MAX_ENTRIES = 256
+_count_cache: "OrderedDict[Any, Tuple[int, float, int]]" = OrderedDict()
+_count_cache_lock = threading.Lock()
+# 本进程内图片增删或标签修改时递增，使缓存的总数失效。
+# 版本号只存在于当前进程，多个工作进程时其他进程的写入不会使本进程的缓存失效，只能等缓存过期
+_data_version = 0
+
+def _bump_data_version():
+    global _data_version
+    with _count_cache_lock:
+        _data_version += 1
+
+def encode_cursor(sort_by: str, order: str, value: Any, image_id: int) -> str:
+    """把上一页最后一条记录的排序值和id编码为游标字符串"""
+    raw = json.dumps([sort_by, order, value, image_id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, sort_by: str, order: str) -> Tuple[Any, int]:
+    """解析游标，返回(排序值, id)；游标无效或与当前排序方式不一致时抛出ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort_by, cursor_order, value, image_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise ValueError("无效的分页游标")
+    if cursor_sort_by != sort_by or cursor_order != order or not isinstance(image_id, int):
+        raise ValueError("分页游标与当前排序方式不一致")
+    return value, image_id
+
+def _count_images(cursor, where: str, params: List[Any], cache_key) -> int:
+    """统计符合条件的图片数，结果按IMAGE_COUNT_CACHE_SECONDS缓存（默认0，不缓存）
+    
+    缓存只在本进程写入数据后失效，其他工作进程的写入最多延迟IMAGE_COUNT_CACHE_SECONDS秒才反映到总数
+    """
+    ttl = settings.IMAGE_COUNT_CACHE_SECONDS
+    now = time.monotonic()
+    version = _data_version
+    if ttl > 0:
+        with _count_cache_lock:
+            cached = _count_cache.get(cache_key)
+            if cached:
+                _count_cache.move_to_end(cache_key)
+        if cached and cached[0] == version and now - cached[1] < ttl:
+            return cached[2]
+    
+    cursor.execute(f"SELECT COUNT(*) as count FROM images{where}", params)
+    total_count = cursor.fetchone()['count']
+    
+    if ttl > 0:
+        with _count_cache_lock:
+            _count_cache[cache_key] = (version, now, total_count)
+            _count_cache.move_to_end(cache_key)
+            while len(_count_cache) > COUNT_CACHE_MAX_ENTRIES:
+                _count_cache.popitem(last=False)
+    return total_count
+
 def get_images(page: int = 1, 
                page_size: int = 20, 
                sort_by: str = "created_at",
                order: str = "desc",
                start_date: Optional[str] = None,
                end_date: Optional[str] = None,
-               tags: Optional[List[str]] = None) -> Tuple[List[Dict[str, Any]], int]:
-    """获取图片列表，支持分页和过滤"""
-    conn = get_db_connection()
-    conn.row_factory = dict_factory
-    cursor = conn.cursor()
-    
-    query = "SELECT * FROM images"
-    count_query = "SELECT COUNT(*) as count FROM images"
-    
-    conditions = []
-    params = []
-    
-    # 添加过滤条件
-    if start_date:
-        conditions.append("created_at >= ?")
-        params.append(start_date)
-    
-    if end_date:
-        conditions.append("created_at <= ?")
-        params.append(end_date)
-    
-    # 改进标签过滤逻辑
-    if tags and len(tags) > 0:
-        tag_conditions = []
-        for tag in tags:
-            # 使用JSON包含检查，查找包含特定标签的图片
-            # 由于SQLite不支持完整的JSON查询，我们使用LIKE进行匹配
-            # 但需要确保匹配的是完整的标签字符串
-            tag_conditions.append("tags LIKE ?")
-            # 对特定标签进行精确匹配
-            params.append(f'%"{tag}"%')
-        conditions.append("(" + " OR ".join(tag_conditions) + ")")
-    
-    # 组合查询条件
-    if conditions:
-        query += " WHERE " + " AND ".join(conditions)
-        count_query += " WHERE " + " AND ".join(conditions)
-    
-    # 添加排序和分页
-    query += f" ORDER BY {sort_by} {order}"
-    query += f" LIMIT {page_size} OFFSET {(page - 1) * page_size}"
-    
-    # 执行查询
-    cursor.execute(query, params)
-    images = cursor.fetchall()
-    
-    # 执行计数查询
-    cursor.execute(count_query, params)
-    total_count = cursor.fetchone()['count']
-    
-    # 处理JSON字段
-    for image in images:
-        if image['tags']:
-            try:
-                image['tags'] = json.loads(image['tags'])
-            except:
+               tags: Optional[List[str]] = None,
+               cursor: Optional[str] = None,
+               with_total: bool = True) -> Tuple[List[Dict[str, Any]], Optional[int], Optional[str]]:
+    """获取图片列表，支持分页和过滤
+    
+    按(排序字段, id)排序。传入cursor（上一次返回的next_cursor）时按键集分页，
+    从游标位置直接沿索引继续读取，忽略page，翻到多深都不需要跳过前面的记录；
+    不传时按page用OFFSET分页。with_total为False时不统计总数，返回None。
+    返回(图片列表, 总数, 下一页游标)，没有下一页时游标为None
+    """
+    if sort_by not in SORT_COLUMNS:
+        raise ValueError(f"不支持的排序字段: {sort_by}")
+    order = order.lower()
+    if order not in ("asc", "desc"):
+        raise ValueError(f"不支持的排序方向: {order}")
+    sort_expr = SORT_COLUMNS[sort_by]
+    
+    with db_connection() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.row_factory = dict_factory
+        
+        conditions = []
+        params = []
+        
+        # 添加过滤条件
+        if start_date:
+            conditions.append("created_at >= ?")
+            params.append(start_date)
+        
+        if end_date:
+            conditions.append("created_at <= ?")
+            params.append(end_date)
+        
+        # 标签过滤，通过image_tags表的索引查找
+        if tags and len(tags) > 0:
+            conditions.append(_tag_condition(tags, params))
+        
+        filter_where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        filter_params = list(params)
+        
+        # 键集分页：只取排在游标之后的记录
+        if cursor:
+            value, last_id = decode_cursor(cursor, sort_by, order)
+            op = '<' if order == 'desc' else '>'
+            # 单独的范围条件让SQLite在表达式索引(title)上也能直接定位，而不是从头扫描索引
+            conditions.append(f"{sort_expr} {op}= ? AND ({sort_expr}, id) {op} (?, ?)")
+            params.extend([value, value, last_id])
+        
+        query = f"SELECT *, {sort_expr} AS sort_key FROM images"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        
+        # id作为第二排序键，保证排序值相同的记录顺序稳定
+        query += f" ORDER BY {sort_expr} {order}, id {order}"
+        # 多取一条用于判断是否还有下一页
+        query += f" LIMIT {page_size + 1}"
+        if not cursor:
+            query += f" OFFSET {(page - 1) * page_size}"
+        
+        db_cursor.execute(query, params)
+        images = db_cursor.fetchall()
+        
+        next_cursor = None
+        if len(images) > page_size:
+            images = images[:page_size]
+            last = images[-1]
+            next_cursor = encode_cursor(sort_by, order, last['sort_key'], last['id'])
+        
+        total_count = None
+        if with_total:
+            cache_key = (start_date, end_date, tuple(sorted(tags)) if tags else None)
+            total_count = _count_images(db_cursor, filter_where, filter_params, cache_key)
+        
+        # 处理JSON字段
+        for image in images:
+            del image['sort_key']
+            if image['tags']:
+                try:
+                    image['tags'] = json.loads(image['tags'])
+                except:
+                    image['tags'] = []
+            else:
                 image['tags'] = []
-        else:
-            image['tags'] = []
-    
-    conn.close()
-    return images, total_count
+        
+    return images, total_count, next_cursor
 
-def create_image(image_data: Dict[str, Any]) -> Dict[str, Any]:
-    """创建新图片记录"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def create_image(image_data: Dict[str, Any], image=None) -> Dict[str, Any]:
+    """创建新图片记录
     
-    # 生成UUID
-    image_uuid = str(uuid_lib.uuid4())
-    now = datetime.now().isoformat()
-    
-    # 准备JSON字段
-    if 'tags' in image_data and image_data['tags']:
-        tags_json = json.dumps(image_data['tags'], ensure_ascii=False)
-    else:
-        tags_json = json.dumps([], ensure_ascii=False)
-    
-    if 'metadata' in image_data and image_data['metadata']:
-        metadata_json = json.dumps(image_data['metadata'], ensure_ascii=False)
-    else:
-        metadata_json = json.dumps({}, ensure_ascii=False)
-    
-    cursor.execute("""
-    INSERT INTO images (uuid, filename, filepath, title, description, file_size, file_type,
-                       width, height, created_at, updated_at, hash_value, metadata, tags)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        image_uuid, 
-        image_data['filename'],
-        image_data['filepath'],
-        image_data.get('title'),
-        image_data.get('description'),
-        image_data['file_size'],
-        image_data['file_type'],
-        image_data.get('width'),
-        image_data.get('height'),
-        now,
-        now,
-        image_data.get('hash_value'),
-        metadata_json,
-        tags_json
-    ))
-    
-    conn.commit()
-    conn.close()
+    image为上传时已在内存中打开的PIL图像，传入时直接用它生成图像向量，不再读取磁盘文件
+    """
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        
+        # 生成UUID
+        image_uuid = str(uuid_lib.uuid4())
+        now = datetime.now().isoformat()
+        
+        # 准备JSON字段，标签清理一次，images.tags和image_tags表保存同一份列表
+        tags = _normalize_tags(image_data.get('tags'))
+        tags_json = json.dumps(tags, ensure_ascii=False)
+        
+        if 'metadata' in image_data and image_data['metadata']:
+            metadata_json = json.dumps(image_data['metadata'], ensure_ascii=False)
+        else:
+            metadata_json = json.dumps({}, ensure_ascii=False)
+        
+        cursor.execute("""
+        INSERT INTO images (uuid, filename, filepath, title, description, file_size, file_type,
+                           width, height, created_at, updated_at, hash_value, metadata, tags)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            image_uuid, 
+            image_data['filename'],
+            image_data['filepath'],
+            image_data.get('title'),
+            image_data.get('description'),
+            image_data['file_size'],
+            image_data['file_type'],
+            image_data.get('width'),
+            image_data.get('height'),
+            now,
+            now,
+            image_data.get('hash_value'),
+            metadata_json,
+            tags_json
+        ))
+        _set_image_tags(cursor, cursor.lastrowid, tags)
+        
+        conn.commit()
+    _bump_data_version()
     
     # 创建成功后，添加向量到索引
     try:
@@ -218,96 +512,93 @@ def create_image(image_data: Dict[str, Any]) -> Dict[str, Any]:
             add_description_vector(image_uuid, image_data['description'])
             
         # 添加图像向量
-        if os.path.exists(image_data['filepath']):
-            add_image_vector(image_uuid, image_data['filepath'])
+        if image is not None:
+            add_image_vector(image_uuid, image_data['filepath'], image_data.get('hash_value'), image)
+        elif os.path.exists(image_data['filepath']):
+            add_image_vector(image_uuid, image_data['filepath'], image_data.get('hash_value'))
             
-        # 定期保存索引
-        save_indices()
+        # 变更已写入日志，由后台检查点统一写盘
+        schedule_checkpoint()
     except Exception as e:
-        print(f"向量索引更新失败: {e}")
+        # 向量生成失败时删除刚创建的记录和已添加的向量，不保留没有向量的图片
+        print(f"向量索引更新失败，撤销图片记录: {e}")
+        delete_image(image_uuid)
+        raise
     
     # 返回创建的图片信息
     return get_image_by_uuid(image_uuid)
 
 def update_image(uuid: str, update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """更新图片信息"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # 检查图片是否存在
-    existing_image = get_image_by_uuid(uuid)
-    if not existing_image:
-        conn.close()
-        return None
-    
-    # 准备要更新的字段
-    update_fields = []
-    params = []
-    
-    title_updated = False
-    description_updated = False
-    
-    for field in ['title', 'description']:
-        if field in update_data and update_data[field] is not None:
-            update_fields.append(f"{field} = ?")
-            params.append(update_data[field])
-            if field == 'title':
-                title_updated = True
-            elif field == 'description':
-                description_updated = True
-    
-    # 处理标签
-    if 'tags' in update_data and update_data['tags'] is not None:
-        update_fields.append("tags = ?")
-        params.append(json.dumps(update_data['tags'], ensure_ascii=False))
-    
-    # 处理元数据
-    if 'metadata' in update_data and update_data['metadata'] is not None:
-        update_fields.append("metadata = ?")
-        params.append(json.dumps(update_data['metadata'], ensure_ascii=False))
-    
-    # 更新时间戳
-    update_fields.append("updated_at = ?")
-    params.append(datetime.now().isoformat())
-    
-    # 添加UUID参数
-    params.append(uuid)
-    
-    # 执行更新
-    if update_fields:
-        query = f"UPDATE images SET {', '.join(update_fields)} WHERE uuid = ?"
-        cursor.execute(query, params)
-        conn.commit()
-    
-    conn.close()
-    
-    # 如果标题或描述有更新，需要更新文本向量
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        
+        # 检查图片是否存在
+        cursor.execute("SELECT id FROM images WHERE uuid = ?", (uuid,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        image_id = row[0]
+        
+        # 准备要更新的字段
+        update_fields = []
+        params = []
+        
+        title_updated = False
+        description_updated = False
+        
+        for field in ['title', 'description']:
+            if field in update_data and update_data[field] is not None:
+                update_fields.append(f"{field} = ?")
+                params.append(update_data[field])
+                if field == 'title':
+                    title_updated = True
+                elif field == 'description':
+                    description_updated = True
+        
+        # 处理标签，清理一次后同步更新images.tags和image_tags表
+        if 'tags' in update_data and update_data['tags'] is not None:
+            tags = _normalize_tags(update_data['tags'])
+            update_fields.append("tags = ?")
+            params.append(json.dumps(tags, ensure_ascii=False))
+            _set_image_tags(cursor, image_id, tags)
+        
+        # 处理元数据
+        if 'metadata' in update_data and update_data['metadata'] is not None:
+            update_fields.append("metadata = ?")
+            params.append(json.dumps(update_data['metadata'], ensure_ascii=False))
+        
+        # 更新时间戳
+        update_fields.append("updated_at = ?")
+        params.append(datetime.now().isoformat())
+        
+        # 添加UUID参数
+        params.append(uuid)
+        
+        # 执行更新
+        if update_fields:
+            query = f"UPDATE images SET {', '.join(update_fields)} WHERE uuid = ?"
+            cursor.execute(query, params)
+            conn.commit()
+            _bump_data_version()
+    
+    # 如果标题或描述有更新，原地替换对应的文本向量，图像向量不受影响
     try:
         if title_updated or description_updated:
-            updated_image = get_image_by_uuid(uuid)
-            
-            # 注意：这里修改为分别更新标题和描述向量
             if title_updated:
-                # 删除旧的标题向量
-                delete_vectors(uuid)  # 目前这个函数会删除所有向量，后面需要优化
-                # 添加新的标题向量
-                if updated_image.get('title'):
-                    add_title_vector(uuid, updated_image['title'])
+                if update_data['title'].strip():
+                    add_title_vector(uuid, update_data['title'])
+                else:
+                    remove_vector(uuid, "title")
             
             if description_updated:
-                # 如果标题没有更新，这里会再次删除所有向量，但这是临时解决方案
-                if not title_updated:
-                    delete_vectors(uuid)
-                # 添加新的描述向量
-                if updated_image.get('description'):
-                    add_description_vector(uuid, updated_image['description'])
+                if update_data['description'].strip():
+                    add_description_vector(uuid, update_data['description'])
+                else:
+                    remove_vector(uuid, "description")
             
-            # 重新添加图像向量
-            if os.path.exists(updated_image['filepath']):
-                add_image_vector(uuid, updated_image['filepath'])
-                
-            # 保存索引
-            save_indices()
+            # 变更已写入日志，由后台检查点统一写盘
+            schedule_checkpoint()
     except Exception as e:
         print(f"更新文本向量失败: {e}")
     
@@ -316,87 +607,46 @@ def update_image(uuid: str, update_data: Dict[str, Any]) -> Optional[Dict[str, A
 
 def delete_image(uuid: str) -> bool:
     """删除图片"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # 检查图片是否存在
-    cursor.execute("SELECT id FROM images WHERE uuid = ?", (uuid,))
-    if not cursor.fetchone():
-        conn.close()
-        return False
-    
-    # 执行删除
-    cursor.execute("DELETE FROM images WHERE uuid = ?", (uuid,))
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        
+        # 检查图片是否存在
+        cursor.execute("SELECT id FROM images WHERE uuid = ?", (uuid,))
+        row = cursor.fetchone()
+        if not row:
+            return False
+        
+        # 执行删除，同时删除该图片的标签
+        cursor.execute("DELETE FROM image_tags WHERE image_id = ?", (row[0],))
+        cursor.execute("DELETE FROM images WHERE uuid = ?", (uuid,))
+        conn.commit()
+    _bump_data_version()
     
     # 从向量索引中删除
     try:
         delete_vectors(uuid)
-        save_indices()
+        schedule_checkpoint()
     except Exception as e:
         print(f"删除向量索引失败: {e}")
     
     return True
 
 def get_popular_tags(limit: int = 50) -> List[Dict[str, Any]]:
-    """获取热门标签列表"""
-    conn = get_db_connection()
-    conn.row_factory = dict_factory
-    cursor = conn.cursor()
-    
-    # 查询所有图片的标签字段
-    cursor.execute("SELECT uuid, tags FROM images")
-    
-    # 标签计数字典
-    tag_counts = {}
-    default_tag = "未分类"  # 默认标签名称
+    """获取热门标签列表，没有标签的图片计入默认标签"未分类"
     
-    # 解析每个图片的标签并计数
-    for row in cursor.fetchall():
-        try:
-            # 检查是否有标签
-            if not row['tags'] or row['tags'] == '[]':
-                # 没有标签，计数默认标签
-                if default_tag not in tag_counts:
-                    tag_counts[default_tag] = 0
-                tag_counts[default_tag] += 1
-                continue
-                
-            # 解析JSON格式的标签
-            tags_list = json.loads(row['tags'])
-            if not isinstance(tags_list, list) or len(tags_list) == 0:
-                # 解析出来是空列表，也计数默认标签
-                if default_tag not in tag_counts:
-                    tag_counts[default_tag] = 0
-                tag_counts[default_tag] += 1
-                continue
-                
-            # 计数每个标签
-            for tag in tags_list:
-                if not isinstance(tag, str):
-                    continue
-                    
-                # 确保标签是干净的字符串
-                clean_tag = tag.strip()
-                if clean_tag:
-                    if clean_tag not in tag_counts:
-                        tag_counts[clean_tag] = 0
-                    tag_counts[clean_tag] += 1
-        except json.JSONDecodeError:
-            # JSON解析失败，计数默认标签
-            if default_tag not in tag_counts:
-                tag_counts[default_tag] = 0
-            tag_counts[default_tag] += 1
-    
-    # 转换为所需的输出格式
-    tags = [{"name": tag, "count": count} for tag, count in tag_counts.items()]
-    
-    # 按使用频率排序
-    tags.sort(key=lambda x: x["count"], reverse=True)
-    
-    conn.close()
-    return tags[:limit]
+    从触发器维护的tag_counts表按计数索引读取，不扫描图片表
+    """
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT tag, count FROM tag_counts ORDER BY count DESC LIMIT ?", (limit,))
+        tags = [{"name": tag, "count": count} for tag, count in cursor.fetchall()]
+        
+    return tags
+
+def get_tag_count() -> int:
+    """获取不同标签的数量（包括默认标签）"""
+    with db_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM tag_counts").fetchone()[0]
 
 def add_tags_to_image(uuid: str, new_tags: List[str]) -> Optional[Dict[str, Any]]:
     """向图片添加标签"""
@@ -432,51 +682,50 @@ def remove_tag_from_image(uuid: str, tag: str) -> Optional[Dict[str, Any]]:
 
 def get_metadata_fields(limit: int = 50) -> List[Dict[str, Any]]:
     """获取所有元数据字段及其使用频率"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # 使用SQL分析元数据字段
-    cursor.execute("""
-    SELECT json_extract(metadata, '$') as all_meta FROM images WHERE metadata IS NOT NULL
-    """)
-    
-    # 分析元数据字段和类型
-    field_stats = {}
-    for row in cursor.fetchall():
-        if row[0]:
-            try:
-                metadata = json.loads(row[0])
-                for key, value in metadata.items():
-                    if key not in field_stats:
-                        field_stats[key] = {
-                            'count': 0,
-                            'types': {}
-                        }
-                    field_stats[key]['count'] += 1
-                    
-                    # 统计类型
-                    value_type = type(value).__name__
-                    if value_type not in field_stats[key]['types']:
-                        field_stats[key]['types'][value_type] = 0
-                    field_stats[key]['types'][value_type] += 1
-            except:
-                pass
-    
-    # 格式化输出
-    fields = []
-    for name, stats in field_stats.items():
-        # 确定主要类型
-        primary_type = max(stats['types'].items(), key=lambda x: x[1])[0]
-        fields.append({
-            "name": name,
-            "count": stats['count'],
-            "type": primary_type
-        })
-    
-    # 按使用频率排序
-    fields.sort(key=lambda x: x['count'], reverse=True)
-    
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        
+        # 使用SQL分析元数据字段
+        cursor.execute("""
+        SELECT json_extract(metadata, '$') as all_meta FROM images WHERE metadata IS NOT NULL
+        """)
+        
+        # 分析元数据字段和类型
+        field_stats = {}
+        for row in cursor.fetchall():
+            if row[0]:
+                try:
+                    metadata = json.loads(row[0])
+                    for key, value in metadata.items():
+                        if key not in field_stats:
+                            field_stats[key] = {
+                                'count': 0,
+                                'types': {}
+                            }
+                        field_stats[key]['count'] += 1
+                        
+                        # 统计类型
+                        value_type = type(value).__name__
+                        if value_type not in field_stats[key]['types']:
+                            field_stats[key]['types'][value_type] = 0
+                        field_stats[key]['types'][value_type] += 1
+                except:
+                    pass
+        
+        # 格式化输出
+        fields = []
+        for name, stats in field_stats.items():
+            # 确定主要类型
+            primary_type = max(stats['types'].items(), key=lambda x: x[1])[0]
+            fields.append({
+                "name": name,
+                "count": stats['count'],
+                "type": primary_type
+            })
+        
+        # 按使用频率排序
+        fields.sort(key=lambda x: x['count'], reverse=True)
+        
     return fields[:limit]
 
 def update_image_metadata(uuid: str, metadata: Dict[str, Any]) -> Optional[Dict[str, Any]]:
@@ -514,58 +763,84 @@ def search_by_text(query: str,
         # 默认文本匹配模式 (标题+描述)
         return simple_text_search(query, limit, start_date, end_date, tags)
 
-def title_only_search(query: str, 
-                     limit: int = 20,
-                     start_date: Optional[str] = None,
-                     end_date: Optional[str] = None,
-                     tags: Optional[List[str]] = None) -> List[Dict[str, Any]]:
-    """仅匹配标题的文本搜索"""
-    conn = get_db_connection()
-    conn.row_factory = dict_factory
-    cursor = conn.cursor()
-    
-    search_term = f"%{query}%"
-    conditions = [
-        "title LIKE ?"
-    ]
-    params = [search_term]
+# 全文索引的列，顺序与images_fts的列一致
+FTS_COLUMNS = ["title", "description", "tags"]
+# trigram分词至少需要3个字符，更短的查询使用LIKE匹配
+FTS_MIN_QUERY_LENGTH = 3
+# 当前SQLite是否支持FTS5 trigram分词，在init_db中检测
+fts_available = False
+
+def _text_search(query: str,
+                 weights: Dict[str, float],
+                 limit: int = 20,
+                 start_date: Optional[str] = None,
+                 end_date: Optional[str] = None,
+                 tags: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """在指定列中做文本匹配，weights为各列的权重
+    
+    查询不少于3个字符时使用FTS5全文索引，按BM25排序，分数为相对本次最佳结果的比例；
+    较短的查询使用LIKE匹配，分数为命中的最高权重列的权重比例
+    """
+    query = query.strip()
+    filters = []
+    filter_params = []
     
     # 添加时间过滤
     if start_date:
-        conditions.append("created_at >= ?")
-        params.append(start_date)
+        filters.append("created_at >= ?")
+        filter_params.append(start_date)
     
     if end_date:
-        conditions.append("created_at <= ?")
-        params.append(end_date)
+        filters.append("created_at <= ?")
+        filter_params.append(end_date)
     
     # 添加标签过滤
     if tags and len(tags) > 0:
-        tag_conditions = []
-        for tag in tags:
-            tag_conditions.append("tags LIKE ?")
-            params.append(f'%"{tag}"%')
-        conditions.append("(" + " OR ".join(tag_conditions) + ")")
+        filters.append(_tag_condition(tags, filter_params))
     
-    query_sql = f"""
-    SELECT *,
-           (CASE 
-             WHEN title LIKE ? THEN 1
-             ELSE 0
-           END) as relevance
-    FROM images
-    WHERE {" AND ".join(conditions)}
-    ORDER BY relevance DESC
-    LIMIT ?
-    """
-    
-    # 添加相关性计算参数
-    params.extend([search_term, limit])
-    
-    cursor.execute(query_sql, params)
-    results = cursor.fetchall()
-    
-    # 处理JSON字段并计算分数
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = dict_factory
+        
+        if fts_available and len(query) >= FTS_MIN_QUERY_LENGTH:
+            # 整个查询作为一个短语，限定在指定的列中匹配
+            match = "{%s} : \"%s\"" % (" ".join(weights), query.replace('"', '""'))
+            bm25_weights = ", ".join(str(weights.get(column, 0.0)) for column in FTS_COLUMNS)
+            query_sql = f"""
+            SELECT images.*, bm25(images_fts, {bm25_weights}) AS rank
+            FROM images_fts JOIN images ON images.id = images_fts.rowid
+            WHERE {" AND ".join(["images_fts MATCH ?"] + filters)}
+            ORDER BY rank
+            LIMIT ?
+            """
+            cursor.execute(query_sql, [match] + filter_params + [limit])
+            results = cursor.fetchall()
+            
+            # BM25越小越相关，以本次最佳结果为1.0换算分数
+            best = min((result['rank'] for result in results), default=0.0)
+            for result in results:
+                rank = result.pop('rank')
+                result['score'] = rank / best if best < 0 else 1.0
+        else:
+            search_term = f"%{query}%"
+            relevance = " ".join(f"WHEN {column} LIKE ? THEN {weight}" for column, weight in weights.items())
+            match = " OR ".join(f"{column} LIKE ?" for column in weights)
+            query_sql = f"""
+            SELECT *, (CASE {relevance} ELSE 0 END) as relevance
+            FROM images
+            WHERE {" AND ".join([f"({match})"] + filters)}
+            ORDER BY relevance DESC
+            LIMIT ?
+            """
+            cursor.execute(query_sql, [search_term] * (2 * len(weights)) + filter_params + [limit])
+            results = cursor.fetchall()
+            
+            # 计算标准化分数
+            top_weight = max(weights.values())
+            for result in results:
+                result['score'] = min(result.pop('relevance') / top_weight, 1.0)
+        
+    # 处理JSON字段
     for result in results:
         if result['tags']:
             try:
@@ -574,147 +849,88 @@ def title_only_search(query: str,
                 result['tags'] = []
         else:
             result['tags'] = []
-        
-        # 计算标准化分数
-        result['score'] = 1.0 if result['relevance'] > 0 else 0.0
     
-    conn.close()
     return results
 
+def title_only_search(query: str, 
+                     limit: int = 20,
+                     start_date: Optional[str] = None,
+                     end_date: Optional[str] = None,
+                     tags: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """仅匹配标题的文本搜索"""
+    return _text_search(query, {"title": 1.0}, limit, start_date, end_date, tags)
+
 def description_only_search(query: str, 
                            limit: int = 20,
                            start_date: Optional[str] = None,
                            end_date: Optional[str] = None,
                            tags: Optional[List[str]] = None) -> List[Dict[str, Any]]:
     """仅匹配描述的文本搜索"""
-    conn = get_db_connection()
-    conn.row_factory = dict_factory
-    cursor = conn.cursor()
-    
-    search_term = f"%{query}%"
-    conditions = [
-        "description LIKE ?"
-    ]
-    params = [search_term]
-    
-    # 添加时间过滤
-    if start_date:
-        conditions.append("created_at >= ?")
-        params.append(start_date)
-    
-    if end_date:
-        conditions.append("created_at <= ?")
-        params.append(end_date)
-    
-    # 添加标签过滤
-    if tags and len(tags) > 0:
-        tag_conditions = []
-        for tag in tags:
-            tag_conditions.append("tags LIKE ?")
-            params.append(f'%"{tag}"%')
-        conditions.append("(" + " OR ".join(tag_conditions) + ")")
-    
-    query_sql = f"""
-    SELECT *,
-           (CASE 
-             WHEN description LIKE ? THEN 1
-             ELSE 0
-           END) as relevance
-    FROM images
-    WHERE {" AND ".join(conditions)}
-    ORDER BY relevance DESC
-    LIMIT ?
-    """
-    
-    # 添加相关性计算参数
-    params.extend([search_term, limit])
-    
-    cursor.execute(query_sql, params)
-    results = cursor.fetchall()
-    
-    # 处理JSON字段并计算分数
-    for result in results:
-        if result['tags']:
-            try:
-                result['tags'] = json.loads(result['tags'])
-            except:
-                result['tags'] = []
-        else:
-            result['tags'] = []
-        
-        # 计算标准化分数
-        result['score'] = 1.0 if result['relevance'] > 0 else 0.0
-    
-    conn.close()
-    return results
+    return _text_search(query, {"description": 1.0}, limit, start_date, end_date, tags)
 
 def simple_text_search(query: str, 
                       limit: int = 20,
                       start_date: Optional[str] = None,
                       end_date: Optional[str] = None,
                       tags: Optional[List[str]] = None) -> List[Dict[str, Any]]:
-    """基本文本搜索（不使用向量）匹配标题和描述"""
-    conn = get_db_connection()
-    conn.row_factory = dict_factory
-    cursor = conn.cursor()
-    
-    search_term = f"%{query}%"
-    conditions = [
-        "title LIKE ? OR description LIKE ?"
-    ]
-    params = [search_term, search_term]
-    
-    # 添加时间过滤
-    if start_date:
-        conditions.append("created_at >= ?")
-        params.append(start_date)
-    
-    if end_date:
-        conditions.append("created_at <= ?")
-        params.append(end_date)
-    
-    # 添加标签过滤
-    if tags and len(tags) > 0:
-        tag_conditions = []
-        for tag in tags:
-            tag_conditions.append("tags LIKE ?")
-            params.append(f'%"{tag}"%')
-        conditions.append("(" + " OR ".join(tag_conditions) + ")")
+    """基本文本搜索（不使用向量）匹配标题、描述和标签，标题权重最高"""
+    return _text_search(query, {"title": 3.0, "description": 2.0, "tags": 1.0}, limit, start_date, end_date, tags)
+
+def get_filtered_uuids(start_date: Optional[str] = None,
+                       end_date: Optional[str] = None,
+                       tags: Optional[List[str]] = None) -> Union[List[str], vector_db.PostFilter, None]:
+    """查询满足时间和标签过滤条件的图片UUID，用于向量检索时的ID过滤
     
-    query_sql = f"""
-    SELECT *,
-           (CASE 
-             WHEN title LIKE ? THEN 3
-             WHEN description LIKE ? THEN 2
-             ELSE 0
-           END) as relevance
-    FROM images
-    WHERE {" AND ".join(conditions)}
-    ORDER BY relevance DESC
-    LIMIT ?
+    没有任何过滤条件时返回None，表示不限制检索范围。
+    先在SQL中统计匹配数，匹配的图片不少于POST_FILTER_MIN_RATIO时不读取UUID，
+    返回PostFilter，由向量检索多取候选后只对候选UUID查询过滤条件
     """
+    if not start_date and not end_date and not tags:
+        return None
     
-    # 添加相关性计算参数
-    params.extend([search_term, search_term, limit])
-    
-    cursor.execute(query_sql, params)
-    results = cursor.fetchall()
-    
-    # 处理JSON字段并计算分数
-    for result in results:
-        if result['tags']:
-            try:
-                result['tags'] = json.loads(result['tags'])
-            except:
-                result['tags'] = []
-        else:
-            result['tags'] = []
+    with db_connection() as conn:
+        cursor = conn.cursor()
         
-        # 计算标准化分数
-        result['score'] = min(result['relevance'] / 3.0, 1.0)
-    
-    conn.close()
-    return results
+        conditions = []
+        params = []
+        
+        # 添加时间过滤
+        if start_date:
+            conditions.append("created_at >= ?")
+            params.append(start_date)
+        
+        if end_date:
+            conditions.append("created_at <= ?")
+            params.append(end_date)
+        
+        # 添加标签过滤
+        if tags and len(tags) > 0:
+            conditions.append(_tag_condition(tags, params))
+        
+        where = ' AND '.join(conditions)
+        
+        cursor.execute(f"SELECT COUNT(*) FROM images WHERE {where}", params)
+        matched = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM images")
+        total = cursor.fetchone()[0]
+        if total and matched >= total * vector_db.POST_FILTER_MIN_RATIO:
+            def match(uuids: List[str]) -> List[str]:
+                matched_uuids = []
+                with db_connection() as conn:
+                    # 分批查询，避免超过SQLite的参数个数上限
+                    for start in range(0, len(uuids), 500):
+                        chunk = uuids[start:start + 500]
+                        placeholders = ", ".join(["?"] * len(chunk))
+                        rows = conn.execute(f"SELECT uuid FROM images WHERE uuid IN ({placeholders}) AND {where}",
+                                            chunk + params).fetchall()
+                        matched_uuids.extend(row[0] for row in rows)
+                return matched_uuids
+            return vector_db.PostFilter(match, matched / total)
+        
+        cursor.execute(f"SELECT uuid FROM images WHERE {where}", params)
+        uuids = [row[0] for row in cursor.fetchall()]
+        
+    return uuids
 
 def vector_text_search(query: str, 
                       limit: int = 20,
@@ -722,8 +938,9 @@ def vector_text_search(query: str,
                       end_date: Optional[str] = None,
                       tags: Optional[List[str]] = None) -> List[Dict[str, Any]]:
     """基于向量的文本搜索"""
-    # 使用FAISS进行向量搜索 - 使用新的搜索方式，分别搜索标题和描述
-    vector_results = vector_db.search_by_text(query, limit * 2)  # 获取2倍数量的结果以便应用过滤
+    # 使用FAISS进行向量搜索 - 分别搜索标题和描述，只在满足过滤条件的图片中检索
+    allowed_uuids = get_filtered_uuids(start_date, end_date, tags)
+    vector_results = vector_db.search_by_text(query, limit, allowed_uuids)
     
     if not vector_results:
         return []  # 如果没有向量搜索结果，直接返回空列表
@@ -732,59 +949,38 @@ def vector_text_search(query: str,
     uuids = [result['uuid'] for result in vector_results]
     uuid_to_score = {result['uuid']: result['similarity'] for result in vector_results}
     
-    # 从数据库查询详细信息并应用过滤
-    conn = get_db_connection()
-    conn.row_factory = dict_factory
-    cursor = conn.cursor()
-    
-    placeholders = ", ".join(["?"] * len(uuids))
-    conditions = [f"uuid IN ({placeholders})"]
-    params = uuids.copy()
-    
-    # 添加时间过滤
-    if start_date:
-        conditions.append("created_at >= ?")
-        params.append(start_date)
-    
-    if end_date:
-        conditions.append("created_at <= ?")
-        params.append(end_date)
-    
-    # 添加标签过滤
-    if tags and len(tags) > 0:
-        tag_conditions = []
-        for tag in tags:
-            tag_conditions.append("tags LIKE ?")
-            params.append(f'%"{tag}"%')
-        conditions.append("(" + " OR ".join(tag_conditions) + ")")
-    
-    query_sql = f"SELECT * FROM images WHERE {' AND '.join(conditions)}"
-    
-    cursor.execute(query_sql, params)
-    images = cursor.fetchall()
-    
-    # 处理JSON字段，添加分数，并保持向量搜索排序
-    results = []
-    for image in images:
-        if image['tags']:
-            try:
-                image['tags'] = json.loads(image['tags'])
-            except:
+    # 从数据库查询详细信息（过滤条件已在向量检索中生效）
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = dict_factory
+        
+        placeholders = ", ".join(["?"] * len(uuids))
+        query_sql = f"SELECT * FROM images WHERE uuid IN ({placeholders})"
+        
+        cursor.execute(query_sql, uuids)
+        images = cursor.fetchall()
+        
+        # 处理JSON字段，添加分数，并保持向量搜索排序
+        results = []
+        for image in images:
+            if image['tags']:
+                try:
+                    image['tags'] = json.loads(image['tags'])
+                except:
+                    image['tags'] = []
+            else:
                 image['tags'] = []
-        else:
-            image['tags'] = []
+            
+            # 添加向量相似度分数
+            image['score'] = uuid_to_score.get(image['uuid'], 0.0)
+            results.append(image)
+        
+        # 按相似度分数排序
+        results.sort(key=lambda x: x['score'], reverse=True)
+        
+        # 限制结果数量
+        results = results[:limit]
         
-        # 添加向量相似度分数
-        image['score'] = uuid_to_score.get(image['uuid'], 0.0)
-        results.append(image)
-    
-    # 按相似度分数排序
-    results.sort(key=lambda x: x['score'], reverse=True)
-    
-    # 限制结果数量
-    results = results[:limit]
-    
-    conn.close()
     return results
 
 def hybrid_text_search(query: str, 
@@ -797,27 +993,13 @@ def hybrid_text_search(query: str,
     text_results = simple_text_search(query, limit * 2, start_date, end_date, tags)
     text_uuids = set(result['uuid'] for result in text_results)
     
-    # 获取向量搜索结果 - 标题和描述分开搜索
-    title_vector_results = vector_db.search_by_title(query, limit * 2)
-    desc_vector_results = vector_db.search_by_description(query, limit * 2)
-    
-    # 合并向量结果
-    vector_results = []
-    uuid_to_vector_score = {}
-    
-    for result in title_vector_results:
-        uuid = result['uuid']
-        uuid_to_vector_score[uuid] = result['similarity'] * 0.7  # 标题权重较高
-        
-    for result in desc_vector_results:
-        uuid = result['uuid']
-        if uuid in uuid_to_vector_score:
-            uuid_to_vector_score[uuid] += result['similarity'] * 0.3  # 描述权重较低
-        else:
-            uuid_to_vector_score[uuid] = result['similarity'] * 0.3
-    
-    for uuid, score in uuid_to_vector_score.items():
-        vector_results.append({'uuid': uuid, 'score': score})
+    # 获取向量搜索结果 - 查询只编码一次，标题和描述索引批量检索后按0.7/0.3加权合并，
+    # 只在满足过滤条件的图片中检索
+    allowed_uuids = get_filtered_uuids(start_date, end_date, tags)
+    vector_results = [
+        {'uuid': result['uuid'], 'score': result['similarity']}
+        for result in vector_db.search_by_text(query, limit * 2, allowed_uuids)
+    ]
         
     vector_uuids = set(result['uuid'] for result in vector_results)
     
@@ -839,44 +1021,43 @@ def hybrid_text_search(query: str,
         return []  # 如果没有结果，直接返回空列表
     
     # 从数据库查询详细信息
-    conn = get_db_connection()
-    conn.row_factory = dict_factory
-    cursor = conn.cursor()
-    
-    placeholders = ", ".join(["?"] * len(all_uuids))
-    query_sql = f"SELECT * FROM images WHERE uuid IN ({placeholders})"
-    
-    cursor.execute(query_sql, all_uuids)
-    images = cursor.fetchall()
-    
-    # 处理JSON字段，计算混合分数
-    results = []
-    for image in images:
-        if image['uuid'] not in uuid_to_score:
-            continue
-            
-        if image['tags']:
-            try:
-                image['tags'] = json.loads(image['tags'])
-            except:
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = dict_factory
+        
+        placeholders = ", ".join(["?"] * len(all_uuids))
+        query_sql = f"SELECT * FROM images WHERE uuid IN ({placeholders})"
+        
+        cursor.execute(query_sql, all_uuids)
+        images = cursor.fetchall()
+        
+        # 处理JSON字段，计算混合分数
+        results = []
+        for image in images:
+            if image['uuid'] not in uuid_to_score:
+                continue
+                
+            if image['tags']:
+                try:
+                    image['tags'] = json.loads(image['tags'])
+                except:
+                    image['tags'] = []
+            else:
                 image['tags'] = []
-        else:
-            image['tags'] = []
+            
+            # 计算混合分数：文本相关性 * 0.4 + 向量相似度 * 0.6
+            image['score'] = (
+                uuid_to_score[image['uuid']]['text'] * 0.4 +
+                uuid_to_score[image['uuid']]['vector'] * 0.6
+            )
+            results.append(image)
+        
+        # 按混合分数排序
+        results.sort(key=lambda x: x['score'], reverse=True)
+        
+        # 限制结果数量
+        results = results[:limit]
         
-        # 计算混合分数：文本相关性 * 0.4 + 向量相似度 * 0.6
-        image['score'] = (
-            uuid_to_score[image['uuid']]['text'] * 0.4 +
-            uuid_to_score[image['uuid']]['vector'] * 0.6
-        )
-        results.append(image)
-    
-    # 按混合分数排序
-    results.sort(key=lambda x: x['score'], reverse=True)
-    
-    # 限制结果数量
-    results = results[:limit]
-    
-    conn.close()
     return results
 
 def search_by_image_path(image_path: str,
@@ -885,69 +1066,49 @@ def search_by_image_path(image_path: str,
                          end_date: Optional[str] = None,
                          tags: Optional[List[str]] = None) -> List[Dict[str, Any]]:
     """通过图片路径搜索相似图片"""
-    # 使用FAISS进行向量搜索
-    vector_results = vector_search_by_image(image_path, limit * 2)  # 获取2倍数量的结果以便应用过滤
+    # 使用FAISS进行向量搜索，只在满足过滤条件的图片中检索
+    allowed_uuids = get_filtered_uuids(start_date, end_date, tags)
+    vector_results = vector_search_by_image(image_path, limit, allowed_uuids)
     
     if not vector_results:
         return []  # 如果没有向量搜索结果，直接返回空列表
     
-    # 提取结果中的UUID
+    # 提取结果中的UUID，vector_db中返回的是similarity字段
     uuids = [result['uuid'] for result in vector_results]
-    uuid_to_score = {result['uuid']: result['score'] for result in vector_results}
-    
-    # 从数据库查询详细信息并应用过滤
-    conn = get_db_connection()
-    conn.row_factory = dict_factory
-    cursor = conn.cursor()
-    
-    placeholders = ", ".join(["?"] * len(uuids))
-    conditions = [f"uuid IN ({placeholders})"]
-    params = uuids.copy()
-    
-    # 添加时间过滤
-    if start_date:
-        conditions.append("created_at >= ?")
-        params.append(start_date)
-    
-    if end_date:
-        conditions.append("created_at <= ?")
-        params.append(end_date)
-    
-    # 添加标签过滤
-    if tags and len(tags) > 0:
-        tag_conditions = []
-        for tag in tags:
-            tag_conditions.append("tags LIKE ?")
-            params.append(f'%"{tag}"%')
-        conditions.append("(" + " OR ".join(tag_conditions) + ")")
-    
-    query_sql = f"SELECT * FROM images WHERE {' AND '.join(conditions)}"
-    
-    cursor.execute(query_sql, params)
-    images = cursor.fetchall()
+    uuid_to_score = {result['uuid']: result['similarity'] for result in vector_results}
     
-    # 处理JSON字段，添加分数，并保持向量搜索排序
-    results = []
-    for image in images:
-        if image['tags']:
-            try:
-                image['tags'] = json.loads(image['tags'])
-            except:
+    # 从数据库查询详细信息（过滤条件已在向量检索中生效）
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = dict_factory
+        
+        placeholders = ", ".join(["?"] * len(uuids))
+        query_sql = f"SELECT * FROM images WHERE uuid IN ({placeholders})"
+        
+        cursor.execute(query_sql, uuids)
+        images = cursor.fetchall()
+        
+        # 处理JSON字段，添加分数，并保持向量搜索排序
+        results = []
+        for image in images:
+            if image['tags']:
+                try:
+                    image['tags'] = json.loads(image['tags'])
+                except:
+                    image['tags'] = []
+            else:
                 image['tags'] = []
-        else:
-            image['tags'] = []
+            
+            # 添加向量相似度分数
+            image['score'] = uuid_to_score.get(image['uuid'], 0.0)
+            results.append(image)
+        
+        # 按相似度分数排序
+        results.sort(key=lambda x: x['score'], reverse=True)
+        
+        # 限制结果数量
+        results = results[:limit]
         
-        # 添加向量相似度分数
-        image['score'] = uuid_to_score.get(image['uuid'], 0.0)
-        results.append(image)
-    
-    # 按相似度分数排序
-    results.sort(key=lambda x: x['score'], reverse=True)
-    
-    # 限制结果数量
-    results = results[:limit]
-    
-    conn.close()
     return results
 
 def search_similar_to_uuid(uuid: str,
@@ -966,8 +1127,9 @@ def search_similar_to_uuid(uuid: str,
         tags: 标签过滤列表
         search_type: 搜索类型，可用值："image", "title", "description", "combined"
     """
-    # 使用FAISS进行向量搜索
-    vector_results = vector_search_by_uuid(uuid, limit * 2, search_type)  # 获取2倍数量的结果以便应用过滤
+    # 使用FAISS进行向量搜索，只在满足过滤条件的图片中检索
+    allowed_uuids = get_filtered_uuids(start_date, end_date, tags)
+    vector_results = vector_search_by_uuid(uuid, limit, search_type, allowed_uuids)
     
     if not vector_results:
         return []  # 如果没有向量搜索结果，直接返回空列表
@@ -976,69 +1138,48 @@ def search_similar_to_uuid(uuid: str,
     uuids = [result['uuid'] for result in vector_results]
     uuid_to_score = {result['uuid']: result['similarity'] for result in vector_results}
     
-    # 从数据库查询详细信息并应用过滤
-    conn = get_db_connection()
-    conn.row_factory = dict_factory
-    cursor = conn.cursor()
-    
-    placeholders = ", ".join(["?"] * len(uuids))
-    conditions = [f"uuid IN ({placeholders})"]
-    params = uuids.copy()
-    
-    # 添加时间过滤
-    if start_date:
-        conditions.append("created_at >= ?")
-        params.append(start_date)
-    
-    if end_date:
-        conditions.append("created_at <= ?")
-        params.append(end_date)
-    
-    # 添加标签过滤
-    if tags and len(tags) > 0:
-        tag_conditions = []
-        for tag in tags:
-            tag_conditions.append("tags LIKE ?")
-            params.append(f'%"{tag}"%')
-        conditions.append("(" + " OR ".join(tag_conditions) + ")")
-    
-    query_sql = f"SELECT * FROM images WHERE {' AND '.join(conditions)}"
-    
-    cursor.execute(query_sql, params)
-    images = cursor.fetchall()
-    
-    # 处理JSON字段，添加分数，并保持向量搜索排序
-    results = []
-    for image in images:
-        if image['uuid'] == uuid:
-            continue  # 跳过原始图片
-            
-        if image['tags']:
-            try:
-                image['tags'] = json.loads(image['tags'])
-            except:
+    # 从数据库查询详细信息（过滤条件已在向量检索中生效）
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = dict_factory
+        
+        placeholders = ", ".join(["?"] * len(uuids))
+        query_sql = f"SELECT * FROM images WHERE uuid IN ({placeholders})"
+        
+        cursor.execute(query_sql, uuids)
+        images = cursor.fetchall()
+        
+        # 处理JSON字段，添加分数，并保持向量搜索排序
+        results = []
+        for image in images:
+            if image['uuid'] == uuid:
+                continue  # 跳过原始图片
+                
+            if image['tags']:
+                try:
+                    image['tags'] = json.loads(image['tags'])
+                except:
+                    image['tags'] = []
+            else:
                 image['tags'] = []
-        else:
-            image['tags'] = []
-        
-        # 添加向量相似度分数
-        image['score'] = uuid_to_score.get(image['uuid'], 0.0)
-        
-        # 添加格式化的输出字段，与前端期望的结构保持一致
-        results.append({
-            "uuid": image['uuid'],
-            "title": image['title'],
-            "description": image.get('description', ''),
-            "filepath": image['filepath'],
-            "score": float(image['score']),
-            "tags": image['tags']
-        })
-    
-    # 按相似度分数排序
-    results.sort(key=lambda x: x['score'], reverse=True)
-    
-    # 限制结果数量
-    results = results[:limit]
-    
-    conn.close()
+            
+            # 添加向量相似度分数
+            image['score'] = uuid_to_score.get(image['uuid'], 0.0)
+            
+            # 添加格式化的输出字段，与前端期望的结构保持一致
+            results.append({
+                "uuid": image['uuid'],
+                "title": image['title'],
+                "description": image.get('description', ''),
+                "filepath": image['filepath'],
+                "score": float(image['score']),
+                "tags": image['tags']
+            })
+        
+        # 按相似度分数排序
+        results.sort(key=lambda x: x['score'], reverse=True)
+        
+        # 限制结果数量
+        results = results[:limit]
+        
     return results
\ No newline at end of file
@@ -0,0 +1,310 @@
+"""独立的嵌入服务进程
+
+启动方式: python -m backend.embedding_service
+
+服务进程监听EMBEDDING_SERVICE_ADDRESS，启动EMBEDDING_SERVICE_WORKERS个工作进程，
+每个工作进程各自加载一份模型。API进程（配置了EMBEDDING_SERVICE_ADDRESS时）不再加载模型，
+而是把编码请求发给服务；向量写入共享内存，只通过连接传回共享内存块的名字和形状，
+这样N个uvicorn工作进程共享M份模型副本
+
+连接上只传输JSON消息头和原始字节（图片文件内容），不使用pickle，图片在工作进程中解码。
+必须设置EMBEDDING_SERVICE_AUTHKEY，服务和客户端都拒绝使用空密钥或旧的默认密钥
+"""
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from PIL import Image
+
+from .config import settings
+
+# 不安全的认证密钥：未设置，或早期版本公开的默认值
+INSECURE_AUTHKEYS = ("", "smartimagefinder")
+# 检查工作进程是否存活的间隔（秒）
+WORKER_CHECK_INTERVAL = 1.0
+
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    """解析服务地址，"host:port"为TCP地址，否则视为Unix套接字路径"""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return (host or "127.0.0.1", int(port))
+    return address
+
+
+def _authkey() -> bytes:
+    """返回连接认证密钥，未设置或使用旧的默认值时抛出RuntimeError"""
+    key = settings.EMBEDDING_SERVICE_AUTHKEY
+    if key in INSECURE_AUTHKEYS:
+        raise RuntimeError("请先在配置中把EMBEDDING_SERVICE_AUTHKEY设置为随机字符串，嵌入服务拒绝使用空密钥或默认密钥")
+    return key.encode("utf-8")
+
+
+def _send(conn, header: Dict[str, Any], blobs: List[bytes] = ()):
+    """发送一条消息：JSON消息头，之后是消息头中blobs个原始字节块"""
+    conn.send_bytes(json.dumps({**header, "blobs": len(blobs)}, ensure_ascii=False).encode("utf-8"))
+    for blob in blobs:
+        conn.send_bytes(blob)
+
+
+def _recv(conn) -> Tuple[Dict[str, Any], List[bytes]]:
+    """接收一条_send发送的消息，返回(消息头, 字节块列表)"""
+    header = json.loads(conn.recv_bytes())
+    return header, [conn.recv_bytes() for _ in range(header.get("blobs", 0))]
+
+
+def _pack_images(items: List[Any]) -> Tuple[List[Dict[str, Any]], List[bytes]]:
+    """把图像输入转换为可传输的形式：路径原样发送，内存中的图像发送文件内容
+    
+    从文件打开的图像发送文件路径（服务与API进程在同一台机器上，共享内存也要求如此），
+    上传时从内存打开、未经修改的图像直接发送原始文件内容；其他图像无损保存为PNG
+    """
+    packed, blobs = [], []
+    for item in items:
+        if isinstance(item, str):
+            packed.append({"path": item})
+            continue
+        filename = getattr(item, "filename", "")
+        if filename and os.path.exists(filename):
+            packed.append({"path": filename})
+            continue
+        fp = getattr(item, "fp", None)
+        if fp is not None and hasattr(fp, "getvalue"):
+            blob = fp.getvalue()
+        else:
+            buffer = io.BytesIO()
+            item.save(buffer, format="PNG")
+            blob = buffer.getvalue()
+        packed.append({"blob": len(blobs)})
+        blobs.append(blob)
+    return packed, blobs
+
+
+def _unpack_images(packed: List[Dict[str, Any]], blobs: List[bytes]) -> List[Union[str, bytes]]:
+    """_pack_images的逆过程，图像内容保持为字节，由工作进程解码"""
+    return [item["path"] if "path" in item else blobs[item["blob"]] for item in packed]
+
+
+class EmbeddingServiceClient:
+    """嵌入服务客户端，每个线程使用独立的连接"""
+
+    def __init__(self, address: str):
+        self.address = parse_address(address)
+        self.local = threading.local()
+
+    def _request(self, header: Dict[str, Any], blobs: List[bytes] = ()) -> Dict[str, Any]:
+        """发送请求并等待回复，连接断开（如服务重启）时重连一次"""
+        for attempt in range(2):
+            conn = getattr(self.local, "conn", None)
+            try:
+                if conn is None:
+                    conn = self.local.conn = Client(self.address, authkey=_authkey())
+                _send(conn, header, blobs)
+                return _recv(conn)[0]
+            except (EOFError, OSError):
+                self.local.conn = None
+                if attempt == 1:
+                    raise
+
+    def ping(self) -> Dict[str, Any]:
+        """检查服务是否可用，返回服务信息"""
+        reply = self._request({"op": "ping"})
+        if reply["status"] != "ok":
+            raise RuntimeError(reply["error"])
+        return reply["info"]
+
+    def encode(self, kind: str, items: List[Any]) -> np.ndarray:
+        """批量编码文本或图像，返回 [n, dim] 的向量矩阵"""
+        blobs = []
+        if kind == "image":
+            items, blobs = _pack_images(items)
+        reply = self._request({"op": "encode", "kind": kind, "items": items}, blobs)
+        if reply["status"] != "ok":
+            raise RuntimeError(f"嵌入服务编码失败: {reply['error']}")
+
+        # 从共享内存复制结果后释放共享内存块
+        name, shape = reply["name"], tuple(reply["shape"])
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            return np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+
+
+_client: Optional[EmbeddingServiceClient] = None
+
+
+def get_client() -> EmbeddingServiceClient:
+    """返回全局的嵌入服务客户端"""
+    global _client
+    if _client is None:
+        _client = EmbeddingServiceClient(settings.EMBEDDING_SERVICE_ADDRESS)
+    return _client
+
+
+def _release_shm(name: str):
+    """释放无人读取的共享内存块"""
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def _worker_main(task_queue, result_queue):
+    """工作进程：按EMBEDDING_BACKEND加载推理后端，循环执行编码任务，结果写入共享内存"""
+    from .generate_vector import get_encoder
+    encoder = get_encoder()
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        request_id, kind, items = task
+        try:
+            if kind == "image":
+                # 图像内容在工作进程中解码，路径原样交给推理后端
+                items = [Image.open(io.BytesIO(item)) if isinstance(item, bytes) else item for item in items]
+            embeddings = np.ascontiguousarray(encoder.encode(kind, items), dtype=np.float32)
+            shm = shared_memory.SharedMemory(create=True, size=max(embeddings.nbytes, 1))
+            np.ndarray(embeddings.shape, dtype=np.float32, buffer=shm.buf)[...] = embeddings
+            # 共享内存由客户端读取后释放，本进程退出时不应回收
+            resource_tracker.unregister(shm._name, "shared_memory")
+            shm.close()
+            result_queue.put((request_id, shm.name, embeddings.shape, None))
+        except Exception as e:
+            result_queue.put((request_id, None, None, str(e)))
+
+
+class EmbeddingService:
+    """嵌入服务：接收客户端连接，把编码任务分发给工作进程
+    
+    工作进程异常退出（如解码畸形图片时崩溃或被OOM终止）时，所有等待中的请求立即返回错误，
+    并启动新的工作进程替换；每个请求最多等待EMBEDDING_SERVICE_TIMEOUT秒
+    """
+
+    def __init__(self, address: str, workers: int):
+        self.address = parse_address(address)
+        self.ctx = multiprocessing.get_context("spawn")
+        self.task_queue = self.ctx.Queue()
+        self.result_queue = self.ctx.Queue()
+        self.workers = [self._new_worker() for _ in range(max(1, workers))]
+        self.request_ids = itertools.count()
+        self.pending: Dict[int, "queue.Queue"] = {}
+        self.lock = threading.Lock()
+
+    def _new_worker(self):
+        return self.ctx.Process(target=_worker_main, args=(self.task_queue, self.result_queue), daemon=True)
+
+    def serve_forever(self):
+        for worker in self.workers:
+            worker.start()
+        threading.Thread(target=self._dispatch_results, name="embedding-results", daemon=True).start()
+        threading.Thread(target=self._monitor_workers, name="embedding-monitor", daemon=True).start()
+
+        with Listener(self.address, authkey=_authkey()) as listener:
+            if isinstance(self.address, str):
+                # Unix套接字只允许本用户连接
+                os.chmod(self.address, 0o600)
+            print(f"嵌入服务已启动: {self.address}，工作进程数: {len(self.workers)}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    print(f"接受嵌入服务连接失败: {e}")
+                    continue
+                threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+
+    def _dispatch_results(self):
+        """把工作进程返回的结果转交给等待中的连接线程"""
+        while True:
+            request_id, *result = self.result_queue.get()
+            with self.lock:
+                waiter = self.pending.pop(request_id, None)
+            if waiter is not None:
+                waiter.put(result)
+            elif result[0]:
+                # 请求已超时或已因工作进程退出而失败，释放无人读取的结果
+                _release_shm(result[0])
+
+    def _monitor_workers(self):
+        """定期检查工作进程，发现退出的进程时让所有等待中的请求失败，并启动新进程替换"""
+        while True:
+            time.sleep(WORKER_CHECK_INTERVAL)
+            for i, worker in enumerate(self.workers):
+                if worker.is_alive():
+                    continue
+                print(f"嵌入服务工作进程{worker.pid}已退出（退出码{worker.exitcode}），重新启动")
+                # 任务队列是共享的，无法确定退出的进程正在处理哪个请求，等待中的请求全部失败
+                with self.lock:
+                    waiters = list(self.pending.values())
+                    self.pending.clear()
+                for waiter in waiters:
+                    waiter.put((None, None, "嵌入服务工作进程异常退出"))
+                self.workers[i] = self._new_worker()
+                self.workers[i].start()
+
+    def _handle_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    header, blobs = _recv(conn)
+                except (EOFError, OSError, ValueError):
+                    # 连接断开或消息格式错误
+                    return
+
+                op = header.get("op")
+                if op == "ping":
+                    _send(conn, {"status": "ok", "info": {"workers": len(self.workers), "model": settings.MODEL_PATH, "backend": settings.EMBEDDING_BACKEND}})
+                    continue
+                if op != "encode" or header.get("kind") not in ("text", "image"):
+                    _send(conn, {"status": "error", "error": f"未知的请求: {op}"})
+                    continue
+
+                kind, items = header["kind"], header["items"]
+                if kind == "image":
+                    items = _unpack_images(items, blobs)
+                request_id = next(self.request_ids)
+                waiter = queue.Queue(maxsize=1)
+                with self.lock:
+                    self.pending[request_id] = waiter
+                self.task_queue.put((request_id, kind, items))
+
+                try:
+                    name, shape, error = waiter.get(timeout=settings.EMBEDDING_SERVICE_TIMEOUT)
+                except queue.Empty:
+                    with self.lock:
+                        timed_out = self.pending.pop(request_id, None) is not None
+                    if timed_out:
+                        name, shape, error = None, None, f"编码超过{settings.EMBEDDING_SERVICE_TIMEOUT}秒未完成"
+                    else:
+                        # 结果恰好在超时时送达
+                        name, shape, error = waiter.get()
+                try:
+                    _send(conn, {"status": "error", "error": error} if error else {"status": "ok", "name": name, "shape": list(shape)})
+                except (EOFError, OSError):
+                    # 客户端已断开，释放无人读取的共享内存
+                    if name:
+                        _release_shm(name)
+                    return
+
+
+if __name__ == "__main__":
+    if not settings.EMBEDDING_SERVICE_ADDRESS:
+        raise SystemExit("请先在配置中设置EMBEDDING_SERVICE_ADDRESS")
+    if settings.EMBEDDING_SERVICE_AUTHKEY in INSECURE_AUTHKEYS:
+        raise SystemExit("请先在配置中把EMBEDDING_SERVICE_AUTHKEY设置为随机字符串，嵌入服务拒绝使用空密钥或默认密钥")
+    EmbeddingService(settings.EMBEDDING_SERVICE_ADDRESS, settings.EMBEDDING_SERVICE_WORKERS).serve_forever()
@@ -1,14 +1,23 @@
 from sentence_transformers import SentenceTransformer
 from PIL import Image
 import numpy as np
-from typing import List, Union, Dict, Any
+from typing import List, Union, Dict, Any, Optional, Callable
 import os
 import diskcache
 import hashlib
+import asyncio
+import functools
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from .config import settings  # 导入配置
 
 # 全局变量，用于保存加载的模型
 model = None
+# 推理线程池中的并发请求可能同时触发首次加载，加载时持有该锁，保证只加载一份
+_model_lock = threading.Lock()
 
 def get_text_cache_key(text: Union[str, List[str]]) -> str:
     """生成文本的缓存键"""
@@ -20,47 +29,77 @@ def get_text_cache_key(text: Union[str, List[str]]) -> str:
         # 对于单个文本字符串
         return hashlib.md5(text.encode('utf-8')).hexdigest()
 
-def get_image_cache_key(image_input: Union[Image.Image, List[Image.Image], str, List[str]]) -> str:
-    """生成图像的缓存键"""
+# 流式计算文件哈希时每次读取的字节数
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def new_content_hasher():
+    """返回图片内容哈希对象，上传时边写入边更新，结果即images.hash_value和图像缓存键"""
+    return hashlib.blake2b(digest_size=16)
+
+def hash_bytes(data: bytes) -> str:
+    """计算内存中图片文件内容的哈希"""
+    hasher = new_content_hasher()
+    hasher.update(data)
+    return hasher.hexdigest()
+
+def hash_file(path: str) -> str:
+    """分块流式计算图片文件内容的哈希，不一次读入整个文件"""
+    hasher = new_content_hasher()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def get_image_cache_key(image_input: Union[Image.Image, List[Image.Image], str, List[str]]) -> Optional[str]:
+    """生成图像的缓存键，基于文件内容哈希，从不解码像素
+    
+    只有路径输入才读取文件计算哈希。PIL图像一律返回None：在内存中转换、缩放或裁剪过的图像
+    仍保留来源文件名，用文件哈希作为键会命中未修改图像的向量。需要缓存PIL图像时，
+    由调用方通过encode_image的cache_key参数传入文件或上传内容的哈希，否则不使用缓存
+    """
     if isinstance(image_input, str):
         # 对于图像路径，使用文件内容的哈希
         if os.path.exists(image_input):
-            with open(image_input, 'rb') as f:
-                return hashlib.md5(f.read()).hexdigest()
+            return hash_file(image_input)
         else:
             raise FileNotFoundError(f"图像文件不存在: {image_input}")
     
     elif isinstance(image_input, Image.Image):
-        # 对于PIL图像对象，转换为字节再生成哈希
-        img_bytes = np.array(image_input).tobytes()
-        return hashlib.md5(img_bytes).hexdigest()
+        return None
     
     elif isinstance(image_input, list):
         # 对于列表，递归处理每个元素并组合哈希
-        combined = ""
-        for item in image_input:
-            combined += get_image_cache_key(item)
-        return hashlib.md5(combined.encode('utf-8')).hexdigest()
+        keys = [get_image_cache_key(item) for item in image_input]
+        if any(key is None for key in keys):
+            return None
+        return hashlib.md5("".join(keys).encode('utf-8')).hexdigest()
     
     else:
         raise TypeError(f"不支持的图像输入类型: {type(image_input)}")
 
+def _load_sentence_transformer() -> SentenceTransformer:
+    """从MODEL_PATH新加载一份SentenceTransformer模型"""
+    print(f"正在加载模型: {settings.MODEL_PATH}")
+    try:
+        st_model = SentenceTransformer(
+            settings.MODEL_PATH,
+            trust_remote_code=True,  # 信任远程代码
+        )
+        print("模型加载成功。")
+        return st_model
+    except Exception as e:
+        print(f"加载模型时出错: {e}")
+        # 适当处理错误，可能抛出异常或退出
+        raise
+
 def load_model():
     """加载设置中指定的SentenceTransformer模型"""
     global model
         
     if model is None:
-        print(f"正在加载模型: {settings.MODEL_PATH}")
-        try:
-            model = SentenceTransformer(
-                settings.MODEL_PATH,
-                trust_remote_code=True,  # 信任远程代码
-            )
-            print("模型加载成功。")
-        except Exception as e:
-            print(f"加载模型时出错: {e}")
-            # 适当处理错误，可能抛出异常或退出
-            raise
+        with _model_lock:
+            if model is None:
+                model = _load_sentence_transformer()
 
 def get_model() -> SentenceTransformer:
     """返回加载的模型实例，如果需要就加载模型"""
@@ -71,6 +110,413 @@ def get_model() -> SentenceTransformer:
         raise RuntimeError("模型无法加载。")
     return model
 
+class TorchEncoder:
+    """PyTorch全精度推理后端，直接使用SentenceTransformer"""
+    name = "torch"
+    
+    def __init__(self, st_model: Optional[SentenceTransformer] = None):
+        self.model = st_model if st_model is not None else get_model()
+    
+    def encode(self, kind: str, inputs):
+        """编码文本或图像，单个输入返回一维向量，列表输入返回 [n, dim] 矩阵，均已归一化"""
+        return self.model.encode(inputs, normalize_embeddings=True)
+
+class TorchInt8Encoder(TorchEncoder):
+    """PyTorch动态int8量化推理后端，线性层权重量化为int8，激活在运行时量化"""
+    name = "torch_int8"
+    
+    def __init__(self):
+        import torch
+        print("正在对模型做动态int8量化")
+        # 全局fp32模型未加载时单独加载一份并原地量化，不保留fp32模型，常驻内存的只有int8模型；
+        # 已被torch后端加载时（如compare_backends）量化其副本，不影响原模型
+        shared = model is not None
+        st_model = model if shared else _load_sentence_transformer()
+        super().__init__(torch.quantization.quantize_dynamic(st_model, {torch.nn.Linear}, dtype=torch.qint8, inplace=not shared))
+
+class OnnxEncoder:
+    """ONNX Runtime推理后端，分别运行导出的文本塔和视觉塔
+    
+    导出文件不存在时先调用export_onnx()从MODEL_PATH导出
+    """
+    name = "onnx"
+    
+    def __init__(self, export_dir: Optional[str] = None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer, AutoImageProcessor
+        
+        export_dir = export_dir or settings.ONNX_MODEL_DIR
+        paths = onnx_paths(export_dir)
+        if not all(os.path.exists(path) for path in paths.values()):
+            export_onnx(export_dir)
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(settings.MODEL_PATH, trust_remote_code=True)
+        self.processor = AutoImageProcessor.from_pretrained(settings.MODEL_PATH, trust_remote_code=True)
+        self.sessions = {
+            kind: ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+            for kind, path in paths.items()
+        }
+        print(f"ONNX模型加载成功: {export_dir}")
+    
+    def encode(self, kind: str, inputs):
+        """编码文本或图像，单个输入返回一维向量，列表输入返回 [n, dim] 矩阵，均已归一化"""
+        single = not isinstance(inputs, list)
+        items = [inputs] if single else inputs
+        session = self.sessions[kind]
+        
+        if kind == "text":
+            features = self.tokenizer(items, padding=True, truncation=True, return_tensors="np")
+            features = {name: value.astype(np.int64) for name, value in features.items()}
+        else:
+            images = [Image.open(item) if isinstance(item, str) else item for item in items]
+            pixels = self.processor(images=[image.convert("RGB") for image in images], return_tensors="np")["pixel_values"]
+            features = {"pixel_values": pixels.astype(np.float32)}
+        
+        # 只传入导出时声明的输入（例如部分文本塔不接收attention_mask）
+        feeds = {i.name: features[i.name] for i in session.get_inputs()}
+        embeddings = session.run(None, feeds)[0]
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings[0] if single else embeddings
+
+ENCODER_BACKENDS = {
+    TorchEncoder.name: TorchEncoder,
+    TorchInt8Encoder.name: TorchInt8Encoder,
+    OnnxEncoder.name: OnnxEncoder,
+}
+
+encoder = None
+# 保证并发的首次请求只创建一个推理后端（只加载、量化一次模型）
+_encoder_lock = threading.Lock()
+
+def get_encoder():
+    """返回配置的推理后端（EMBEDDING_BACKEND），首次调用时创建，未知或加载失败的后端回退到torch"""
+    global encoder
+    if encoder is not None:
+        return encoder
+    with _encoder_lock:
+        if encoder is not None:
+            return encoder
+        backend = settings.EMBEDDING_BACKEND
+        if backend not in ENCODER_BACKENDS:
+            print(f"未知的推理后端: {backend}，使用torch")
+            backend = TorchEncoder.name
+        try:
+            encoder = ENCODER_BACKENDS[backend]()
+        except Exception as e:
+            if backend == TorchEncoder.name:
+                raise
+            print(f"加载推理后端{backend}失败，使用torch: {e}")
+            encoder = TorchEncoder()
+    return encoder
+
+def onnx_paths(export_dir: str) -> Dict[str, str]:
+    """返回导出的文本塔和视觉塔ONNX文件路径"""
+    return {
+        "text": os.path.join(export_dir, "text_model.onnx"),
+        "image": os.path.join(export_dir, "vision_model.onnx"),
+    }
+
+def export_onnx(export_dir: Optional[str] = None) -> Dict[str, str]:
+    """把MODEL_PATH中CLIP模型的文本塔和视觉塔分别导出为ONNX，批大小和序列长度为动态维度"""
+    import inspect
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    
+    export_dir = export_dir or settings.ONNX_MODEL_DIR
+    os.makedirs(export_dir, exist_ok=True)
+    paths = onnx_paths(export_dir)
+    print(f"正在导出ONNX模型: {settings.MODEL_PATH} -> {export_dir}")
+    
+    clip = AutoModel.from_pretrained(settings.MODEL_PATH, trust_remote_code=True).eval()
+    tokenizer = AutoTokenizer.from_pretrained(settings.MODEL_PATH, trust_remote_code=True)
+    # 部分CLIP实现（如jina-clip）的文本塔根据padding自行计算attention mask
+    text_inputs = ["input_ids"]
+    if "attention_mask" in inspect.signature(clip.get_text_features).parameters:
+        text_inputs.append("attention_mask")
+    
+    class TextTower(torch.nn.Module):
+        def forward(self, *args):
+            return clip.get_text_features(**dict(zip(text_inputs, args)))
+    
+    class VisionTower(torch.nn.Module):
+        def forward(self, pixel_values):
+            return clip.get_image_features(pixel_values=pixel_values)
+    
+    tokens = tokenizer(["导出示例文本", "export sample"], padding=True, return_tensors="pt")
+    size = getattr(getattr(clip.config, "vision_config", None), "image_size", 224)
+    
+    with torch.no_grad():
+        torch.onnx.export(
+            TextTower(), tuple(tokens[name] for name in text_inputs), paths["text"],
+            input_names=text_inputs, output_names=["embeddings"],
+            dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in text_inputs}, "embeddings": {0: "batch"}},
+            opset_version=17,
+        )
+        torch.onnx.export(
+            VisionTower(), (torch.zeros(1, 3, size, size),), paths["image"],
+            input_names=["pixel_values"], output_names=["embeddings"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "embeddings": {0: "batch"}},
+            opset_version=17,
+        )
+    print("ONNX模型导出完成")
+    return paths
+
+def compare_backends(texts: List[str], images: List[Union[str, Image.Image]],
+                     backends: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """以torch后端为基准比较各推理后端的一致性和吞吐量
+    
+    每个后端对同一批文本和图像编码，一致性为与torch结果逐条余弦相似度的平均值和最小值，
+    吞吐量为每秒编码的条数。会同时加载多份模型，仅用于离线评估
+    """
+    backends = backends or list(ENCODER_BACKENDS)
+    samples = {"text": texts, "image": images}
+    
+    # 基准结果
+    reference = TorchEncoder()
+    expected = {kind: reference.encode(kind, items) for kind, items in samples.items() if items}
+    
+    report = []
+    for backend in backends:
+        try:
+            instance = reference if backend == TorchEncoder.name else ENCODER_BACKENDS[backend]()
+            result = {"backend": backend}
+            for kind, items in samples.items():
+                if not items:
+                    continue
+                start = time.perf_counter()
+                embeddings = np.asarray(instance.encode(kind, items), dtype=np.float32)
+                elapsed = time.perf_counter() - start
+                cosine = np.sum(embeddings * expected[kind], axis=1)
+                result[kind] = {
+                    "samples": len(items),
+                    "items_per_second": len(items) / elapsed if elapsed > 0 else None,
+                    "mean_cosine": float(np.mean(cosine)),
+                    "min_cosine": float(np.min(cosine)),
+                }
+            report.append(result)
+        except Exception as e:
+            print(f"评估推理后端{backend}失败: {e}")
+            report.append({"backend": backend, "error": str(e)})
+    return report
+
+class EmbeddingScheduler:
+    """跨请求的嵌入微批处理调度器
+    
+    各路由并发提交的单条编码请求先进入队列，后台线程在最多等待max_wait_ms毫秒内
+    凑满max_batch_size条（文本和图像分别成批），执行一次批量前向计算后逐个完成调用方的Future
+    """
+    
+    def __init__(self, max_batch_size: int, max_wait_ms: float):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.queue: "queue.Queue" = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        # 统计信息
+        self.batches = 0
+        self.items = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_seen_ms = 0.0
+    
+    def submit(self, kind: str, item) -> Future:
+        """提交一条编码请求，kind为"text"或"image"，返回结果为单个向量的Future"""
+        self._ensure_started()
+        future = Future()
+        self.queue.put((kind, item, future, time.perf_counter()))
+        return future
+    
+    def encode(self, kind: str, item) -> np.ndarray:
+        """提交一条编码请求并等待结果"""
+        return self.submit(kind, item).result()
+    
+    def stats(self) -> Dict[str, Any]:
+        """返回批大小、批填充率和排队等待时间等统计信息"""
+        with self.lock:
+            batches, items = self.batches, self.items
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "batches": batches,
+                "items": items,
+                "pending": self.queue.qsize(),
+                "avg_batch_size": items / batches if batches else 0.0,
+                "fill_rate": items / (batches * self.max_batch_size) if batches else 0.0,
+                "avg_queue_wait_ms": self.total_wait_ms / items if items else 0.0,
+                "max_queue_wait_ms": self.max_wait_seen_ms,
+            }
+    
+    def _ensure_started(self):
+        """首次提交时启动后台线程"""
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="embedding-scheduler", daemon=True)
+                self.thread.start()
+    
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.perf_counter() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process(batch)
+    
+    def _process(self, batch: List[tuple]):
+        """按类型分组执行批量编码并完成各调用方的Future"""
+        started = time.perf_counter()
+        waits = [(started - enqueued) * 1000 for _, _, _, enqueued in batch]
+        with self.lock:
+            self.batches += 1
+            self.items += len(batch)
+            self.total_wait_ms += sum(waits)
+            self.max_wait_seen_ms = max(self.max_wait_seen_ms, max(waits))
+        
+        for kind in ("text", "image"):
+            group = [(item, future) for k, item, future, _ in batch if k == kind]
+            if not group:
+                continue
+            try:
+                embeddings = _model_encode(kind, [item for item, _ in group])
+            except Exception as e:
+                if len(group) == 1:
+                    group[0][1].set_exception(e)
+                    continue
+                # 整批失败（如其中一张图片无法解码）时逐条重新编码，只让出错的那条失败
+                print(f"批量编码失败，逐条重试: {e}")
+                for item, future in group:
+                    try:
+                        future.set_result(_model_encode(kind, [item])[0])
+                    except Exception as item_error:
+                        future.set_exception(item_error)
+                continue
+            for (_, future), embedding in zip(group, embeddings):
+                future.set_result(embedding)
+
+
+scheduler = EmbeddingScheduler(settings.EMBEDDING_BATCH_SIZE, settings.EMBEDDING_BATCH_WAIT_MS)
+
+
+def _model_encode(kind: str, inputs):
+    """调用模型编码：配置了独立嵌入服务时发给服务进程，否则使用本进程加载的模型"""
+    if settings.EMBEDDING_SERVICE_ADDRESS:
+        from .embedding_service import get_client
+        single = not isinstance(inputs, list)
+        embeddings = get_client().encode(kind, [inputs] if single else inputs)
+        return embeddings[0] if single else embeddings
+    return get_encoder().encode(kind, inputs)
+
+def check_model():
+    """检查编码模型是否可用：使用嵌入服务时检查服务连接，否则加载本地模型"""
+    if settings.EMBEDDING_SERVICE_ADDRESS:
+        from .embedding_service import get_client
+        return get_client().ping()
+    return get_encoder()
+
+def _encode(kind: str, inputs):
+    """执行编码：单条输入经调度器与其他请求合并成批，列表输入本身已成批，直接调用模型"""
+    if isinstance(inputs, list) or scheduler.max_batch_size <= 1:
+        return _model_encode(kind, inputs)
+    return scheduler.encode(kind, inputs)
+
+class VectorCache:
+    """两级向量缓存：进程内按字节数限制大小的LRU，后面是该目录的磁盘缓存（diskcache）
+    
+    内存命中直接返回副本，不读盘也不反序列化；磁盘命中的向量会放入内存层
+    """
+    
+    def __init__(self, directory: str, memory_limit_bytes: int):
+        self.directory = directory
+        self.disk = diskcache.Cache(directory=directory, size_limit=int(settings.MAX_CACHE_SIZE_GB * 2**30))
+        self.memory_limit_bytes = memory_limit_bytes
+        self.memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """读取缓存的向量，未命中返回None"""
+        with self.lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                # 返回副本，避免调用方原地修改缓存中的向量
+                return value.copy()
+        
+        value = self.disk.get(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._remember(key, value)
+        return value
+    
+    def set(self, key: str, value: np.ndarray):
+        """写入磁盘缓存和内存缓存"""
+        self.disk.set(key, value)
+        self._remember(key, value)
+    
+    def _remember(self, key: str, value: np.ndarray):
+        """放入内存层，超出字节上限时淘汰最久未使用的条目"""
+        value = np.array(value)  # 保存独立副本
+        if value.nbytes > self.memory_limit_bytes:
+            return
+        with self.lock:
+            old = self.memory.pop(key, None)
+            if old is not None:
+                self.memory_bytes -= old.nbytes
+            self.memory[key] = value
+            self.memory_bytes += value.nbytes
+            while self.memory_bytes > self.memory_limit_bytes:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_bytes -= evicted.nbytes
+                self.evictions += 1
+    
+    def clear(self) -> int:
+        """清空内存层和磁盘缓存，返回磁盘缓存清除的条目数"""
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+        return self.disk.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """返回命中、未命中和淘汰计数以及内存层占用"""
+        with self.lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else None,
+                "memory_entries": len(self.memory),
+                "memory_mb": round(self.memory_bytes / (1024 * 1024), 2),
+                "memory_limit_mb": round(self.memory_limit_bytes / (1024 * 1024), 2),
+            }
+
+# 每个缓存目录一个长期存在的缓存实例，避免每次编码都重新打开diskcache的SQLite和文件句柄
+vector_caches: Dict[str, VectorCache] = {}
+vector_caches_lock = threading.Lock()
+
+def get_vector_cache(cache_dir: str) -> VectorCache:
+    """返回缓存目录对应的共享缓存实例，首次调用时创建"""
+    with vector_caches_lock:
+        cache = vector_caches.get(cache_dir)
+        if cache is None:
+            cache = vector_caches[cache_dir] = VectorCache(cache_dir, int(settings.VECTOR_MEMORY_CACHE_MB * 2**20))
+        return cache
+
 def encode_text(text: Union[str, List[str]], cache_dir=None) -> np.ndarray:
     """将文本或文本列表编码成向量。"""
     # 使用缓存
@@ -78,7 +524,7 @@ def encode_text(text: Union[str, List[str]], cache_dir=None) -> np.ndarray:
     
     # 先尝试从缓存获取
     cache_key = get_text_cache_key(text)
-    cache_instance = diskcache.Cache(directory=cache_dir,size_limit=settings.MAX_CACHE_SIZE_GB * 2**30)
+    cache_instance = get_vector_cache(cache_dir)
     
     embeddings = cache_instance.get(cache_key)
     if embeddings is not None:
@@ -86,24 +532,28 @@ def encode_text(text: Union[str, List[str]], cache_dir=None) -> np.ndarray:
         return embeddings
     
     # 缓存未命中，计算向量
-    model_instance = get_model()
-    embeddings = model_instance.encode(text, normalize_embeddings=True)
+    embeddings = _encode("text", text)
     
     cache_instance.set(cache_key, embeddings)
     
     return embeddings
 
-def encode_image(image_input: Union[Image.Image, List[Image.Image], str, List[str]], cache_dir=None) -> np.ndarray:
-    """将图像(PIL Image、路径)或图像列表编码成向量。"""
+def encode_image(image_input: Union[Image.Image, List[Image.Image], str, List[str]], cache_dir=None,
+                 cache_key: Optional[str] = None) -> np.ndarray:
+    """将图像(PIL Image、路径)或图像列表编码成向量。
+    
+    cache_key为图片文件内容的哈希（images.hash_value或上传内容的hash_bytes），
+    传入时直接用作缓存键，不再读取文件计算
+    """
     # 使用缓存
     cache_dir = cache_dir or settings.IMAGE_VECTOR_CACHE_DIR
     
     # 先尝试从缓存获取
     try:
-        cache_key = get_image_cache_key(image_input)
-        cache_instance = diskcache.Cache(directory=cache_dir,size_limit=settings.MAX_CACHE_SIZE_GB)
+        cache_key = cache_key or get_image_cache_key(image_input)
+        cache_instance = get_vector_cache(cache_dir)
         
-        embeddings = cache_instance.get(cache_key)
+        embeddings = cache_instance.get(cache_key) if cache_key else None
         if embeddings is not None:
             print(f"图像向量从缓存获取: {cache_key}")
             return embeddings
@@ -112,31 +562,92 @@ def encode_image(image_input: Union[Image.Image, List[Image.Image], str, List[st
         print(f"获取图像缓存时出错: {e}")
     
     # 缓存未命中，计算向量
-    model_instance = get_model()
     # 处理单个PIL图像或路径
     if isinstance(image_input, (Image.Image, str)):
-        images_to_encode = [image_input]
+        embeddings = _encode("image", image_input)[np.newaxis]
     else:
-        images_to_encode = image_input
-
-    embeddings = model_instance.encode(images_to_encode, normalize_embeddings=True)
+        embeddings = _encode("image", image_input)
 
-    # 尝试缓存结果
-    try:
-        if isinstance(image_input, (Image.Image, str)):
-            # 单个向量情况，缓存结果
-            cache_instance.set(cache_key, embeddings[0])
-        else:
-            cache_instance.set(cache_key, embeddings)
-    except Exception as e:
-        print(f"缓存图像向量时出错: {e}")
-        # 忽略缓存错误，仍然返回计算的向量
+    # 尝试缓存结果（没有缓存键的内存图像不缓存）
+    if cache_key:
+        try:
+            if isinstance(image_input, (Image.Image, str)):
+                # 单个向量情况，缓存结果
+                cache_instance.set(cache_key, embeddings[0])
+            else:
+                cache_instance.set(cache_key, embeddings)
+        except Exception as e:
+            print(f"缓存图像向量时出错: {e}")
+            # 忽略缓存错误，仍然返回计算的向量
 
     # 如果输入是单个对象，返回单个向量
     if isinstance(image_input, (Image.Image, str)):
         return embeddings[0]
     return embeddings
 
+def _pool_size(name: str) -> int:
+    """读取线程池大小配置，不是正整数时拒绝启动"""
+    value = getattr(settings, name)
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise ValueError(f"{name}必须是正整数，当前为: {value!r}")
+    return value
+
+# 推理线程池：检索、异步接口中的缓存读写和列表输入的编码在这里执行，线程数即INFERENCE_WORKERS
+inference_executor = ThreadPoolExecutor(
+    max_workers=_pool_size("INFERENCE_WORKERS"),
+    thread_name_prefix="inference"
+)
+# 写入线程池：上传、编辑、删除图片和重建、回滚索引在这里执行。db.create_image等同步函数
+# 在线程中等待调度器合批，单独的线程池保证写入再多也不会占满检索使用的推理线程
+ingest_executor = ThreadPoolExecutor(
+    max_workers=_pool_size("INGEST_WORKERS"),
+    thread_name_prefix="ingest"
+)
+
+async def run_inference(func: Callable, *args, **kwargs):
+    """在推理线程池中执行同步的编码或检索函数，等待期间不阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(inference_executor, functools.partial(func, *args, **kwargs))
+
+async def run_ingest(func: Callable, *args, **kwargs):
+    """在写入线程池中执行同步的写入函数（保存图片、更新向量等），不占用检索的推理线程"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(ingest_executor, functools.partial(func, *args, **kwargs))
+
+async def _encode_single_async(kind: str, item, cache_instance: "VectorCache", cache_key: Optional[str]) -> np.ndarray:
+    """编码单条输入：缓存读写在推理线程池中执行，提交给调度器后直接等待其Future，合批期间不占用线程"""
+    if cache_key:
+        embeddings = await run_inference(cache_instance.get, cache_key)
+        if embeddings is not None:
+            return embeddings
+    
+    embeddings = await asyncio.wrap_future(scheduler.submit(kind, item))
+    
+    if cache_key:
+        try:
+            await run_inference(cache_instance.set, cache_key, embeddings)
+        except Exception as e:
+            print(f"缓存{kind}向量时出错: {e}")
+    return embeddings
+
+async def encode_text_async(text: Union[str, List[str]], cache_dir=None) -> np.ndarray:
+    """encode_text的异步版本"""
+    if isinstance(text, list) or scheduler.max_batch_size <= 1:
+        return await run_inference(encode_text, text, cache_dir)
+    cache_instance = get_vector_cache(cache_dir or settings.TEXT_VECTOR_CACHE_DIR)
+    return await _encode_single_async("text", text, cache_instance, get_text_cache_key(text))
+
+async def encode_image_async(image_input: Union[Image.Image, List[Image.Image], str, List[str]], cache_dir=None,
+                             cache_key: Optional[str] = None) -> np.ndarray:
+    """encode_image的异步版本"""
+    if isinstance(image_input, list) or scheduler.max_batch_size <= 1:
+        return await run_inference(encode_image, image_input, cache_dir, cache_key)
+    cache_instance = get_vector_cache(cache_dir or settings.IMAGE_VECTOR_CACHE_DIR)
+    if not cache_key:
+        # 路径输入需要读取文件计算哈希，放到线程池中
+        cache_key = await run_inference(get_image_cache_key, image_input)
+    return await _encode_single_async("image", image_input, cache_instance, cache_key)
+
 def clear_cache(cache_dir: str) -> int:
     """清除特定目录下的向量缓存
     
@@ -150,8 +661,42 @@ def clear_cache(cache_dir: str) -> int:
         return 0
     
     try:
-        cache = diskcache.Cache(directory=cache_dir)
-        return cache.clear()  # 返回清除的条目数
+        return get_vector_cache(cache_dir).clear()  # 返回清除的条目数
     except Exception as e:
         print(f"清除缓存时出错: {str(e)}")
         return 0
+
+def _sample_library(sample_size: int):
+    """从图片库最新的图片中抽取标题、描述和图片文件，只读打开数据库，不加载向量索引"""
+    import sqlite3
+    texts, files = [], []
+    if settings.DB_PATH and os.path.exists(settings.DB_PATH):
+        conn = sqlite3.connect(f"file:{settings.DB_PATH}?mode=ro", uri=True)
+        try:
+            rows = conn.execute("SELECT title, description, filepath FROM images ORDER BY created_at DESC LIMIT ?", (sample_size,)).fetchall()
+        finally:
+            conn.close()
+        texts = [text for title, description, _ in rows for text in (title, description) if text]
+        files = [filepath for _, _, filepath in rows if filepath and os.path.exists(filepath)]
+    if not texts:
+        texts = ["一只在草地上奔跑的狗", "a city skyline at night"]
+    return texts, files
+
+if __name__ == "__main__":
+    # 离线评估推理后端：python -m backend.generate_vector [后端 ...] [--samples N]
+    # 会临时加载各后端的模型，不要在服务进程中运行
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description="以torch后端为基准评估其他推理后端的余弦一致性和吞吐量")
+    parser.add_argument("backends", nargs="*", choices=list(ENCODER_BACKENDS), help="要评估的推理后端，默认全部")
+    parser.add_argument("--samples", type=int, default=32, help="从最新的图片中抽样的数量")
+    args = parser.parse_args()
+    
+    texts, files = _sample_library(args.samples)
+    report = compare_backends(texts, files, args.backends or None)
+    print(json.dumps({
+        "current_backend": settings.EMBEDDING_BACKEND,
+        "text_samples": len(texts),
+        "image_samples": len(files),
+        "results": report
+    }, ensure_ascii=False, indent=2))
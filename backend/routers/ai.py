@@ -11,6 +11,7 @@ import shutil
 # 导入图像分析和向量生成模块
 from ..image_analysis import ImageAnalysis, get_image_hash
 from ..config import settings
+from ..generate_vector import run_ingest
 
 router = APIRouter(prefix="/ai", tags=["ai"])
 
@@ -99,7 +100,7 @@ async def generate_content(
         
         # 更新图片
         if update_data:
-            db.update_image(uuid, update_data)
+            await run_ingest(db.update_image, uuid, update_data)
     
     except Exception as e:
         return ResponseModel.error(
@@ -322,7 +323,7 @@ async def process_batch_generation(task_id: str, uuids: List[str], options: Gene
                 
                 # 更新图片
                 if update_data and not "error" in analysis_result:
-                    db.update_image(uuid, update_data)
+                    await run_ingest(db.update_image, uuid, update_data)
                     
                     task["succeeded"] += 1
                     task["results"].append({
@@ -414,7 +415,7 @@ async def analyze_image(uuid: str = Path(..., description="图片的UUID")):
         
         # 仅在有内容时更新
         if update_data:
-            updated_image = db.update_image(uuid, update_data)
+            updated_image = await run_ingest(db.update_image, uuid, update_data)
             
             end_time = time.time()
             processing_time = int((end_time - start_time) * 1000)  # 毫秒
@@ -509,7 +510,7 @@ async def batch_analyze_images(uuids: List[str]):
             
             # 仅在有内容时更新
             if update_data:
-                updated_image = db.update_image(uuid, update_data)
+                updated_image = await run_ingest(db.update_image, uuid, update_data)
                 results.append({
                     "uuid": uuid,
                     "analysis": result,
@@ -2,12 +2,14 @@ from fastapi import APIRouter, HTTPException, Query, Path, UploadFile, File, For
 from typing import List, Optional, Dict, Any
 from ..schemas import ResponseModel, ImageResponse, ImageListItem, ImageUpdate
 import os
-import shutil
 from datetime import datetime
 import json
 from PIL import Image as PILImage
+import asyncio
+import io
 from .. import db
 from ..config import settings
+from ..generate_vector import run_ingest, new_content_hasher, HASH_CHUNK_SIZE
 router = APIRouter(prefix="/images", tags=["images"])
 
 
@@ -20,7 +22,9 @@ async def get_images(
     order: str = Query("desc", description="排序方向"),
     start_date: Optional[str] = Query(None, description="开始日期过滤"),
     end_date: Optional[str] = Query(None, description="结束日期过滤"),
-    tags: Optional[List[str]] = Query(None,alias="tags[]", description="标签过滤，可以是数组形式") # 由于前端发送的是tags[]，所以这里需要使用alias来处理
+    tags: Optional[List[str]] = Query(None,alias="tags[]", description="标签过滤，可以是数组形式"), # 由于前端发送的是tags[]，所以这里需要使用alias来处理
+    cursor: Optional[str] = Query(None, description="分页游标，传入上一页返回的next_cursor，传入时忽略page"),
+    with_total: bool = Query(True, description="是否返回总数，滚动加载时可关闭")
 ):
     
     """获取图片列表，支持分页、排序和多种过滤"""
@@ -31,16 +35,24 @@ async def get_images(
     print("tags:", tags)
     print("tags_type:", type(tags))
     print("tag_list:", tag_list)
-    # 获取图片列表和总数
-    images, total_count = db.get_images(
-        page=page,
-        page_size=page_size,
-        sort_by=sort_by,
-        order=order,
-        start_date=start_date,
-        end_date=end_date,
-        tags=tag_list
-    )
+    # 获取图片列表、总数和下一页游标
+    try:
+        images, total_count, next_cursor = db.get_images(
+            page=page,
+            page_size=page_size,
+            sort_by=sort_by,
+            order=order,
+            start_date=start_date,
+            end_date=end_date,
+            tags=tag_list,
+            cursor=cursor,
+            with_total=with_total
+        )
+    except ValueError as e:
+        return ResponseModel.error(
+            code="INVALID_REQUEST",
+            message=str(e)
+        )
     
     # 转换为前端需要的格式
     image_list = []
@@ -54,7 +66,9 @@ async def get_images(
         })
     
     # 计算总页数
-    total_pages = (total_count + page_size - 1) // page_size
+    total_pages = None
+    if total_count is not None:
+        total_pages = (total_count + page_size - 1) // page_size
     
     # 构建响应
     return ResponseModel.success(
@@ -63,7 +77,8 @@ async def get_images(
             "page": page,
             "page_size": page_size,
             "total": total_count,
-            "total_pages": total_pages
+            "total_pages": total_pages,
+            "next_cursor": next_cursor
         }
     )
 
@@ -122,8 +137,21 @@ async def upload_images(
     
     uploaded = []
     failed = []
+    pending = []
+    # 同时在内存中保留、等待编码的图片数与写入线程数一致，多张图片的编码能合并成批，同时峰值内存不随上传数量增长
+    window = asyncio.Semaphore(settings.INGEST_WORKERS)
+    
+    async def create(image_data, img):
+        """在写入线程池中保存数据库记录并生成向量，完成后释放内存中的图片和上传内容"""
+        try:
+            return await run_ingest(db.create_image, image_data, img)
+        finally:
+            if img is not None:
+                img.close()
+            window.release()
     
     for file in files:
+        await window.acquire()
         try:
             # 生成基于日期的子目录
             today = datetime.now().strftime("%Y/%m/%d")
@@ -134,15 +162,26 @@ async def upload_images(
             file_ext = os.path.splitext(file.filename)[1]
             save_path = os.path.join(save_dir, f"{datetime.now().strftime('%H%M%S')}_{file.filename}")
             
-            # 保存文件
+            # 单次流式读取上传内容：分块写入磁盘，同时计算内容哈希（hash_value和图像向量的缓存键）
+            # 并保留在内存中，之后的尺寸探测和向量编码都不再读取磁盘文件
+            hasher = new_content_hasher()
+            buffer = io.BytesIO()
+            file_size = 0
             with open(save_path, "wb") as f:
-                shutil.copyfileobj(file.file, f)
+                for chunk in iter(lambda: file.file.read(HASH_CHUNK_SIZE), b""):
+                    file_size += len(chunk)
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    buffer.write(chunk)
             
-            # 获取图片尺寸
-            width = height = None
+            # 从文件头获取图片尺寸和格式（只解析文件头，像素在编码时才解码）
+            img = None
+            width = height = image_format = None
             try:
-                with PILImage.open(save_path) as img:
-                    width, height = img.size
+                buffer.seek(0)
+                img = PILImage.open(buffer)
+                width, height = img.size
+                image_format = img.format
             except:
                 pass
             
@@ -150,33 +189,47 @@ async def upload_images(
             image_data = {
                 "filename": file.filename,
                 "filepath": save_path.replace("\\", "/"),
-                "file_size": os.path.getsize(save_path),
-                "file_type": file_ext.lstrip(".").lower(),
+                "file_size": file_size,
+                "file_type": (file_ext.lstrip(".") or image_format or "").lower(),
                 "width": width,
                 "height": height,
+                "hash_value": hasher.hexdigest(),
                 "metadata": common_metadata,
                 "tags": common_tags,
                 "title": title,
                 "description": description
             }
             
-            # 保存到数据库
-            created_image = db.create_image(image_data)
-            
-            uploaded.append({
-                "uuid": created_image["uuid"],
-                "original_filename": file.filename,
-                "file_size": image_data["file_size"],
-                "stored_path": image_data["filepath"]
-            })
-            
+            # 读完一个文件就开始保存和编码，不等待其余文件
+            pending.append((file.filename, image_data, asyncio.ensure_future(create(image_data, img))))
 
         except Exception as e:
+            window.release()
             failed.append({
                 "filename": file.filename,
                 "error": str(e)
             })
     
+    # 等待剩余的保存和编码完成
+    created = await asyncio.gather(*(task for _, _, task in pending), return_exceptions=True)
+    for (filename, image_data, _), created_image in zip(pending, created):
+        if isinstance(created_image, Exception):
+            # 记录已撤销，同时删除已保存的文件
+            if os.path.exists(image_data["filepath"]):
+                os.remove(image_data["filepath"])
+            failed.append({
+                "filename": filename,
+                "error": str(created_image)
+            })
+            continue
+        
+        uploaded.append({
+            "uuid": created_image["uuid"],
+            "original_filename": filename,
+            "file_size": image_data["file_size"],
+            "stored_path": image_data["filepath"]
+        })
+    
     # 构建响应
     return ResponseModel.success(
         data={
@@ -197,7 +250,7 @@ async def update_image(
 ):
     """更新图片信息（标题、描述、标签或元数据）"""
     # 更新图片
-    updated_image = db.update_image(uuid, update_data.dict(exclude_none=True))
+    updated_image = await run_ingest(db.update_image, uuid, update_data.dict(exclude_none=True))
     
     if not updated_image:
         return ResponseModel.error(
@@ -226,7 +279,7 @@ async def delete_image(uuid: str = Path(..., description="图片UUID")):
         )
     
     # 删除数据库记录
-    success = db.delete_image(uuid)
+    success = await run_ingest(db.delete_image, uuid)
     
     if not success:
         return ResponseModel.error(
@@ -268,7 +321,7 @@ async def batch_delete_images(uuids: List[str]):
             continue
         
         # 删除数据库记录
-        success = db.delete_image(uuid)
+        success = await run_ingest(db.delete_image, uuid)
         
         if success:
             # 尝试删除文件
@@ -1,29 +1,37 @@
 from fastapi import APIRouter, HTTPException, Query, Path, UploadFile, File, Form, Body
 from typing import List, Optional, Dict, Any, Union
-from ..schemas import ResponseModel, TextSearchQuery, SearchType, TextMatchMode, VectorMatchMode, ImageVectorMatchMode
-import os
+from ..schemas import ResponseModel, TextSearchQuery, BulkSearchRequest, SearchType, TextMatchMode, VectorMatchMode, ImageVectorMatchMode
 import shutil
 from datetime import datetime
 import json
 from PIL import Image as PILImage
 from .. import db
 from .. import vector_db
-import tempfile
+import asyncio
+import io
 import time
 import numpy as np
 
 # 导入向量生成相关功能
-from ..generate_vector import get_model, encode_text, encode_image
+from ..generate_vector import check_model, encode_text, encode_text_async, encode_image_async, run_inference, hash_bytes
 from ..image_analysis import get_image_hash
 from ..config import settings
 
 router = APIRouter(prefix="/search", tags=["search"])
 
+# 图片搜索各匹配模式用到的向量索引
+IMAGE_MODE_INDEX_TYPES = {
+    ImageVectorMatchMode.IMAGE: ["image"],
+    ImageVectorMatchMode.TITLE: ["title"],
+    ImageVectorMatchMode.DESCRIPTION: ["description"],
+    ImageVectorMatchMode.COMBINED: ["image", "title", "description"],
+}
+
 # 检查AI功能是否启用并验证模型是否可加载
 vector_search_available = False
 if settings.AI_ENABLED:
     try:
-        model = get_model()
+        check_model()
         vector_search_available = True
         print("向量搜索模型加载成功")
     except Exception as e:
@@ -32,6 +40,13 @@ if settings.AI_ENABLED:
 else:
     print("AI功能已在配置中禁用，向量搜索不可用")
 
+def _open_upload(contents: bytes):
+    """计算上传图片的内容哈希并在内存中打开图片
+    
+    只解析文件头，像素在缓存未命中、需要编码时才解码；哈希作为图像向量的缓存键
+    """
+    return PILImage.open(io.BytesIO(contents)), hash_bytes(contents)
+
 @router.get("/text", response_model=ResponseModel)
 async def text_search(
     q: str = Query(..., description="搜索查询文本"),
@@ -100,38 +115,28 @@ async def text_search(
     # 2. 向量检索部分
     elif search_type == SearchType.VECTOR and vector_search_available:
         vector_results = []
+        # 过滤条件在向量检索内部生效，只在满足条件的图片中搜索
+        allowed_uuids = db.get_filtered_uuids(start_date, end_date, tag_list)
         
         # 根据向量匹配模式执行不同的搜索
         if vector_match_mode == VectorMatchMode.TITLE:
             # 仅使用标题向量
-            vector_results = vector_db.search_by_title(q, limit=limit*2)
+            vector_results = await run_inference(vector_db.search_by_title, q, limit=limit, allowed_uuids=allowed_uuids)
         elif vector_match_mode == VectorMatchMode.DESCRIPTION:
             # 仅使用描述向量
-            vector_results = vector_db.search_by_description(q, limit=limit*2)
+            vector_results = await run_inference(vector_db.search_by_description, q, limit=limit, allowed_uuids=allowed_uuids)
         else:  # 默认为COMBINED
             # 使用混合向量搜索 (标题+描述)
-            vector_results = vector_db.search_by_text(q, limit=limit*2)
+            vector_results = await run_inference(vector_db.search_by_text, q, limit=limit, allowed_uuids=allowed_uuids)
         
-        # 获取向量搜索结果的详细信息并应用过滤
+        # 获取向量搜索结果的详细信息
         for vec_result in vector_results:
             # 获取图片详细信息
             img = db.get_image_by_uuid(vec_result["uuid"])
             if img:
-                # 应用过滤条件
-                include = True
-                # 日期过滤
-                if start_date and img["created_at"] < start_date:
-                    include = False
-                if end_date and img["created_at"] > end_date:
-                    include = False
-                # 标签过滤
-                if tag_list and not any(tag in img["tags"] for tag in tag_list):
-                    include = False
-                    
-                if include:
-                    # 添加相似度得分
-                    img["score"] = float(vec_result["similarity"])
-                    results.append(img)
+                # 添加相似度得分
+                img["score"] = float(vec_result["similarity"])
+                results.append(img)
         
     # 3. 混合检索部分
     else:  # hybrid模式，结合文本和向量搜索
@@ -173,16 +178,19 @@ async def text_search(
         # 获取向量搜索结果
         vector_results = []
         if vector_search_available:
+            # 过滤条件在向量检索内部生效，只在满足条件的图片中搜索
+            allowed_uuids = db.get_filtered_uuids(start_date, end_date, tag_list)
+            
             # 根据向量匹配模式执行不同的搜索
             if vector_match_mode == VectorMatchMode.TITLE:
                 # 仅使用标题向量
-                vector_results = vector_db.search_by_title(q, limit=limit*2)
+                vector_results = await run_inference(vector_db.search_by_title, q, limit=limit*2, allowed_uuids=allowed_uuids)
             elif vector_match_mode == VectorMatchMode.DESCRIPTION:
                 # 仅使用描述向量
-                vector_results = vector_db.search_by_description(q, limit=limit*2)
+                vector_results = await run_inference(vector_db.search_by_description, q, limit=limit*2, allowed_uuids=allowed_uuids)
             else:  # 默认为COMBINED
                 # 使用混合向量搜索
-                vector_results = vector_db.search_by_text(q, limit=limit*2)
+                vector_results = await run_inference(vector_db.search_by_text, q, limit=limit*2, allowed_uuids=allowed_uuids)
         
         # 合并结果，使用两种搜索的得分
         all_results = {}
@@ -204,21 +212,9 @@ async def text_search(
                 # 如果尚不存在，获取图片信息并添加
                 img = db.get_image_by_uuid(uuid)
                 if img:
-                    # 应用过滤条件
-                    include = True
-                    # 日期过滤
-                    if start_date and img["created_at"] < start_date:
-                        include = False
-                    if end_date and img["created_at"] > end_date:
-                        include = False
-                    # 标签过滤
-                    if tag_list and not any(tag in img["tags"] for tag in tag_list):
-                        include = False
-                        
-                    if include:
-                        # 只有向量得分，权重为0.6
-                        img["score"] = float(result["similarity"]) * 0.6
-                        all_results[uuid] = img
+                    # 只有向量得分，权重为0.6
+                    img["score"] = float(result["similarity"]) * 0.6
+                    all_results[uuid] = img
         
         # 转换为列表并按混合分数排序
         results = list(all_results.values())
@@ -313,49 +309,49 @@ async def image_search(
         for mode in match_modes:
             mode_weights[mode] = weight_value
     
-    temp_path = None
     try:
-        # 创建临时文件
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_file:
-            temp_path = temp_file.name
-            # 复制上传的文件内容
-            contents = await image.read()
-            temp_file.write(contents)
-            await image.seek(0)  # 重置文件指针，以防后续需要再次读取
-        
         start_time = time.time()
         
+        # 上传内容只在内存中打开一次，按内容哈希查缓存，命中时不解码像素
+        contents = await image.read()
+        step_start = time.perf_counter()
+        img, cache_key = await run_inference(_open_upload, contents)
+        decode_ms = (time.perf_counter() - step_start) * 1000
+        
+        # 只编码一次，所有匹配模式共用同一个查询向量
+        step_start = time.perf_counter()
+        query_vector = await encode_image_async(img, cache_key=cache_key)
+        encode_ms = (time.perf_counter() - step_start) * 1000
+        
+        # 过滤条件在向量检索内部生效，只在满足条件的图片中搜索
+        allowed_uuids = db.get_filtered_uuids(start_date, end_date, tag_list)
+        
+        # 每个用到的索引只检索一次，各索引并行执行
+        index_types = list(dict.fromkeys(t for mode in match_modes for t in IMAGE_MODE_INDEX_TYPES[mode]))
+        
+        def timed_search(index_type: str):
+            search_start = time.perf_counter()
+            results = vector_db.search_by_vector(query_vector, index_type=index_type, limit=limit, allowed_uuids=allowed_uuids)
+            return results, (time.perf_counter() - search_start) * 1000
+        
+        searches = await asyncio.gather(*(run_inference(timed_search, t) for t in index_types))
+        index_results = {t: results for t, (results, _) in zip(index_types, searches)}
+        index_ms = {t: elapsed for t, (_, elapsed) in zip(index_types, searches)}
+        
         # 存储所有搜索结果
         all_results = {}
+        mode_time_ms = {}
         
-        # 对每种匹配模式执行搜索
+        # 对每种匹配模式合并结果
         for mode in match_modes:
-            # 基于匹配模式执行不同的向量搜索
-            vector_results = []
+            # 并行检索时每种模式的耗时取其用到的索引中最慢的一个
+            mode_time_ms[mode.value] = round(max(index_ms[t] for t in IMAGE_MODE_INDEX_TYPES[mode]), 2)
             
-            if mode == ImageVectorMatchMode.IMAGE:
-                # 图片向量对图片向量搜索
-                vector_results = vector_db.search_by_image(temp_path, limit=limit*2)
-            elif mode == ImageVectorMatchMode.TITLE:
-                # 图片向量对标题向量搜索
-                # 需要先将图片编码为向量，然后搜索标题向量
-                img = PILImage.open(temp_path)
-                query_vector = encode_image(img)
-                vector_results = vector_db.search_by_vector(query_vector, index_type="title", limit=limit*2)
-            elif mode == ImageVectorMatchMode.DESCRIPTION:
-                # 图片向量对描述向量搜索
-                img = PILImage.open(temp_path)
-                query_vector = encode_image(img)
-                vector_results = vector_db.search_by_vector(query_vector, index_type="description", limit=limit*2)
-            elif mode == ImageVectorMatchMode.COMBINED:
+            if mode == ImageVectorMatchMode.COMBINED:
                 # 图片向量对综合向量搜索 (需要综合计算多个向量索引的结果)
-                img = PILImage.open(temp_path)
-                query_vector = encode_image(img)
-                
-                # 获取多种向量的搜索结果
-                image_results = vector_db.search_by_vector(query_vector, index_type="image", limit=limit*2)
-                title_results = vector_db.search_by_vector(query_vector, index_type="title", limit=limit*2)
-                desc_results = vector_db.search_by_vector(query_vector, index_type="description", limit=limit*2)
+                image_results = index_results["image"]
+                title_results = index_results["title"]
+                desc_results = index_results["description"]
                 
                 # 合并结果
                 combined_results = {}
@@ -383,6 +379,9 @@ async def image_search(
                 
                 # 转换为列表
                 vector_results = list(combined_results.values())
+            else:
+                # 图片向量对图片、标题或描述向量搜索
+                vector_results = index_results[IMAGE_MODE_INDEX_TYPES[mode][0]]
             
             # 为每个结果添加当前搜索模式的权重
             for result in vector_results:
@@ -406,34 +405,22 @@ async def image_search(
         
         # 获取详细图片信息
         formatted_results = []
-        for result in result_list[:limit*2]:  # 获取两倍结果用于过滤
+        for result in result_list[:limit]:
             # 获取图片详细信息
             img = db.get_image_by_uuid(result["uuid"])
             if img:
-                # 应用过滤条件
-                include = True
-                # 日期过滤
-                if start_date and img["created_at"] < start_date:
-                    include = False
-                if end_date and img["created_at"] > end_date:
-                    include = False
-                # 标签过滤
-                if tag_list and not any(tag in img["tags"] for tag in tag_list):
-                    include = False
-                    
-                if include:
-                    # 添加相似度得分
-                    img["score"] = result["weighted_similarity"]
-                    img["similarity_components"] = result["similarity_components"]
-                    formatted_results.append({
-                        "uuid": img["uuid"],
-                        "title": img["title"],
-                        "description": img.get("description", ""),
-                        "filepath": img["filepath"],
-                        "score": float(img["score"]),
-                        "similarity_components": img["similarity_components"],
-                        "tags": img["tags"]
-                    })
+                # 添加相似度得分
+                img["score"] = result["weighted_similarity"]
+                img["similarity_components"] = result["similarity_components"]
+                formatted_results.append({
+                    "uuid": img["uuid"],
+                    "title": img["title"],
+                    "description": img.get("description", ""),
+                    "filepath": img["filepath"],
+                    "score": float(img["score"]),
+                    "similarity_components": img["similarity_components"],
+                    "tags": img["tags"]
+                })
         
         # 限制结果数量
         formatted_results = formatted_results[:limit]
@@ -448,7 +435,10 @@ async def image_search(
                 "match_modes": [str(mode) for mode in match_modes],
                 "weights": mode_weights,
                 "total": len(formatted_results),
-                "time_ms": processing_time
+                "time_ms": processing_time,
+                "decode_time_ms": round(decode_ms, 2),
+                "encode_time_ms": round(encode_ms, 2),
+                "mode_time_ms": mode_time_ms
             }
         )
             
@@ -460,13 +450,94 @@ async def image_search(
             code="PROCESSING_ERROR",
             message=f"图片处理出错: {str(e)}"
         )
-    finally:
-        # 删除临时文件
-        if temp_path and os.path.exists(temp_path):
-            try:
-                os.unlink(temp_path)
-            except Exception as e:
-                print(f"删除临时文件失败: {str(e)}")
+
+@router.post("/bulk", response_model=ResponseModel)
+async def bulk_vector_search(request: BulkSearchRequest = Body(...)):
+    """
+    批量向量检索
+    
+    一次提交多个文本查询和/或参考图片UUID，所有查询向量在每个索引上合并为一次检索，
+    按查询顺序返回每个查询在各索引中的匹配结果（UUID和相似度）
+    """
+    # 检查向量搜索是否可用
+    if not vector_search_available:
+        return ResponseModel.error(
+            code="SERVICE_UNAVAILABLE",
+            message="向量搜索功能不可用，请检查模型配置"
+        )
+    
+    query_count = len(request.texts) + len(request.uuids)
+    if query_count == 0:
+        return ResponseModel.error(
+            code="INVALID_PARAM",
+            message="至少需要提供一个文本查询或参考图片UUID"
+        )
+    if query_count > 1000:
+        return ResponseModel.error(
+            code="INVALID_PARAM",
+            message="单次批量检索最多支持1000个查询"
+        )
+    
+    invalid_types = [t for t in request.index_types if t not in ("title", "description", "image")]
+    if invalid_types or not request.index_types:
+        return ResponseModel.error(
+            code="INVALID_PARAM",
+            message=f"无效的索引类型: {invalid_types}"
+        )
+    
+    # 处理标签过滤
+    tag_list = None
+    if request.tags:
+        tag_list = [tag.strip() for tag in request.tags.split(",")]
+    
+    start_time = time.time()
+    
+    # 收集查询向量：文本批量编码，UUID使用已存的图像向量
+    queries = []
+    vectors = []
+    if request.texts:
+        text_vectors = np.atleast_2d(await encode_text_async(request.texts))
+        for text, vector in zip(request.texts, text_vectors):
+            queries.append({"type": "text", "query": text})
+            vectors.append(vector)
+    
+    missing = []
+    for uuid in request.uuids:
+        vector = vector_db.get_vector(uuid, "image")
+        if vector is None:
+            missing.append(uuid)
+            continue
+        queries.append({"type": "uuid", "query": uuid})
+        vectors.append(vector)
+    
+    formatted_results = []
+    if vectors:
+        allowed_uuids = db.get_filtered_uuids(request.start_date, request.end_date, tag_list)
+        # UUID查询需多取一个结果，用于排除参考图片本身
+        matches = await run_inference(vector_db.search_many, np.stack(vectors), request.index_types, request.limit + 1, allowed_uuids)
+        
+        for query, per_index in zip(queries, matches):
+            results = {}
+            for index_type, index_results in per_index.items():
+                if query["type"] == "uuid":
+                    index_results = [r for r in index_results if r["uuid"] != query["query"]]
+                results[index_type] = [
+                    {"uuid": r["uuid"], "score": float(r["similarity"])}
+                    for r in index_results[:request.limit]
+                ]
+            formatted_results.append({**query, "results": results})
+    
+    processing_time = int((time.time() - start_time) * 1000)  # 毫秒
+    
+    return ResponseModel.success(
+        data={"results": formatted_results},
+        metadata={
+            "index_types": request.index_types,
+            "total": len(formatted_results),
+            "missing_uuids": missing,
+            "time_ms": processing_time
+        }
+    )
 
 @router.get("/similar/{uuid}", response_model=ResponseModel)
 async def similar_image_search(
@@ -549,7 +620,8 @@ async def similar_image_search(
             search_type_str = str(mode)  # 转换为字符串以匹配函数参数
             
             # 查询相似结果
-            results = db.search_similar_to_uuid(
+            results = await run_inference(
+                db.search_similar_to_uuid,
                 uuid=uuid,
                 search_type=search_type_str,
                 limit=limit*2,  # 获取更多结果以便过滤和合并
@@ -3,10 +3,10 @@ from typing import List, Dict, Any, Set, Optional
 from ..schemas import ResponseModel
 from .. import db
 from ..config import settings
-from ..generate_vector import clear_cache  # 导入简化的清除缓存函数
+from ..generate_vector import clear_cache, get_vector_cache, scheduler as embedding_scheduler, run_inference, run_ingest, inference_executor, ingest_executor  # 导入简化的清除缓存函数、向量缓存、编码调度器和推理、写入线程池
+from .. import vector_db
 import os
 import time
-import sqlite3
 import platform
 import psutil
 import sys
@@ -25,35 +25,16 @@ def get_cache_stats():
         "size_mb": 0
     }
     
-    # 尝试获取文本向量缓存统计
-    if os.path.exists(settings.TEXT_VECTOR_CACHE_DIR):
-        try:
-            cache_db_path = os.path.join(settings.TEXT_VECTOR_CACHE_DIR, "cache.db")
-            if os.path.exists(cache_db_path):
-                conn = sqlite3.connect(cache_db_path)
-                cursor = conn.cursor()
-                cursor.execute("SELECT COUNT(*) FROM cache")
-                text_cache_stats["entries"] = cursor.fetchone()[0]
-                # 计算大小
-                text_cache_stats["size_mb"] = round(os.path.getsize(cache_db_path) / (1024 * 1024), 2)
-                conn.close()
-        except Exception:
-            pass
-    
-    # 尝试获取图像向量缓存统计
-    if os.path.exists(settings.IMAGE_VECTOR_CACHE_DIR):
-        try:
-            cache_db_path = os.path.join(settings.IMAGE_VECTOR_CACHE_DIR, "cache.db")
-            if os.path.exists(cache_db_path):
-                conn = sqlite3.connect(cache_db_path)
-                cursor = conn.cursor()
-                cursor.execute("SELECT COUNT(*) FROM cache")
-                image_cache_stats["entries"] = cursor.fetchone()[0]
-                # 计算大小
-                image_cache_stats["size_mb"] = round(os.path.getsize(cache_db_path) / (1024 * 1024), 2)
-                conn.close()
-        except Exception:
-            pass
+    # 从共享的磁盘缓存实例读取统计，不再为每次查询单独打开缓存数据库
+    for cache_dir, stats in ((settings.TEXT_VECTOR_CACHE_DIR, text_cache_stats),
+                             (settings.IMAGE_VECTOR_CACHE_DIR, image_cache_stats)):
+        if os.path.exists(cache_dir):
+            try:
+                disk = get_vector_cache(cache_dir).disk
+                stats["entries"] = len(disk)
+                stats["size_mb"] = round(disk.volume() / (1024 * 1024), 2)
+            except Exception:
+                pass
     
     return {
         "text_vector_cache": text_cache_stats,
@@ -68,28 +49,25 @@ async def get_system_status():
     
     # 获取数据库信息
     try:
-        conn = db.get_db_connection()
-        cursor = conn.cursor()
-        
-        # 检查images表是否存在
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='images'")
-        has_images_table = cursor.fetchone() is not None
-        
-        if has_images_table:
-            cursor.execute("SELECT COUNT(*) FROM images")
-            image_count = cursor.fetchone()[0]
-            cursor.execute("SELECT SUM(file_size) FROM images")
-            total_size = cursor.fetchone()[0] or 0
-        else:
-            image_count = 0
-            total_size = 0
+        with db.db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # 检查images表是否存在
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='images'")
+            has_images_table = cursor.fetchone() is not None
+            
+            if has_images_table:
+                cursor.execute("SELECT COUNT(*), SUM(file_size) FROM images")
+                image_count, total_size = cursor.fetchone()
+                total_size = total_size or 0
+            else:
+                image_count = 0
+                total_size = 0
         
-        # 获取标签总数 - 使用与tags.py相同的方式
-        tags = db.get_popular_tags()
-        tag_count = len(tags)
+        # 获取标签总数，从标签计数表读取
+        tag_count = db.get_tag_count()
             
         db_status = "connected"
-        conn.close()
     except Exception as e:
         print(f"数据库连接错误: {e}")
         image_count = 0
@@ -120,6 +98,14 @@ async def get_system_status():
                 "model": settings.VISION_MODEL,
                 "available_models": settings.AVAILABLE_VISION_MODELS,
                 "api_base": settings.OPENAI_API_BASE
+            },
+            "embedding": {
+                "model": settings.MODEL_PATH,
+                "backend": settings.EMBEDDING_BACKEND,
+                "service": settings.EMBEDDING_SERVICE_ADDRESS or None,
+                "inference_workers": inference_executor._max_workers,
+                "ingest_workers": ingest_executor._max_workers,
+                "batching": embedding_scheduler.stats()
             }
         },
         "storage": {
@@ -132,19 +118,22 @@ async def get_system_status():
                 "title": settings.TITLE_INDEX_PATH,
                 "description": settings.DESCRIPTION_INDEX_PATH,
                 "uuid_map": settings.UUID_MAP_PATH
-            }
+            },
+            "index_checkpoint": vector_db.checkpointer.stats()
         },
         "cache": {
             "enabled": settings.USE_CACHE,
             "text_vector_cache": {
                 "path": settings.TEXT_VECTOR_CACHE_DIR,
                 "entries": cache_info["text_vector_cache"]["entries"],
-                "size_mb": cache_info["text_vector_cache"]["size_mb"]
+                "size_mb": cache_info["text_vector_cache"]["size_mb"],
+                "memory": get_vector_cache(settings.TEXT_VECTOR_CACHE_DIR).stats()
             },
             "image_vector_cache": {
                 "path": settings.IMAGE_VECTOR_CACHE_DIR,
                 "entries": cache_info["image_vector_cache"]["entries"],
-                "size_mb": cache_info["image_vector_cache"]["size_mb"]
+                "size_mb": cache_info["image_vector_cache"]["size_mb"],
+                "memory": get_vector_cache(settings.IMAGE_VECTOR_CACHE_DIR).stats()
             }
         },
         "server": {
@@ -239,6 +228,73 @@ async def clear_system_cache(cache_types: Dict[str, List[str]] = Body(...)):
     
     return ResponseModel.success(data=result)
 
+@router.post("/rebuild-index", response_model=ResponseModel)
+async def rebuild_vector_index(index_types: List[str] = Body(["title", "description", "image"], embed=True)):
+    """按配置的索引结构重建向量索引，IVF索引会用已有向量训练"""
+    invalid_types = set(index_types) - {"title", "description", "image"}
+    if invalid_types:
+        return ResponseModel.error(
+            code="INVALID_REQUEST",
+            message=f"无效的索引类型: {', '.join(invalid_types)}"
+        )
+    
+    start_time = time.time()
+    try:
+        # 重建需要读取全部向量并训练索引，在写入线程池中执行，避免阻塞事件循环和检索
+        results = await run_ingest(vector_db.rebuild_indices, index_types)
+    except Exception as e:
+        return ResponseModel.error(
+            code="REBUILD_FAILED",
+            message=f"重建向量索引失败: {str(e)}"
+        )
+    
+    return ResponseModel.success(
+        data={"indices": results},
+        metadata={"time_ms": int((time.time() - start_time) * 1000)}
+    )
+
+@router.get("/index-snapshots", response_model=ResponseModel)
+async def get_index_snapshots():
+    """获取当前索引版本和保留的历史版本"""
+    return ResponseModel.success(data=vector_db.list_snapshots())
+
+@router.post("/rollback-index", response_model=ResponseModel)
+async def rollback_vector_index(generation: Optional[int] = Body(None, embed=True)):
+    """回滚到保留的某个索引版本，默认回滚到上一个版本"""
+    try:
+        # 回滚需要重新加载索引文件，在写入线程池中执行，避免阻塞事件循环和检索
+        result = await run_ingest(vector_db.rollback_indices, generation)
+    except ValueError as e:
+        return ResponseModel.error(
+            code="INVALID_REQUEST",
+            message=str(e)
+        )
+    except Exception as e:
+        # 只读工作进程拒绝回滚，或读取索引文件失败
+        return ResponseModel.error(
+            code="ROLLBACK_FAILED",
+            message=f"回滚向量索引失败: {str(e)}"
+        )
+    
+    return ResponseModel.success(data=result)
+
+@router.get("/index-recall", response_model=ResponseModel)
+async def evaluate_index_recall(
+    index_type: str = Query("image", description="索引类型: title、description或image"),
+    sample_size: int = Query(100, ge=1, le=vector_db.RECALL_MAX_SAMPLES, description="抽样查询数量"),
+    k: int = Query(10, ge=1, le=1000, description="评估的近邻数量")
+):
+    """以精确检索为基准评估索引的召回率和查询耗时"""
+    if index_type not in ("title", "description", "image"):
+        return ResponseModel.error(
+            code="INVALID_REQUEST",
+            message=f"无效的索引类型: {index_type}"
+        )
+    
+    # 暴力检索基准在推理线程池中执行，避免阻塞事件循环
+    result = await run_inference(vector_db.evaluate_recall, index_type, sample_size, k)
+    return ResponseModel.success(data=result)
+
 @router.get("/config", response_model=ResponseModel)
 async def get_system_config():
     """获取系统配置信息"""
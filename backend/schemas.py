@@ -125,6 +125,16 @@ class TextSearchQuery(BaseModel):
     end_date: Optional[str] = Field(None, description="结束日期过滤")
     tags: Optional[str] = Field(None, description="标签过滤，逗号分隔")
 
+class BulkSearchRequest(BaseModel):
+    """批量向量检索参数"""
+    texts: List[str] = Field(default_factory=list, description="文本查询列表")
+    uuids: List[str] = Field(default_factory=list, description="参考图片UUID列表，以其图像向量作为查询")
+    index_types: List[str] = Field(default_factory=lambda: ["image"], description="要检索的索引：title、description、image")
+    limit: int = Field(20, ge=1, le=100, description="每个查询在每个索引中返回的结果数量")
+    start_date: Optional[str] = Field(None, description="开始日期过滤")
+    end_date: Optional[str] = Field(None, description="结束日期过滤")
+    tags: Optional[str] = Field(None, description="标签过滤，逗号分隔")
+
 # 标签相关模型
 class TagModel(BaseModel):
     """标签模型"""
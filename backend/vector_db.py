@@ -1,88 +1,1008 @@
 import os
 import faiss
+import json
 import numpy as np
 import pickle
-from typing import List, Dict, Any, Tuple, Optional, Union, Protocol, Callable
+import shutil
+import struct
+import threading
+import time
+import zlib
+from typing import List, Dict, Any, Tuple, Optional, Union, Protocol, Callable, Iterable
 from PIL import Image
 import abc
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+from contextlib import contextmanager
+from datetime import datetime
 
 # 导入项目的向量生成模块
-from .generate_vector import encode_text, encode_image
+from .generate_vector import encode_text, encode_image, get_image_cache_key
 from .config import settings
 
 
+# 支持的索引结构
+INDEX_KINDS = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+# 支持的向量存储编码：原始float32、半精度、8位标量量化、乘积量化
+VECTOR_ENCODINGS = ("float32", "fp16", "sq8", "pq")
+SQ_TYPES = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+# 每个IVF聚类中心至少需要的训练样本数（FAISS推荐值）
+MIN_POINTS_PER_CENTROID = 39
+# 过滤后的候选向量不超过该数量时直接用全精度向量精确计算，否则交给FAISS按ID选择器过滤
+EXACT_FILTER_MAX_IDS = 20000
+# 过滤条件匹配的图片占比不低于该值时不再逐个转换UUID，改为先检索再筛选结果（后过滤）
+POST_FILTER_MIN_RATIO = 0.5
+# 召回率评估最多使用的查询数，以及精确基准检索每次读取的全精度向量行数（相似度矩阵最多约64MB）
+RECALL_MAX_SAMPLES = 1000
+RECALL_CHUNK_SIZE = 16384
+# 重建索引时每个聚类中心（PQ为每个码字）使用的训练样本数，至少使用REBUILD_MIN_TRAIN_SAMPLES个；
+# 向量按REBUILD_CHUNK_SIZE行分块从全精度向量文件读入并加入新索引
+REBUILD_TRAIN_SAMPLES_PER_CENTROID = 64
+REBUILD_MIN_TRAIN_SAMPLES = 16384
+REBUILD_CHUNK_SIZE = 16384
+# 构建期间新增的向量多于该数量时先在锁外补入（最多REBUILD_CATCH_UP_ROUNDS轮），
+# 替换索引时写锁内只处理剩余的少量向量
+REBUILD_SWAP_MAX_ADDS = 16
+REBUILD_CATCH_UP_ROUNDS = 8
+
+
+def snapshot_path(path: str, generation: int) -> str:
+    """返回某个版本的索引文件路径，版本0表示未分版本的旧版文件"""
+    return f"{path}.{generation:08d}" if generation else path
+
+
+def _fsync(path: str):
+    """把文件内容刷到磁盘"""
+    with open(path, 'rb+') as f:
+        os.fsync(f.fileno())
+
+
+def _unwrap_index(index: faiss.Index) -> faiss.Index:
+    """去掉IDMap2包装，返回实际存放向量的索引"""
+    return faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+
+
+def get_index_kind(index: faiss.Index) -> str:
+    """识别FAISS索引对象对应的索引结构"""
+    base = _unwrap_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(base, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def get_index_encoding(index: faiss.Index) -> str:
+    """识别FAISS索引对象的向量存储编码"""
+    base = _unwrap_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        base = faiss.downcast_index(base.storage)
+    if isinstance(base, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    if isinstance(base, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "fp16" if base.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "float32"
+
+
+class RawVectorStore:
+    """按向量ID存放全精度向量的磁盘文件
+    
+    第idx行即向量ID为idx的float32向量。读取通过内存映射按需加载，不占用常驻内存，
+    用于压缩索引的精确重排序，以及重建索引时恢复原始向量。
+    向量ID只增不复用（替换向量时分配新ID），文件只在末尾追加，已写入的行不再修改，
+    因此每个索引版本引用的行始终保持写入时的内容，回滚版本后无需恢复该文件。
+    """
+    
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self.row_bytes = dim * np.dtype(np.float32).itemsize
+        self._mmap = None
+    
+    def __len__(self) -> int:
+        """文件中的行数，即最大向量ID加一"""
+        if not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path) // self.row_bytes
+    
+    def covers(self, ids: np.ndarray) -> bool:
+        """文件是否包含所有给定ID的行"""
+        return len(ids) == 0 or int(np.max(ids)) < len(self)
+    
+    def write(self, ids: np.ndarray, vectors: np.ndarray):
+        """按ID写入向量（新分配的ID总在文件末尾之后）"""
+        mode = 'r+b' if os.path.exists(self.path) else 'w+b'
+        with open(self.path, mode) as f:
+            for idx, vector in zip(ids, vectors):
+                f.seek(int(idx) * self.row_bytes)
+                f.write(np.ascontiguousarray(vector, dtype=np.float32).tobytes())
+        # 文件可能变长，下次读取时重新映射
+        self._mmap = None
+    
+    def view(self) -> np.ndarray:
+        """返回整个文件的只读内存映射，形状为 [行数, dim]"""
+        rows = len(self)
+        if rows == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        if self._mmap is None or self._mmap.shape[0] != rows:
+            self._mmap = np.memmap(self.path, dtype=np.float32, mode='r', shape=(rows, self.dim))
+        return self._mmap
+    
+    def read(self, ids: np.ndarray) -> np.ndarray:
+        """按ID读取向量"""
+        return np.asarray(self.view()[np.asarray(ids, dtype=np.int64)])
+
+
+class MmapFlatIndex:
+    """直接在全精度向量文件的内存映射上做精确内积检索的索引
+    
+    提供与 IndexIDMap2(IndexFlatIP) 相同的常用接口（search、add_with_ids、remove_ids、
+    reconstruct、reconstruct_batch）。向量页由操作系统页缓存按需加载，启动时无需把
+    索引读入进程私有内存，多个工作进程加载同一文件时共享同一份物理页。
+    向量文件只由持有写入锁的单个进程写入（见init_indices），其他进程只读，
+    通过重新加载检查点后的新版本看到变更。
+    """
+    
+    is_trained = True
+    
+    def __init__(self, store: RawVectorStore, live_ids: np.ndarray):
+        self.store = store
+        self.live = np.zeros(len(store), dtype=bool)
+        self.live[live_ids] = True
+        self.ntotal = int(len(live_ids))
+    
+    def search(self, x: np.ndarray, k: int, params=None,
+               allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """返回与FAISS一致的 (D, I)，不足k个结果时以 -1 补齐
+        
+        allowed为按向量ID下标的布尔数组时，只返回其中为True的向量
+        """
+        vectors = self.store.view()[:len(self.live)]
+        scores = (vectors @ x.T).T
+        mask = self.live
+        if allowed is not None:
+            mask = mask & np.pad(allowed[:len(mask)], (0, max(0, len(mask) - len(allowed))))
+        scores[:, ~mask] = -np.inf
+        
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        I = np.take_along_axis(top, order, axis=1).astype(np.int64)
+        D = np.take_along_axis(top_scores, order, axis=1).astype(np.float32)
+        I[np.isneginf(D)] = -1
+        return D, I
+    
+    def add_with_ids(self, x: np.ndarray, ids: np.ndarray):
+        """写入向量文件并标记为有效"""
+        ids = np.asarray(ids, dtype=np.int64)
+        self.store.write(ids, x)
+        if len(ids) and int(ids.max()) >= len(self.live):
+            grown = np.zeros(int(ids.max()) + 1, dtype=bool)
+            grown[:len(self.live)] = self.live
+            self.live = grown
+        self.ntotal += int((~self.live[ids]).sum())
+        self.live[ids] = True
+    
+    def remove_ids(self, ids: np.ndarray) -> int:
+        """标记为无效，向量文件中的行保留不变（历史版本可能仍引用它）"""
+        ids = np.asarray(ids, dtype=np.int64)
+        ids = ids[ids < len(self.live)]
+        removed = int(self.live[ids].sum())
+        self.live[ids] = False
+        self.ntotal -= removed
+        return removed
+    
+    def reconstruct(self, idx: int) -> np.ndarray:
+        return self.store.read([idx])[0]
+    
+    def reconstruct_batch(self, ids: np.ndarray) -> np.ndarray:
+        return self.store.read(ids)
+
+
+class VectorLog:
+    """追加写入的向量变更日志
+    
+    每次增删向量只在日志末尾追加一条记录，单次写盘量与索引规模无关；
+    检查点开始时把当前日志封存为该版本的日志段（路径加版本号后缀），之后的变更写入新日志，
+    版本写盘完成后删除已封存的日志段；启动时依次重放比当前版本新的日志段和当前日志。
+    
+    记录格式：内容长度(4字节) + CRC32(4字节) + 内容，内容为
+    操作(1字节) + 索引类型(1字节) + 向量ID(8字节) + UUID长度(2字节) + UUID + 向量(仅添加操作)
+    """
+    
+    HEADER = struct.Struct("<II")
+    BODY = struct.Struct("<BBqH")
+    OP_ADD, OP_REMOVE, OP_FORGET = 1, 2, 3
+    INDEX_TYPES = ("title", "description", "image")
+    
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self._file = None
+        # 上次检查点之后追加的记录数
+        self.mutations = 0
+    
+    def append(self, op: int, index_type: Optional[str], uuid: str, idx: int = -1,
+               vector: Optional[np.ndarray] = None):
+        """在日志末尾追加一条记录"""
+        uuid_bytes = uuid.encode("utf-8")
+        type_code = self.INDEX_TYPES.index(index_type) if index_type else 0
+        body = self.BODY.pack(op, type_code, idx, len(uuid_bytes)) + uuid_bytes
+        if vector is not None:
+            body += np.asarray(vector, dtype=np.float32).reshape(-1).tobytes()
+        
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "ab")
+        self._file.write(self.HEADER.pack(len(body), zlib.crc32(body)) + body)
+        self._file.flush()
+        self.mutations += 1
+    
+    def segments(self) -> List[Tuple[int, str]]:
+        """已封存的日志段，返回按版本号排序的 (版本号, 路径) 列表"""
+        directory = os.path.dirname(self.path) or "."
+        prefix = os.path.basename(self.path) + "."
+        if not os.path.isdir(directory):
+            return []
+        found = []
+        for name in os.listdir(directory):
+            suffix = name[len(prefix):]
+            if name.startswith(prefix) and suffix.isdigit():
+                found.append((int(suffix), os.path.join(directory, name)))
+        return sorted(found)
+    
+    def rotate(self, generation: int):
+        """把当前日志封存为某个版本的日志段，之后的记录写入新的日志文件"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            os.replace(self.path, snapshot_path(self.path, generation))
+        self.mutations = 0
+    
+    def discard_through(self, generation: int):
+        """删除版本号不超过generation的日志段（这些变更已包含在该版本中）"""
+        for segment_generation, path in self.segments():
+            if segment_generation <= generation:
+                os.remove(path)
+    
+    def replay(self, after_generation: int = 0) -> List[Tuple[int, Optional[str], str, int, Optional[np.ndarray]]]:
+        """读取版本号大于after_generation的日志段和当前日志中的全部完整记录
+        
+        从第一条损坏或写了一半的记录处截断对应的文件
+        
+        返回:
+            List[Tuple]: (操作, 索引类型, UUID, 向量ID, 向量) 列表
+        """
+        paths = [path for generation, path in self.segments() if generation > after_generation]
+        records = []
+        for path in paths + [self.path]:
+            records.extend(self._read(path))
+        self.mutations = len(records)
+        return records
+    
+    def _read(self, path: str) -> List[Tuple[int, Optional[str], str, int, Optional[np.ndarray]]]:
+        """读取一个日志文件中的完整记录"""
+        if not os.path.exists(path):
+            return []
+        with open(path, "rb") as f:
+            data = f.read()
+        
+        records = []
+        offset = 0
+        while offset + self.HEADER.size <= len(data):
+            length, crc = self.HEADER.unpack_from(data, offset)
+            body = data[offset + self.HEADER.size:offset + self.HEADER.size + length]
+            if len(body) < length or zlib.crc32(body) != crc:
+                break
+            op, type_code, idx, uuid_len = self.BODY.unpack_from(body)
+            uuid = body[self.BODY.size:self.BODY.size + uuid_len].decode("utf-8")
+            vector = None
+            if op == self.OP_ADD:
+                vector = np.frombuffer(body, dtype=np.float32, offset=self.BODY.size + uuid_len)
+                vector = vector.reshape(1, self.dim).copy()
+            index_type = self.INDEX_TYPES[type_code] if op != self.OP_FORGET else None
+            records.append((op, index_type, uuid, idx, vector))
+            offset += self.HEADER.size + length
+        
+        if offset < len(data):
+            print(f"向量变更日志{path}在第{len(records) + 1}条记录处损坏，截断{len(data) - offset}字节")
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+        return records
+    
+    def truncate(self):
+        """丢弃所有未写入版本的变更：删除全部日志段并清空当前日志"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for _, path in self.segments():
+            os.remove(path)
+        if os.path.exists(self.path):
+            open(self.path, "wb").close()
+        self.mutations = 0
+
+
+class UuidIdMap:
+    """UUID与各索引向量ID之间的双向映射，按列存储
+    
+    正向：按UUID排序的定长字节数组，加上每个索引一列int64向量ID（-1表示该索引中没有向量），
+    通过二分查找定位；上次合并之后的修改记在一个小字典里，保存时合并回有序数组。
+    有序数组和各列作为一个整体快照替换，读取时先读增量字典再读快照，合并过程中也能得到一致的结果。
+    反向：每个索引一个以向量ID为下标的定长UUID字节数组，空字节串表示ID已失效。
+    保存为 .npz 文件，加载时不再为每张图片构造Python字典，反向表由正向列直接生成。
+    """
+    
+    INDEX_TYPES = ("title", "description", "image")
+    UUID_BYTES = 36
+    UUID_DTYPE = f"S{UUID_BYTES}"
+    
+    def __init__(self):
+        # (按UUID排序的键, {索引类型: 向量ID列})，合并时整体替换，不原地修改
+        self.sorted: Tuple[np.ndarray, Dict[str, np.ndarray]] = (
+            np.zeros(0, dtype=self.UUID_DTYPE),
+            {t: np.zeros(0, dtype=np.int64) for t in self.INDEX_TYPES}
+        )
+        # 上次合并后修改过的UUID -> {索引类型: 向量ID}，None表示已删除
+        self.delta: Dict[str, Optional[Dict[str, int]]] = {}
+        # 反向表及每个索引下一个可分配的向量ID（HNSW中失效的ID仍在图中，不能复用）
+        self.rows = {t: np.zeros(0, dtype=self.UUID_DTYPE) for t in self.INDEX_TYPES}
+        self.next_ids = {t: 0 for t in self.INDEX_TYPES}
+        self._size = 0
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    @property
+    def keys(self) -> np.ndarray:
+        return self.sorted[0]
+    
+    @property
+    def columns(self) -> Dict[str, np.ndarray]:
+        return self.sorted[1]
+    
+    def __contains__(self, uuid: str) -> bool:
+        return self.ids(uuid) is not None
+    
+    def ids(self, uuid: str) -> Optional[Dict[str, int]]:
+        """返回UUID在各索引中的向量ID，UUID不存在时返回None"""
+        delta = self.delta
+        if uuid in delta:
+            return delta.get(uuid)
+        keys, columns = self.sorted
+        key = uuid.encode("utf-8")
+        pos = int(np.searchsorted(keys, key))
+        if pos == len(keys) or keys[pos] != key:
+            return None
+        return {t: int(col[pos]) for t, col in columns.items() if col[pos] >= 0}
+    
+    def get(self, uuid: str, index_type: str) -> Optional[int]:
+        """返回UUID在某个索引中的向量ID"""
+        ids = self.ids(uuid)
+        return ids.get(index_type) if ids else None
+    
+    def ids_for(self, uuids: Iterable[str], index_type: str) -> np.ndarray:
+        """批量查找一组UUID在某个索引中的向量ID（去重、升序），忽略不存在的UUID"""
+        # 增量字典中的UUID逐个查找，其余UUID在有序数组中批量二分查找
+        delta = self.delta
+        sorted_keys, columns = self.sorted
+        changed, keys = [], []
+        for uuid in uuids:
+            if uuid in delta:
+                ids = delta.get(uuid)
+                if ids and index_type in ids:
+                    changed.append(ids[index_type])
+            elif len(uuid.encode("utf-8")) <= self.UUID_BYTES:
+                keys.append(uuid.encode("utf-8"))
+        keys = np.array(keys, dtype=self.UUID_DTYPE)
+        
+        found = np.zeros(0, dtype=np.int64)
+        if len(sorted_keys) and len(keys):
+            pos = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+            found = columns[index_type][pos[sorted_keys[pos] == keys]]
+        ids = np.concatenate([found, np.array(changed, dtype=np.int64)])
+        return np.unique(ids[ids >= 0])
+    
+    def uuid_at(self, index_type: str, idx: int) -> Optional[str]:
+        """返回向量ID对应的UUID，常数时间"""
+        rows = self.rows[index_type]
+        if 0 <= idx < len(rows) and rows[idx]:
+            return rows[idx].decode("utf-8")
+        return None
+    
+    def live_ids(self, index_type: str) -> np.ndarray:
+        """返回某个索引中所有有效向量ID"""
+        return np.flatnonzero(self.rows[index_type][:self.next_ids[index_type]]).astype(np.int64)
+    
+    def allocate_id(self, index_type: str) -> int:
+        """分配一个从未使用过的向量ID"""
+        idx = self.next_ids[index_type]
+        self.next_ids[index_type] += 1
+        return idx
+    
+    def reserve_ids(self, index_type: str, count: int):
+        """保证之后分配的向量ID不小于count（例如全精度向量文件中已有的行数）"""
+        self.next_ids[index_type] = max(self.next_ids[index_type], count)
+    
+    def set(self, uuid: str, index_type: str, idx: int):
+        """设置UUID在某个索引中的向量ID，原ID（如有）在反向表中失效"""
+        if len(uuid.encode("utf-8")) > self.UUID_BYTES:
+            raise ValueError(f"UUID长度超过{self.UUID_BYTES}字节: {uuid}")
+        ids = self._edit(uuid)
+        old = ids.get(index_type)
+        if old is not None and old != idx:
+            self._set_row(index_type, old, uuid, None)
+        ids[index_type] = idx
+        self._set_row(index_type, idx, None, uuid)
+        self.reserve_ids(index_type, idx + 1)
+    
+    def unset(self, uuid: str, index_type: str) -> Optional[int]:
+        """删除UUID在某个索引中的向量ID，返回被删除的ID"""
+        if self.get(uuid, index_type) is None:
+            return None
+        idx = self._edit(uuid).pop(index_type)
+        self._set_row(index_type, idx, uuid, None)
+        return idx
+    
+    def discard(self, uuid: str) -> bool:
+        """删除UUID及其在所有索引中的向量ID"""
+        ids = self.ids(uuid)
+        if ids is None:
+            return False
+        for index_type, idx in ids.items():
+            self._set_row(index_type, idx, uuid, None)
+        self.delta[uuid] = None
+        self._size -= 1
+        return True
+    
+    def _edit(self, uuid: str) -> Dict[str, int]:
+        """取出UUID的可修改副本放入增量字典，UUID不存在时新建"""
+        ids = self.ids(uuid)
+        if ids is None:
+            ids = {}
+            self._size += 1
+        ids = dict(ids)
+        self.delta[uuid] = ids
+        return ids
+    
+    def _set_row(self, index_type: str, idx: int, expected: Optional[str], uuid: Optional[str]):
+        """修改反向表中的一行，expected不为空时只在该行仍指向expected时修改"""
+        rows = self.rows[index_type]
+        if idx >= len(rows):
+            if uuid is None:
+                return
+            grown = np.zeros(max(idx + 1, 2 * len(rows), 1024), dtype=self.UUID_DTYPE)
+            grown[:len(rows)] = rows
+            self.rows[index_type] = rows = grown
+        if expected is not None and rows[idx] != expected.encode("utf-8"):
+            return
+        rows[idx] = uuid.encode("utf-8") if uuid else b""
+    
+    def compact(self):
+        """把增量字典合并回按UUID排序的列
+        
+        新的键和各列构建完成后作为一个快照替换，再清空增量字典
+        """
+        if not self.delta:
+            return
+        old_keys, old_columns = self.sorted
+        changed = np.array([uuid.encode("utf-8") for uuid in self.delta], dtype=self.UUID_DTYPE)
+        keep = ~np.isin(old_keys, changed)
+        added = [(uuid, ids) for uuid, ids in self.delta.items() if ids is not None]
+        keys = np.concatenate([
+            old_keys[keep],
+            np.array([uuid.encode("utf-8") for uuid, _ in added], dtype=self.UUID_DTYPE)
+        ])
+        order = np.argsort(keys, kind="stable")
+        columns = {}
+        for index_type in self.INDEX_TYPES:
+            column = np.concatenate([
+                old_columns[index_type][keep],
+                np.array([ids.get(index_type, -1) for _, ids in added], dtype=np.int64)
+            ])
+            columns[index_type] = column[order]
+        self.sorted = (keys[order], columns)
+        self.delta = {}
+    
+    def _rebuild_rows(self):
+        """由正向列生成反向表"""
+        for index_type, column in self.columns.items():
+            mask = column >= 0
+            size = max(self.next_ids[index_type], int(column[mask].max()) + 1 if mask.any() else 0)
+            rows = np.zeros(size, dtype=self.UUID_DTYPE)
+            rows[column[mask]] = self.keys[mask]
+            self.rows[index_type] = rows
+            self.next_ids[index_type] = size
+    
+    def snapshot(self) -> Dict[str, np.ndarray]:
+        """合并增量后返回保存所需的数组
+        
+        合并后的键和各列不再被原地修改，调用方可以在不持有锁的情况下写盘
+        """
+        self.compact()
+        keys, columns = self.sorted
+        return {
+            "keys": keys,
+            "next_ids": np.array([self.next_ids[t] for t in self.INDEX_TYPES], dtype=np.int64),
+            **columns
+        }
+    
+    @staticmethod
+    def write_snapshot(path: str, arrays: Dict[str, np.ndarray]):
+        """以 .npz 格式写入snapshot()返回的数组并刷盘"""
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def save(self, path: str):
+        """合并增量后以 .npz 格式保存并刷盘"""
+        self.write_snapshot(path, self.snapshot())
+    
+    @classmethod
+    def load(cls, path: str) -> "UuidIdMap":
+        """加载映射文件，兼容旧版pickle格式的 {uuid: {"title_id": ..., ...}} 字典"""
+        with open(path, 'rb') as f:
+            is_npz = f.read(2) == b"PK"
+        if not is_npz:
+            with open(path, 'rb') as f:
+                return cls.from_dict(pickle.load(f))
+        
+        mapping = cls()
+        with np.load(path) as data:
+            mapping.sorted = (data["keys"].astype(cls.UUID_DTYPE),
+                              {t: data[t].astype(np.int64) for t in cls.INDEX_TYPES})
+            for i, index_type in enumerate(cls.INDEX_TYPES):
+                mapping.next_ids[index_type] = int(data["next_ids"][i])
+        mapping._size = len(mapping.keys)
+        mapping._rebuild_rows()
+        return mapping
+    
+    @classmethod
+    def from_dict(cls, legacy: Dict[str, Dict[str, int]]) -> "UuidIdMap":
+        """由旧版字典构建"""
+        mapping = cls()
+        uuids = sorted(legacy)
+        columns = {}
+        for index_type in cls.INDEX_TYPES:
+            key = f"{index_type}_id"
+            columns[index_type] = np.array(
+                [legacy[uuid][key] if legacy[uuid].get(key) is not None else -1 for uuid in uuids],
+                dtype=np.int64)
+        mapping.sorted = (np.array([uuid.encode("utf-8") for uuid in uuids], dtype=cls.UUID_DTYPE), columns)
+        mapping._size = len(uuids)
+        mapping._rebuild_rows()
+        return mapping
+
+
+class PostFilter:
+    """匹配大部分图片的过滤条件，检索时不限制范围，多取候选后再筛选
+    
+    match接收一批候选UUID，返回其中满足条件的UUID集合；ratio为满足条件的图片占比，用于估计需要多取的候选数
+    """
+    
+    def __init__(self, match: Callable[[List[str]], Iterable[str]], ratio: float):
+        self.match = match
+        self.ratio = max(ratio, POST_FILTER_MIN_RATIO)
+
 
 class VectorIndex(abc.ABC):
     """向量索引抽象基类"""
     
-    def __init__(self, index_path: str, index_type: str, uuid_map: Dict, encode_func: Callable):
+    def __init__(self, index_path: str, index_type: str, uuid_map: UuidIdMap, encode_func: Callable):
         """初始化向量索引
         
         参数:
             index_path: 索引文件路径
             index_type: 索引类型标识符 ("title", "description", "image")
-            uuid_map: UUID映射字典的引用
+            uuid_map: UUID映射的引用，同时提供向量ID到UUID的反向查找
             encode_func: 编码函数，接受输入数据并返回向量
         """
         self.index_path = index_path
         self.index_type = index_type
         self.index = None
+        # 向量ID在该索引内只增不复用，替换向量时分配新ID
         self.uuid_map = uuid_map
         self.encode_func = encode_func
+        # 不支持删除的索引(HNSW)中已失效但仍在图中的向量ID，查询时通过ID选择器排除，重建后清空
+        self.dead_ids: List[int] = []
+        self._dead_selector = None
+        # 是否为只读内存映射加载的索引，修改前需要先完整读入内存
+        self.read_only = False
+        # 当前加载的索引版本，由清单文件决定，0表示旧版未分版本的文件
+        self.generation = 0
+        # 全精度向量文件，与索引文件放在同一目录
+        self.raw_vectors = RawVectorStore(f"{os.path.splitext(index_path)[0]}.f32", settings.VECTOR_DIM)
+    
+    @property
+    def configured_layout(self) -> Tuple[str, str]:
+        """配置中该索引使用的索引结构和向量编码，如 TITLE_INDEX_TYPE、TITLE_INDEX_ENCODING"""
+        prefix = self.index_type.upper()
+        kind = settings.get(f"{prefix}_INDEX_TYPE", "flat")
+        encoding = settings.get(f"{prefix}_INDEX_ENCODING", "float32")
+        if kind not in INDEX_KINDS:
+            print(f"未知的{self.index_type}索引类型: {kind}，使用flat")
+            kind = "flat"
+        if encoding not in VECTOR_ENCODINGS:
+            print(f"未知的{self.index_type}向量编码: {encoding}，使用float32")
+            encoding = "float32"
+        # IVF-PQ即采用PQ编码的IVF索引
+        if kind == "ivf_pq":
+            encoding = "pq"
+        elif kind == "ivf_flat" and encoding == "pq":
+            kind = "ivf_pq"
+        return kind, encoding
+    
+    @property
+    def configured_kind(self) -> str:
+        """配置中该索引使用的索引结构"""
+        return self.configured_layout[0]
+    
+    @property
+    def kind(self) -> str:
+        """当前实际使用的索引结构"""
+        return get_index_kind(self.index) if self.index is not None else self.configured_kind
+    
+    @property
+    def encoding(self) -> str:
+        """当前实际使用的向量编码"""
+        return get_index_encoding(self.index) if self.index is not None else self.configured_layout[1]
+    
+    @property
+    def layout(self) -> Tuple[str, str]:
+        """当前实际使用的索引结构和向量编码"""
+        return self.kind, self.encoding
+    
+    @property
+    def tombstones(self) -> int:
+        """已失效但仍占用索引空间的向量数"""
+        return len(self.dead_ids)
+    
+    def _set_dead_ids(self, ids: Iterable[int]):
+        self.dead_ids = [int(idx) for idx in ids]
+        self._dead_selector = None
+    
+    def _tombstone_selector(self) -> Optional[faiss.IDSelector]:
+        """排除失效向量的ID选择器，没有失效向量时返回None；在失效向量变化前复用"""
+        if not self.dead_ids:
+            return None
+        if self._dead_selector is None:
+            dead = np.array(self.dead_ids, dtype=np.int64)
+            batch = faiss.IDSelectorBatch(len(dead), faiss.swig_ptr(dead))
+            selector = faiss.IDSelectorNot(batch)
+            # IDSelectorNot只保存内部选择器的指针，需要同时保留其引用
+            selector.inner = batch
+            self._dead_selector = selector
+        return self._dead_selector
+    
+    @property
+    def supports_removal(self) -> bool:
+        """索引是否支持按ID删除向量，HNSW只能标记失效，待重建时清理"""
+        return self.kind != "hnsw"
+    
+    def _build_index(self, kind: str, encoding: str = "float32", nlist: int = 1) -> faiss.Index:
+        """按索引结构和向量编码创建空索引，均使用内积相似度并支持按ID添加和重建向量
+        
+        参数:
+            kind: 索引结构，见 INDEX_KINDS
+            encoding: 向量编码，见 VECTOR_ENCODINGS
+            nlist: IVF聚类中心数量，仅对IVF索引有效
+        """
+        dim = settings.VECTOR_DIM
+        metric = faiss.METRIC_INNER_PRODUCT
+        if kind == "ivf_pq":
+            encoding = "pq"
+        
+        if kind == "hnsw":
+            if encoding in SQ_TYPES:
+                base = faiss.IndexHNSWSQ(dim, SQ_TYPES[encoding], settings.HNSW_M, metric)
+            elif encoding == "pq":
+                base = faiss.IndexHNSWPQ(dim, settings.PQ_M, settings.HNSW_M, settings.PQ_NBITS, metric)
+            else:
+                base = faiss.IndexHNSWFlat(dim, settings.HNSW_M, metric)
+            base.hnsw.efConstruction = settings.HNSW_EF_CONSTRUCTION
+            return faiss.IndexIDMap2(base)
+        
+        if kind.startswith("ivf"):
+            quantizer = faiss.IndexFlatIP(dim)
+            if encoding in SQ_TYPES:
+                index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, SQ_TYPES[encoding], metric)
+            elif encoding == "pq":
+                index = faiss.IndexIVFPQ(quantizer, dim, nlist, settings.PQ_M, settings.PQ_NBITS, metric)
+            else:
+                index = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+            # IVF原生支持自定义ID，哈希直接映射用于按ID重建向量
+            index.set_direct_map_type(faiss.DirectMap.Hashtable)
+            return index
+        
+        if encoding in SQ_TYPES:
+            base = faiss.IndexScalarQuantizer(dim, SQ_TYPES[encoding], metric)
+        elif encoding == "pq":
+            base = faiss.IndexPQ(dim, settings.PQ_M, settings.PQ_NBITS, metric)
+        else:
+            base = faiss.IndexFlatIP(dim)
+        return faiss.IndexIDMap2(base)
+    
+    def _new_index(self) -> faiss.Index:
+        """创建空索引
+        
+        需要训练的索引（IVF、SQ8、PQ）在积累足够向量并调用rebuild_index之前先使用flat索引存放
+        """
+        kind, encoding = self.configured_layout
+        if kind.startswith("ivf"):
+            return self._build_index("flat")
+        index = self._build_index(kind, encoding)
+        if not index.is_trained:
+            return self._build_index("flat")
+        return index
+    
+    def _search_params(self, sel: Optional[faiss.IDSelector] = None) -> Optional[faiss.SearchParameters]:
+        """按当前配置生成查询参数（HNSW的efSearch、IVF的nprobe），sel为只允许返回的ID选择器"""
+        kind = self.kind
+        extra = {"sel": sel} if sel is not None else {}
+        if kind == "hnsw":
+            return faiss.SearchParametersHNSW(efSearch=settings.HNSW_EF_SEARCH, **extra)
+        if kind.startswith("ivf"):
+            return faiss.SearchParametersIVF(nprobe=settings.IVF_NPROBE, **extra)
+        return faiss.SearchParameters(**extra) if extra else None
     
     def init_index(self):
         """初始化索引"""
-        if os.path.exists(self.index_path):
+        self.index = None
+        self.read_only = False
+        if settings.VECTOR_INDEX_MMAP and self._init_mmap_flat_index():
+            return
+        
+        if os.path.exists(snapshot_path(self.index_path, self.generation)):
             try:
-                self.index = faiss.read_index(self.index_path)
+                self.index = self._read_index()
                 print(f"已加载{self.index_type}向量索引，包含{self.index.ntotal}个向量")
             except Exception as e:
                 print(f"加载{self.index_type}向量索引失败: {e}")
-                self.index = faiss.IndexFlatIP(settings.VECTOR_DIM)  # 使用内积相似度
+                self.index = self._new_index()
         else:
-            self.index = faiss.IndexFlatIP(settings.VECTOR_DIM)
+            self.index = self._new_index()
             print(f"创建了新的{self.index_type}向量索引")
+        
+        if isinstance(self.index, faiss.IndexFlat):
+            self._migrate_to_id_map()
+        
+        self._check_id_map()
+        self._ensure_raw_vectors()
+        self._ensure_consistent_index()
+        
+        if self.layout != self.configured_layout:
+            print(f"{self.index_type}向量索引当前为{self.layout}，配置为{self.configured_layout}，"
+                  f"调用rebuild_indices()后生效")
     
-    def save_index(self):
-        """保存索引到磁盘"""
-        if self.index is not None:
-            try:
-                faiss.write_index(self.index, self.index_path)
-                print(f"{self.index_type}向量索引已保存，包含{self.index.ntotal}个向量")
-            except Exception as e:
-                print(f"保存{self.index_type}向量索引失败: {e}")
+    def _read_index(self) -> faiss.Index:
+        """读取索引文件，开启VECTOR_INDEX_MMAP时以只读内存映射方式加载
+        
+        FAISS目前只支持对IVF倒排表做内存映射，其他索引仍会读入内存
+        """
+        path = snapshot_path(self.index_path, self.generation)
+        if not settings.VECTOR_INDEX_MMAP:
+            return faiss.read_index(path)
+        
+        index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        self.read_only = isinstance(index, faiss.IndexIVF)
+        return index
+    
+    def _init_mmap_flat_index(self) -> bool:
+        """flat/float32索引直接以全精度向量文件的内存映射作为索引，跳过读取FAISS文件
+        
+        返回:
+            bool: 是否成功以内存映射方式加载
+        """
+        if self.configured_layout != ("flat", "float32") or len(self.raw_vectors) == 0:
+            return False
+        
+        self.uuid_map.reserve_ids(self.index_type, len(self.raw_vectors))
+        ids = self.live_ids()
+        if not self.raw_vectors.covers(ids):
+            return False
+        
+        self.index = MmapFlatIndex(self.raw_vectors, ids)
+        print(f"已通过内存映射加载{self.index_type}向量索引，包含{self.index.ntotal}个向量")
+        return True
+    
+    def _ensure_writable(self):
+        """只读内存映射加载的索引在首次修改前完整读入内存"""
+        if not self.read_only:
+            return
+        self.index = faiss.read_index(snapshot_path(self.index_path, self.generation))
+        self.read_only = False
+        print(f"{self.index_type}向量索引已从内存映射切换为可写模式")
+    
+    def _ensure_consistent_index(self):
+        """索引向量数与ID映射不一致时（例如上次以内存映射模式运行），从全精度向量文件重建flat索引"""
+        ids = self.live_ids()
+        if not self.supports_removal or self.index.ntotal == len(ids) or not self.raw_vectors.covers(ids):
+            return
+        print(f"{self.index_type}向量索引与ID映射不一致，从全精度向量文件重建")
+        index = self._build_index("flat")
+        if len(ids):
+            index.add_with_ids(self.raw_vectors.read(ids), ids)
+        self.index = index
+    
+    def _ensure_raw_vectors(self):
+        """全精度向量文件缺失时从索引中恢复（压缩索引只能恢复量化后的近似值）"""
+        ids = self.live_ids()
+        if self.raw_vectors.covers(ids):
+            return
+        if read_only_process:
+            print(f"{self.index_type}全精度向量文件不完整，由写入进程恢复")
+            return
+        print(f"{self.index_type}全精度向量文件不完整，从{self.encoding}索引中恢复{len(ids)}个向量")
+        self.raw_vectors.write(ids, self.index.reconstruct_batch(ids))
+    
+    def _migrate_to_id_map(self):
+        """将旧版按行号寻址的索引迁移为ID映射索引
+        
+        仍被UUID映射引用的行以原行号作为向量ID保留，已失效的行被丢弃，
+        因此UUID映射无需改动
+        """
+        live_ids = [int(idx) for idx in self.live_ids() if idx < self.index.ntotal]
+        migrated = self._build_index("flat")
+        if live_ids:
+            vectors = self.index.reconstruct_n(0, self.index.ntotal)[live_ids]
+            migrated.add_with_ids(vectors, np.array(live_ids, dtype=np.int64))
+        print(f"{self.index_type}向量索引已迁移为ID映射索引，保留{len(live_ids)}/{self.index.ntotal}个向量")
+        self.index = migrated
+    
+    def _check_id_map(self):
+        """核对UUID映射与索引的向量数，统计HNSW中的失效向量
+        
+        已写过全精度向量的ID都不再分配，避免与HNSW中失效但仍在图中的ID冲突
+        """
+        self.uuid_map.reserve_ids(self.index_type, len(self.raw_vectors))
+        live = len(self.live_ids())
+        if live != self.index.ntotal and (self.supports_removal or live > self.index.ntotal):
+            print(f"{self.index_type}向量索引包含{self.index.ntotal}个向量，UUID映射中有{live}个")
+        dead = []
+        if not self.supports_removal and isinstance(self.index, faiss.IndexIDMap2):
+            dead = np.setdiff1d(faiss.vector_to_array(self.index.id_map), self.live_ids())
+        self._set_dead_ids(dead)
     
-    def add_vector(self, uuid: str, data):
+    def snapshot_index(self) -> Union[faiss.Index, np.ndarray, str, None]:
+        """在内存中复制当前索引，供检查点在不持有锁的情况下写盘
+        
+        返回索引的副本（不支持复制的索引返回序列化后的字节数组）；只读内存映射加载、
+        尚未修改的索引与当前版本文件相同，返回该文件路径；内存映射的flat索引即全精度向量文件本身，返回None
+        """
+        if self.index is None or isinstance(self.index, MmapFlatIndex):
+            return None
+        if self.read_only:
+            return snapshot_path(self.index_path, self.generation)
+        try:
+            return faiss.clone_index(self.index)
+        except RuntimeError:
+            return faiss.serialize_index(self.index)
+    
+    def write_snapshot(self, snapshot: Union[faiss.Index, np.ndarray, str, None], generation: int) -> bool:
+        """把snapshot_index()的结果写为指定版本的文件并刷到磁盘
+        
+        新版本写入新文件，不覆盖当前版本，由清单文件切换后才生效
+        
+        返回:
+            bool: 是否保存成功
+        """
+        try:
+            if snapshot is not None:
+                path = snapshot_path(self.index_path, generation)
+                if isinstance(snapshot, str):
+                    shutil.copyfile(snapshot, path)
+                elif isinstance(snapshot, faiss.Index):
+                    faiss.write_index(snapshot, path)
+                else:
+                    with open(path, 'wb') as f:
+                        f.write(memoryview(snapshot))
+                _fsync(path)
+            # 全精度向量文件只追加写入，快照引用的行都已写入，刷盘即可
+            if os.path.exists(self.raw_vectors.path):
+                _fsync(self.raw_vectors.path)
+            print(f"{self.index_type}向量索引版本{generation}已保存")
+        except Exception as e:
+            print(f"保存{self.index_type}向量索引失败: {e}")
+            return False
+        return True
+
+    
+    def uuid_at(self, idx: int) -> Optional[str]:
+        """返回向量ID对应的UUID，常数时间"""
+        return self.uuid_map.uuid_at(self.index_type, idx)
+    
+    def remove_vector(self, uuid: str) -> bool:
+        """从索引中真正删除UUID对应的向量，并记入变更日志
+        
+        返回:
+            bool: 该UUID在此索引中是否存在向量
+        """
+        _require_writer()
+        with index_lock.write():
+            if not self._remove(uuid):
+                return False
+            vector_log.append(VectorLog.OP_REMOVE, self.index_type, uuid)
+        return True
+    
+    def _remove(self, uuid: str) -> bool:
+        """从索引中删除UUID对应的向量，不写日志（重放日志时直接调用）"""
+        idx = self.uuid_map.get(uuid, self.index_type)
+        if idx is None:
+            return False
+        
+        self._discard_id(idx)
+        self.uuid_map.unset(uuid, self.index_type)
+        return True
+    
+    def _discard_id(self, idx: int):
+        """从FAISS索引中移除向量ID，不支持删除的索引只记为失效向量"""
+        if self.index is None:
+            return
+        self._ensure_writable()
+        if self.supports_removal:
+            self.index.remove_ids(np.array([idx], dtype=np.int64))
+        else:
+            self._set_dead_ids(self.dead_ids + [idx])
+    
+    def add_vector(self, uuid: str, data, **encode_kwargs):
         """添加向量到索引
         
         参数:
             uuid: 数据的UUID
             data: 要编码的数据(文本或图像路径)
+            encode_kwargs: 传给编码函数的额外参数，例如图像的cache_key
+        
+        如果该UUID在此索引中已有向量，则删除原向量（HNSW记为失效）并以新ID添加
         """
+        _require_writer()
         if self.index is None:
             self.init_index()
         
-        # 获取向量
-        vector = self._get_vector(data)
+        # 获取向量（编码耗时较长，不持有索引锁）
+        vector = self._get_vector(data, **encode_kwargs)
+        with index_lock.write():
+            idx = self._insert(uuid, vector)
+            vector_log.append(VectorLog.OP_ADD, self.index_type, uuid, idx, vector)
+        return idx
+    
+    def _insert(self, uuid: str, vector: np.ndarray, new_id: Optional[int] = None) -> int:
+        """把已编码的向量写入索引，不写日志
         
-        # 添加向量到索引
-        idx = self.index.ntotal
-        self.index.add(vector)
+        重放日志时直接调用，并传入日志中记录的ID作为新分配的ID，保证重放前后ID一致
+        """
+        self._ensure_writable()
         
-        # 更新UUID映射
-        if uuid not in self.uuid_map:
-            self.uuid_map[uuid] = {f"{self.index_type}_id": idx}
-        else:
-            self.uuid_map[uuid][f"{self.index_type}_id"] = idx
+        idx = self.uuid_map.get(uuid, self.index_type)
+        if idx is not None:
+            # 已有向量时删除旧ID（HNSW记为失效），全精度向量文件中的旧行留给引用它的历史版本
+            self._discard_id(idx)
+        idx = self.uuid_map.allocate_id(self.index_type) if new_id is None else new_id
+        
+        # 添加向量到索引，同时保存全精度向量
+        self.index.add_with_ids(vector, np.array([idx], dtype=np.int64))
+        if not isinstance(self.index, MmapFlatIndex):
+            self.raw_vectors.write([idx], vector)
+        self.uuid_map.set(uuid, self.index_type, idx)
         
         return idx
     
-    def search(self, query, limit: int = 20) -> List[Dict[str, Any]]:
+    def search(self, query, limit: int = 20, allowed_uuids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
         """搜索相似向量
         
         参数:
             query: 查询数据(文本或图像路径)
             limit: 返回结果数量上限
+            allowed_uuids: 只在这些UUID中搜索，None表示不限制
         """
         if self.index is None or self.index.ntotal == 0:
             return []
@@ -92,37 +1012,21 @@ class VectorIndex(abc.ABC):
         
         # 执行搜索
         try:
-            D, I = self.index.search(query_vector, min(limit, self.index.ntotal))
-            
-            # 转换结果
-            results = []
-            for i, (distance, idx) in enumerate(zip(D[0], I[0])):
-                # 查找对应的UUID
-                uuid = None
-                for u, ids in self.uuid_map.items():
-                    if ids.get(f"{self.index_type}_id") == idx:
-                        uuid = u
-                        break
-                
-                if uuid:
-                    results.append({
-                        "uuid": uuid,
-                        "similarity": float(distance),
-                        "index": int(idx)
-                    })
-            
-            return results
+            with index_lock.read():
+                return self._search(query_vector, limit, self._allowed_ids(allowed_uuids))
         
         except Exception as e:
             print(f"{self.index_type}搜索失败: {e}")
             return []
     
-    def search_by_vector(self, query_vector: np.ndarray, limit: int = 20) -> List[Dict[str, Any]]:
+    def search_by_vector(self, query_vector: np.ndarray, limit: int = 20,
+                         allowed_uuids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
         """使用向量直接搜索相似向量
         
         参数:
             query_vector: 查询向量
             limit: 返回结果数量上限
+            allowed_uuids: 只在这些UUID中搜索，None表示不限制
         """
         if self.index is None or self.index.ntotal == 0:
             return []
@@ -140,117 +1044,353 @@ class VectorIndex(abc.ABC):
             
         # 执行搜索
         try:
-            D, I = self.index.search(query_vector, min(limit, self.index.ntotal))
-            
-            # 转换结果
-            results = []
-            for i, (distance, idx) in enumerate(zip(D[0], I[0])):
-                # 查找对应的UUID
-                uuid = None
-                for u, ids in self.uuid_map.items():
-                    if ids.get(f"{self.index_type}_id") == idx:
-                        uuid = u
-                        break
-                
-                if uuid:
-                    results.append({
-                        "uuid": uuid,
-                        "similarity": float(distance),
-                        "index": int(idx)
-                    })
-            
-            return results
+            with index_lock.read():
+                return self._search(query_vector, limit, self._allowed_ids(allowed_uuids))
         
         except Exception as e:
             print(f"{self.index_type}向量搜索失败: {e}")
             return []
     
-    def search_by_id(self, idx: int, limit: int = 20) -> List[Dict[str, Any]]:
-        """通过内部索引ID搜索相似向量"""
+    def search_by_id(self, idx: int, limit: int = 20,
+                     allowed_uuids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """通过内部索引ID搜索相似向量
+        
+        直接取出该ID对应的已存向量做一次FAISS查询，结果中不包含源向量本身；
+        allowed_uuids不为None时只在这些UUID中搜索
+        """
         if self.index is None or self.index.ntotal == 0:
             return []
         
         try:
-            # 确保索引在有效范围内
-            if idx < 0 or idx >= self.index.ntotal:
-                print(f"索引ID {idx} 超出范围 [0, {self.index.ntotal-1}]")
-                return []
-            
-            # 方法1: 简单地查询所有索引，通过UUID映射找到匹配的结果
-            results = []
-            source_uuid = None
-            
-            # 先找到对应的源UUID
-            for u, ids in self.uuid_map.items():
-                if ids.get(f"{self.index_type}_id") == idx:
-                    source_uuid = u
-                    break
-            
-            if not source_uuid:
-                print(f"找不到索引ID {idx} 对应的UUID")
-                return []
-            
-            # 对于每个索引项，创建一个结果
-            for uuid, ids in self.uuid_map.items():
-                # 跳过自己
-                if uuid == source_uuid:
-                    continue
-                
-                # 获取此UUID的索引ID
-                result_id = ids.get(f"{self.index_type}_id")
-                if result_id is not None:
-                    # 尝试使用FAISS的方式计算相似度
-                    try:
-                        # 使用范围内的索引进行查询
-                        if isinstance(self.index, faiss.IndexFlat):
-                            # 只用到单个ID进行搜索，不取向量
-                            D, I = self.index.search(self.index.reconstruct(idx).reshape(1, -1), limit + 1)
-                            
-                            # 找到当前UUID对应的位置和分数
-                            for i, result_idx in enumerate(I[0]):
-                                if result_idx == result_id:
-                                    # 找到了当前UUID，添加结果
-                                    results.append({
-                                        "uuid": uuid,
-                                        "similarity": float(D[0][i]),
-                                        "index": int(result_id)
-                                    })
-                                    break
-                    except Exception as e:
-                        # 如果FAISS检索失败，使用备用计算方法
-                        print(f"FAISS计算相似度失败: {e}，将使用备用方法")
-                        # 简单地按照索引ID的接近程度生成一个相似度
-                        similarity = 1.0 - abs(idx - result_id) / self.index.ntotal
-                        
-                        results.append({
-                            "uuid": uuid,
-                            "similarity": float(max(0.1, similarity)),  # 确保相似度至少为0.1
-                            "index": int(result_id)
-                        })
-            
-            # 按相似度排序
-            results.sort(key=lambda x: x["similarity"], reverse=True)
-            
-            # 限制结果数量
-            return results[:limit]
-                
+            with index_lock.read():
+                source_uuid = self.uuid_at(idx)
+                if not source_uuid:
+                    print(f"找不到索引ID {idx} 对应的UUID")
+                    return []
+                query_vector = self._stored_vectors(np.array([idx], dtype=np.int64))
+                # 多取一个结果，用于排除源向量本身
+                results = self._search(query_vector, limit + 1, self._allowed_ids(allowed_uuids))
         except Exception as e:
             print(f"{self.index_type}ID搜索失败: {e}")
-            import traceback
-            traceback.print_exc()
             return []
+        
+        results = [r for r in results if r["uuid"] != source_uuid]
+        return results[:limit]
     
-    def _get_vector(self, data) -> np.ndarray:
+    def search_many(self, query_vectors: np.ndarray, limit: int = 20,
+                    allowed_uuids: Optional[Iterable[str]] = None) -> List[List[Dict[str, Any]]]:
+        """批量搜索多个查询向量，所有查询合并为一次FAISS调用
+        
+        参数:
+            query_vectors: 查询向量矩阵 [n, dim]（单个向量也可以）
+            limit: 每个查询返回结果数量上限
+            allowed_uuids: 只在这些UUID中搜索，None表示不限制
+        
+        返回:
+            与查询向量一一对应的结果列表
+        """
+        query_vectors = np.ascontiguousarray(np.atleast_2d(query_vectors), dtype=np.float32)
+        if self.index is None or self.index.ntotal == 0:
+            return [[] for _ in range(len(query_vectors))]
+        
+        try:
+            with index_lock.read():
+                return self._search_batch(query_vectors, limit, self._allowed_ids(allowed_uuids))
+        
+        except Exception as e:
+            print(f"{self.index_type}批量向量搜索失败: {e}")
+            return [[] for _ in range(len(query_vectors))]
+    
+    def _allowed_ids(self, allowed_uuids: Union[Iterable[str], PostFilter, None]) -> Union[np.ndarray, PostFilter, None]:
+        """把允许的UUID集合转换为该索引中的向量ID，None表示不限制，后过滤条件原样返回"""
+        if allowed_uuids is None or isinstance(allowed_uuids, PostFilter):
+            return allowed_uuids
+        return self.uuid_map.ids_for(allowed_uuids, self.index_type)
+    
+    def _post_filter_search(self, query_vectors: np.ndarray, limit: int,
+                            post_filter: PostFilter) -> List[List[Dict[str, Any]]]:
+        """不限制范围检索后筛选结果，候选不足limit个时加倍多取，直到取完所有向量"""
+        live = self.index.ntotal - self.tombstones
+        fetch = int(np.ceil(limit / post_filter.ratio)) * 2
+        while True:
+            batch = self._search_batch(query_vectors, min(fetch, live))
+            allowed = set(post_filter.match(list({r["uuid"] for results in batch for r in results})))
+            batch = [[r for r in results if r["uuid"] in allowed] for results in batch]
+            if fetch >= live or all(len(results) >= limit for results in batch):
+                return [results[:limit] for results in batch]
+            fetch *= 2
+    
+    def _search(self, query_vector: np.ndarray, limit: int,
+                allowed_ids: Union[np.ndarray, PostFilter, None] = None) -> List[Dict[str, Any]]:
+        """执行单个查询向量的搜索"""
+        return self._search_batch(query_vector, limit, allowed_ids)[0]
+    
+    def _search_batch(self, query_vectors: np.ndarray, limit: int,
+                      allowed_ids: Union[np.ndarray, PostFilter, None] = None) -> List[List[Dict[str, Any]]]:
+        """对一批查询向量执行一次FAISS查询并转换结果，HNSW中的失效向量通过ID选择器排除
+        
+        压缩索引在配置了RERANK_FACTOR时多取候选，再用全精度向量精确重排序。
+        指定allowed_ids时过滤条件在检索内部生效：候选较少时直接精确计算，
+        否则以位图ID选择器传给FAISS，一次查询即可得到limit个满足条件的结果；
+        过滤条件匹配大部分图片时传入PostFilter，检索后再筛选
+        """
+        if isinstance(allowed_ids, PostFilter):
+            return self._post_filter_search(query_vectors, limit, allowed_ids)
+        if allowed_ids is not None:
+            if len(allowed_ids) == 0:
+                return [[] for _ in range(len(query_vectors))]
+            if len(allowed_ids) <= EXACT_FILTER_MAX_IDS and self.raw_vectors.covers(allowed_ids):
+                return self._exact_search(query_vectors, limit, allowed_ids)
+        
+        fetch = limit
+        rerank = self.encoding != "float32" and settings.RERANK_FACTOR > 1
+        if rerank:
+            fetch = limit * settings.RERANK_FACTOR
+        
+        if allowed_ids is None:
+            k = max(1, min(fetch, self.index.ntotal - self.tombstones))
+            D, I = self.index.search(query_vectors, k, params=self._search_params(self._tombstone_selector()))
+        else:
+            # 允许的ID都是有效向量，不需要为失效向量多取
+            k = min(fetch, len(allowed_ids))
+            allowed = np.zeros(int(allowed_ids[-1]) + 1, dtype=bool)
+            allowed[allowed_ids] = True
+            if isinstance(self.index, MmapFlatIndex):
+                D, I = self.index.search(query_vectors, k, allowed=allowed)
+            else:
+                # 位图按字节计长度，且需在查询结束前保持引用
+                bitmap = np.packbits(allowed, bitorder="little")
+                sel = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+                D, I = self.index.search(query_vectors, k, params=self._search_params(sel))
+        
+        batch = []
+        for query_vector, distances, indices in zip(query_vectors, D, I):
+            results = self._collect_results(distances, indices)
+            if rerank:
+                results = self._rerank(query_vector, results)
+            batch.append(results[:limit])
+        return batch
+    
+    def _exact_search(self, query_vectors: np.ndarray, limit: int, ids: np.ndarray) -> List[List[Dict[str, Any]]]:
+        """在给定的向量ID中用全精度向量精确计算相似度，一次矩阵乘法处理所有查询"""
+        scores = query_vectors @ self.raw_vectors.read(ids).T
+        batch = []
+        for row in scores:
+            top = np.argsort(-row, kind="stable")[:limit]
+            batch.append(self._collect_results(row[top], ids[top]))
+        return batch
+    
+    def _rerank(self, query_vector: np.ndarray, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """用磁盘上的全精度向量重新计算相似度并排序"""
+        ids = np.array([r["index"] for r in results], dtype=np.int64)
+        if not self.raw_vectors.covers(ids):
+            return results
+        
+        scores = self.raw_vectors.read(ids) @ query_vector
+        for result, score in zip(results, scores):
+            result["similarity"] = float(score)
+        results.sort(key=lambda x: x["similarity"], reverse=True)
+        return results
+    
+    def _stored_vectors(self, ids: np.ndarray) -> np.ndarray:
+        """读取已存向量，优先使用全精度向量文件，否则从索引中重建"""
+        if self.raw_vectors.covers(ids):
+            return self.raw_vectors.read(ids)
+        return self.index.reconstruct_batch(ids)
+    
+    def _bytes_per_vector(self) -> float:
+        """估算索引中每个向量占用的内存字节数（不含ID映射等附加结构）"""
+        base = _unwrap_index(self.index)
+        if isinstance(base, faiss.IndexHNSW):
+            return float(faiss.downcast_index(base.storage).sa_code_size() + settings.HNSW_M * 2 * 4)
+        try:
+            return float(base.sa_code_size())
+        except Exception:
+            return float(settings.VECTOR_DIM * 4)
+    
+    def live_ids(self) -> np.ndarray:
+        """返回所有有效向量ID"""
+        return self.uuid_map.live_ids(self.index_type)
+    
+    def rebuild_index(self) -> Dict[str, Any]:
+        """按配置的索引结构重建索引
+        
+        用已存向量训练IVF索引（聚类中心数量不超过样本数允许的范围），
+        同时清理HNSW中的失效向量。样本不足以训练IVF时保持flat索引。
+        
+        新索引在锁外构建：训练只使用抽样的向量，全部向量按REBUILD_CHUNK_SIZE行分块读取并加入，
+        读取每块时只短暂持有读锁，构建期间检索和写入照常进行；最后在写锁内补上构建期间
+        新增的向量、去掉已删除的向量（向量ID不复用，按ID集合比较即可），再替换当前索引。
+        
+        返回:
+            Dict[str, Any]: 重建结果，包括前后的索引结构和向量数量
+        """
+        with index_lock.write():
+            if self.index is None:
+                self.init_index()
+        
+        with index_lock.read():
+            previous_kind, previous_encoding = self.layout
+            ids = self.live_ids()
+        
+        kind, encoding = self.configured_layout
+        nlist = 1
+        if kind.startswith("ivf"):
+            nlist = min(settings.IVF_NLIST, len(ids) // MIN_POINTS_PER_CENTROID)
+        min_points = 2 ** settings.PQ_NBITS if encoding == "pq" else 1
+        if nlist < 1 or len(ids) < min_points:
+            print(f"{self.index_type}向量数量({len(ids)})不足以训练{kind}/{encoding}索引，保持flat索引")
+            kind, encoding = "flat", "float32"
+        
+        mmap_flat = (settings.VECTOR_INDEX_MMAP and (kind, encoding) == ("flat", "float32")
+                     and self.raw_vectors.covers(ids))
+        index = None
+        if not mmap_flat:
+            index = self._build_index(kind, encoding, nlist)
+            if not index.is_trained:
+                if len(ids) == 0:
+                    index = self._build_index("flat")
+                    kind, encoding = "flat", "float32"
+                else:
+                    index.train(self._read_chunked(self._train_sample(ids, nlist, encoding)))
+            for offset in range(0, len(ids), REBUILD_CHUNK_SIZE):
+                chunk = ids[offset:offset + REBUILD_CHUNK_SIZE]
+                index.add_with_ids(self._read_chunked(chunk), chunk)
+            # 构建期间写入的向量先在锁外补入，直到剩余数量足够少
+            for _ in range(REBUILD_CATCH_UP_ROUNDS):
+                with index_lock.read():
+                    added = np.setdiff1d(self.live_ids(), ids, assume_unique=True)
+                if len(added) <= REBUILD_SWAP_MAX_ADDS:
+                    break
+                for offset in range(0, len(added), REBUILD_CHUNK_SIZE):
+                    chunk = added[offset:offset + REBUILD_CHUNK_SIZE]
+                    index.add_with_ids(self._read_chunked(chunk), chunk)
+                ids = np.union1d(ids, added)
+        
+        with index_lock.write():
+            current = self.live_ids()
+            if mmap_flat:
+                # 内存映射的flat索引就是全精度向量文件本身，按当前有效ID直接创建
+                index = MmapFlatIndex(self.raw_vectors, current)
+                dead = []
+            else:
+                added = np.setdiff1d(current, ids, assume_unique=True)
+                removed = np.setdiff1d(ids, current, assume_unique=True)
+                if len(added):
+                    index.add_with_ids(self._stored_vectors(added), added)
+                dead = []
+                if len(removed):
+                    if get_index_kind(index) == "hnsw":
+                        dead = removed
+                    else:
+                        index.remove_ids(removed)
+            self.index = index
+            self.read_only = False
+            self._set_dead_ids(dead)
+            vectors = int(index.ntotal)
+        
+        print(f"{self.index_type}向量索引已重建为{kind}/{encoding}，包含{vectors}个向量")
+        return {
+            "index_type": self.index_type,
+            "previous_kind": previous_kind,
+            "previous_encoding": previous_encoding,
+            "kind": kind,
+            "encoding": encoding,
+            "nlist": nlist if kind.startswith("ivf") else None,
+            "vectors": vectors
+        }
+    
+    def _train_sample(self, ids: np.ndarray, nlist: int, encoding: str) -> np.ndarray:
+        """抽取训练样本的向量ID（升序），样本数按聚类中心和PQ码字数量确定"""
+        centroids = max(nlist, 2 ** settings.PQ_NBITS if encoding == "pq" else 1)
+        size = max(REBUILD_MIN_TRAIN_SAMPLES, centroids * REBUILD_TRAIN_SAMPLES_PER_CENTROID)
+        if len(ids) <= size:
+            return ids
+        return np.sort(np.random.default_rng(0).choice(ids, size=size, replace=False))
+    
+    def _read_chunked(self, ids: np.ndarray) -> np.ndarray:
+        """分块读取已存向量，每块只短暂持有读锁"""
+        if len(ids) <= REBUILD_CHUNK_SIZE:
+            with index_lock.read():
+                return self._stored_vectors(ids)
+        vectors = np.empty((len(ids), settings.VECTOR_DIM), dtype=np.float32)
+        for offset in range(0, len(ids), REBUILD_CHUNK_SIZE):
+            with index_lock.read():
+                vectors[offset:offset + REBUILD_CHUNK_SIZE] = self._stored_vectors(ids[offset:offset + REBUILD_CHUNK_SIZE])
+        return vectors
+    
+    def evaluate_recall(self, sample_size: int = 100, k: int = 10) -> Dict[str, Any]:
+        """以精确内积检索为基准评估当前索引的召回率和查询耗时
+        
+        从已存的全精度向量中抽样作为查询（最多RECALL_MAX_SAMPLES个），基准结果来自对全部全精度向量的暴力检索，
+        因此结果同时反映近似检索和向量压缩（含重排序）带来的召回损失。
+        基准检索按RECALL_CHUNK_SIZE行分块读取向量并合并结果，不在内存中复制整个索引；
+        每块只短暂持有读锁，评估期间写入不会被长时间阻塞，评估开始后的修改不计入结果
+        """
+        with index_lock.read():
+            if self.index is None or self.index.ntotal == 0:
+                return {"index_type": self.index_type, "kind": self.kind, "queries": 0}
+            ids = self.live_ids()
+            rng = np.random.default_rng(0)
+            sample = np.sort(rng.choice(len(ids), size=min(sample_size, RECALL_MAX_SAMPLES, len(ids)), replace=False))
+            queries = self._stored_vectors(ids[sample])
+        k = min(k, len(ids))
+        
+        start = time.perf_counter()
+        heap = faiss.ResultHeap(len(queries), k, keep_max=True)
+        rows = np.arange(len(queries))
+        for offset in range(0, len(ids), RECALL_CHUNK_SIZE):
+            chunk = ids[offset:offset + RECALL_CHUNK_SIZE]
+            with index_lock.read():
+                vectors = self._stored_vectors(chunk)
+            heap.add_result_subset(rows, queries @ vectors.T, chunk)
+        heap.finalize()
+        expected = heap.I
+        exact_ms = (time.perf_counter() - start) * 1000
+        
+        start = time.perf_counter()
+        with index_lock.read():
+            actual = [[r["index"] for r in results] for results in self._search_batch(queries, k)]
+        approx_ms = (time.perf_counter() - start) * 1000
+        
+        hits = sum(len(set(e) & set(a)) for e, a in zip(expected, actual))
+        return {
+            "index_type": self.index_type,
+            "kind": self.kind,
+            "encoding": self.encoding,
+            "index_bytes_per_vector": self._bytes_per_vector(),
+            "queries": len(queries),
+            "k": k,
+            "recall": hits / (len(queries) * k),
+            "exact_ms_per_query": exact_ms / len(queries),
+            "index_ms_per_query": approx_ms / len(queries)
+        }
+    
+    def _collect_results(self, distances: np.ndarray, indices: np.ndarray) -> List[Dict[str, Any]]:
+        """将FAISS返回的向量ID转换为带UUID的结果，跳过已删除的ID"""
+        results = []
+        for distance, idx in zip(distances, indices):
+            uuid = self.uuid_at(int(idx))
+            if uuid:
+                results.append({
+                    "uuid": uuid,
+                    "similarity": float(distance),
+                    "index": int(idx)
+                })
+        return results
+    
+    def _get_vector(self, data, **encode_kwargs) -> np.ndarray:
         """从数据中获取向量表示
         
         参数:
             data: 要编码的数据
+            encode_kwargs: 传给编码函数的额外参数
         
         返回:
             numpy.ndarray: 归一化的向量表示
         """
         # 使用编码函数获取向量
-        vector = self.encode_func(data)
+        vector = self.encode_func(data, **encode_kwargs)
         
         # 确保向量为numpy数组，并转换为float32类型
         if not isinstance(vector, np.ndarray):
@@ -269,95 +1409,589 @@ class VectorIndex(abc.ABC):
 class TextVectorIndex(VectorIndex):
     """文本向量索引类"""
     
-    def __init__(self, index_path: str, index_type: str, uuid_map: Dict):
+    def __init__(self, index_path: str, index_type: str, uuid_map: UuidIdMap):
         super().__init__(index_path, index_type, uuid_map, encode_text)
 
 
 class ImageVectorIndex(VectorIndex):
     """图像向量索引类"""
     
-    def __init__(self, index_path: str, uuid_map: Dict):
+    def __init__(self, index_path: str, uuid_map: UuidIdMap):
         super().__init__(index_path, "image", uuid_map, self._encode_image_wrapper)
     
-    def _encode_image_wrapper(self, image_path: str) -> np.ndarray:
+    def _encode_image_wrapper(self, image_path: Union[str, Image.Image], cache_key: Optional[str] = None) -> np.ndarray:
         """图像编码包装函数，处理图像路径转换为向量
         
         参数:
-            image_path: 图像文件路径
+            image_path: 图像文件路径，或已在内存中打开的PIL图像（上传时不再读取磁盘文件）
+            cache_key: 图片文件内容哈希（images.hash_value），为空时读取文件计算
             
         返回:
             numpy.ndarray: 图像的向量表示
         """
+        if isinstance(image_path, Image.Image):
+            return encode_image(image_path, cache_key=cache_key)
+        
         if not os.path.exists(image_path):
             raise FileNotFoundError(f"图像文件不存在: {image_path}")
         
-        # 打开图像
+        # 缓存键按路径计算，PIL图像本身不再推导缓存键
+        cache_key = cache_key or get_image_cache_key(image_path)
+        # 打开图像（只读取文件头，缓存命中时不解码像素）
         img = Image.open(image_path)
         # 生成向量
-        return encode_image(img)
+        return encode_image(img, cache_key=cache_key)
+
+
+class IndexLock:
+    """向量索引的读写锁
+    
+    检索（FAISS查询、UUID映射查找、读取全精度向量）持有读锁，可以并发执行；
+    增删向量、检查点快照和重新加载持有写锁，与所有检索互斥。
+    写锁可重入，持有写锁的线程可以再获取读锁；有线程等待写锁时新的读者排队，避免写入饿死。
+    持有读锁时不能再获取写锁
+    """
+    
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer: Optional[int] = None
+        self._write_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()
+    
+    @contextmanager
+    def read(self):
+        depth = getattr(self._local, "read_depth", 0)
+        if depth or self._writer == threading.get_ident():
+            # 本线程已持有读锁或写锁
+            self._local.read_depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.read_depth = depth
+            return
+        
+        with self._cond:
+            while self._writer is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        self._local.read_depth = 1
+        try:
+            yield
+        finally:
+            self._local.read_depth = 0
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+    
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+            else:
+                self._writers_waiting += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._cond.wait()
+                finally:
+                    self._writers_waiting -= 1
+                self._writer = me
+                self._write_depth = 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self._writer = None
+                    self._cond.notify_all()
 
 
 # 全局变量
-uuid_map = {}  # UUID到索引ID的映射
+uuid_map = UuidIdMap()  # UUID到索引ID的映射
 title_index = None
 description_index = None
 image_index = None
+# 索引版本清单，记录当前版本和保留的历史版本，与UUID映射文件放在同一目录
+MANIFEST_PATH = os.path.join(os.path.dirname(settings.UUID_MAP_PATH), "manifest.json")
+manifest: Dict[str, Any] = {"generation": 0, "generations": []}
+# 向量变更日志，与UUID映射文件放在同一目录
+vector_log = VectorLog(f"{os.path.splitext(settings.UUID_MAP_PATH)[0]}_vectors.log", settings.VECTOR_DIM)
+# 保护索引、UUID映射和变更日志：检索持有读锁，写操作和检查点持有写锁
+index_lock = IndexLock()
+# 同一时间只执行一个检查点或回滚，获取顺序总是先checkpoint_lock后index_lock
+checkpoint_lock = threading.Lock()
+# 同一时间只执行一次索引重建或回滚；重建在锁外构建新索引，不持有checkpoint_lock和index_lock，
+# 回滚时先获取rebuild_lock再获取checkpoint_lock
+rebuild_lock = threading.Lock()
+# 写入锁文件：同一数据目录只允许一个进程修改索引、UUID映射、变更日志和全精度向量文件，
+# 否则各进程独立分配向量ID，会在共享的全精度向量文件中互相覆盖
+WRITER_LOCK_PATH = os.path.join(os.path.dirname(settings.UUID_MAP_PATH), "writer.lock")
+# 未配置只读的进程启动时等待写入锁的最长时间（秒），覆盖重启时旧进程尚未退出的情况
+WRITER_LOCK_TIMEOUT = 10.0
+_writer_lock_file = None
+# 当前进程是否以只读方式加载索引（配置了VECTOR_INDEX_READ_ONLY）
+read_only_process = False
+# 只读进程检查清单版本的最小间隔（秒）
+MANIFEST_CHECK_INTERVAL = 1.0
+_manifest_checked_at = 0.0
+
+
+def _acquire_writer_lock(timeout: float = 0.0) -> bool:
+    """获取写入锁，最多等待timeout秒，进程退出时由操作系统释放
+    
+    获得锁后在锁文件中写入当前进程号，便于排查占用写入锁的进程
+    
+    返回:
+        bool: 当前进程是否为写入进程
+    """
+    global _writer_lock_file
+    if _writer_lock_file is not None:
+        return True
+    os.makedirs(os.path.dirname(WRITER_LOCK_PATH) or ".", exist_ok=True)
+    deadline = time.monotonic() + timeout
+    while True:
+        f = open(WRITER_LOCK_PATH, "a+")
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            break
+        except OSError:
+            f.close()
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.2)
+    if fcntl is not None:
+        f.truncate(0)
+        f.write(str(os.getpid()))
+        f.flush()
+    _writer_lock_file = f
+    return True
+
+
+def release_writer_lock():
+    """释放写入锁
+    
+    用于不处理请求的父进程，例如uvicorn重载模式下导入了应用、随后由子进程处理请求的监视进程
+    """
+    global _writer_lock_file
+    if _writer_lock_file is not None:
+        _writer_lock_file.close()
+        _writer_lock_file = None
+
+
+def _writer_lock_owner() -> str:
+    """读取锁文件中记录的写入进程号"""
+    try:
+        with open(WRITER_LOCK_PATH, "r") as f:
+            return f.read().strip() or "未知"
+    except OSError:
+        return "未知"
+
+
+def _require_writer():
+    """只读进程中修改向量索引时报错"""
+    if read_only_process:
+        raise RuntimeError("当前进程配置为只读（VECTOR_INDEX_READ_ONLY），写请求应发往写入实例")
+
+
+def _reload_if_changed():
+    """只读进程：写入进程完成检查点、清单切换到新版本后重新加载索引"""
+    global _manifest_checked_at, uuid_map, title_index, description_index, image_index
+    if not read_only_process or time.monotonic() - _manifest_checked_at < MANIFEST_CHECK_INTERVAL:
+        return
+    _manifest_checked_at = time.monotonic()
+    try:
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            generation = json.load(f)["generation"]
+    except (OSError, ValueError, KeyError):
+        return
+    if generation == manifest["generation"]:
+        return
+    
+    with checkpoint_lock, index_lock.write():
+        print(f"索引版本已由写入进程更新为{generation}，重新加载")
+        uuid_map = UuidIdMap()
+        title_index = description_index = image_index = None
+        init_indices()
 
 
 def init_indices():
     """初始化所有向量索引"""
-    global uuid_map, title_index, description_index, image_index
+    global uuid_map, title_index, description_index, image_index, manifest
+    
+    global read_only_process
     
     # 如果所有索引都已初始化，则直接返回
     if title_index is not None and description_index is not None and image_index is not None:
         return
     
+    # 写入进程和只读进程必须显式划分：未配置只读却拿不到写入锁时拒绝启动，
+    # 避免多个工作进程中只有一个能写、其余进程的上传和编辑随机失败
+    read_only_process = settings.VECTOR_INDEX_READ_ONLY
+    if read_only_process:
+        print("向量索引以只读方式加载，写入进程检查点后自动重新加载")
+    elif not _acquire_writer_lock(WRITER_LOCK_TIMEOUT):
+        raise RuntimeError(
+            f"向量索引写入锁{WRITER_LOCK_PATH}被进程{_writer_lock_owner()}持有。同一数据目录只能有一个写入进程："
+            f"写入实例以单个工作进程运行（--workers 1），其余处理检索的实例设置VECTOR_INDEX_READ_ONLY: true"
+        )
+    
+    manifest = _load_manifest()
+    generation = manifest["generation"]
+    
     # 加载UUID映射
     if not uuid_map:  # 只在uuid_map为空时加载
-        if os.path.exists(settings.UUID_MAP_PATH):
+        uuid_map_path = snapshot_path(settings.UUID_MAP_PATH, generation)
+        if os.path.exists(uuid_map_path):
             try:
-                with open(settings.UUID_MAP_PATH, 'rb') as f:
-                    uuid_map = pickle.load(f)
+                uuid_map = UuidIdMap.load(uuid_map_path)
                 print(f"已加载UUID映射，包含{len(uuid_map)}个条目")
             except Exception as e:
                 print(f"加载UUID映射失败: {e}")
-                uuid_map = {}
+                uuid_map = UuidIdMap()
         else:
-            uuid_map = {}
+            uuid_map = UuidIdMap()
             print("创建了新的UUID映射")
     
     # 初始化各个索引（如果尚未初始化）
     if title_index is None:
         title_index = TextVectorIndex(settings.TITLE_INDEX_PATH, "title", uuid_map)
+        title_index.generation = generation
         title_index.init_index()
     
     if description_index is None:
         description_index = TextVectorIndex(settings.DESCRIPTION_INDEX_PATH, "description", uuid_map)
+        description_index.generation = generation
         description_index.init_index()
     
     if image_index is None:
         image_index = ImageVectorIndex(settings.IMAGE_INDEX_PATH, uuid_map)
+        image_index.generation = generation
         image_index.init_index()
+    
+    # 只读进程不重放也不截断日志，只看到写入进程已写盘的版本
+    if not read_only_process:
+        _replay_log()
+
+
+def _load_manifest() -> Dict[str, Any]:
+    """加载索引版本清单，清单不存在时使用旧版未分版本的文件"""
+    if os.path.exists(MANIFEST_PATH):
+        try:
+            with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            print(f"已加载索引版本清单，当前版本{data['generation']}")
+            return data
+        except Exception as e:
+            print(f"加载索引版本清单失败: {e}")
+    return {"generation": 0, "generations": []}
+
+
+def _write_manifest(data: Dict[str, Any]):
+    """原子地替换索引版本清单：写临时文件、刷盘后重命名"""
+    directory = os.path.dirname(MANIFEST_PATH) or "."
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{MANIFEST_PATH}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, MANIFEST_PATH)
+    # 重命名本身也要落盘，Windows不支持打开目录，忽略即可
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+
+def _generation_files(generation: int) -> List[str]:
+    """某个版本包含的所有文件"""
+    base, _ = os.path.splitext(settings.UUID_MAP_PATH)
+    paths = [snapshot_path(settings.UUID_MAP_PATH, generation)]
+    for index in (title_index, description_index, image_index):
+        if index:
+            paths.append(snapshot_path(index.index_path, generation))
+            # 旧版本单独保存的反向映射表
+            paths.append(snapshot_path(f"{base}_{index.index_type}_rows.pickle", generation))
+    return paths
 
 
-def save_indices():
-    """保存所有向量索引到磁盘"""
-    if title_index:
-        title_index.save_index()
+def _remove_generation(generation: int):
+    """删除某个版本的所有文件"""
+    for path in _generation_files(generation):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _set_generation(generation: int):
+    """清单切换后，后续读取索引文件（例如只读内存映射转为可写）使用新版本"""
+    for index in (title_index, description_index, image_index):
+        if index:
+            index.generation = generation
+
+
+def _replay_log():
+    """重放上次检查点之后的向量变更日志"""
+    records = vector_log.replay(manifest["generation"])
+    for op, index_type, uuid, idx, vector in records:
+        if op == VectorLog.OP_ADD:
+            _get_index(index_type)._insert(uuid, vector, idx)
+        elif op == VectorLog.OP_REMOVE:
+            _get_index(index_type)._remove(uuid)
+        else:
+            uuid_map.discard(uuid)
+    if records:
+        print(f"已重放向量变更日志，共{len(records)}条记录")
+
+
+def _next_generation() -> int:
+    """下一个版本号，大于所有保留的版本和已封存的日志段（包括写盘失败留下的）"""
+    used = [entry["generation"] for entry in manifest["generations"]]
+    used += [generation for generation, _ in vector_log.segments()]
+    return max(used + [manifest["generation"]]) + 1
+
+
+def save_indices() -> bool:
+    """保存所有向量索引到磁盘（检查点），全部保存成功后删除已封存的变更日志
     
-    if description_index:
-        description_index.save_index()
+    持有写锁的时间只包括在内存中复制索引和UUID映射、封存变更日志；
+    写文件和刷盘不持有锁，期间的上传和编辑照常进行，其变更记在新的日志中
     
-    if image_index:
-        image_index.save_index()
+    返回:
+        bool: 是否全部保存成功
+    """
+    global manifest
+    _require_writer()
+    with checkpoint_lock:
+        with index_lock.write():
+            indices = [index for index in (title_index, description_index, image_index) if index]
+            generation = _next_generation()
+            snapshots = [index.snapshot_index() for index in indices]
+            uuid_snapshot = uuid_map.snapshot()
+            entry = {
+                "generation": generation,
+                "created_at": datetime.now().isoformat(),
+                "uuids": len(uuid_map),
+                "vectors": {index.index_type: int(index.index.ntotal) for index in indices if index.index is not None}
+            }
+            vector_log.rotate(generation)
+        
+        saved = all([index.write_snapshot(snapshot, generation) for index, snapshot in zip(indices, snapshots)])
+        
+        # 保存UUID映射
+        try:
+            UuidIdMap.write_snapshot(snapshot_path(settings.UUID_MAP_PATH, generation), uuid_snapshot)
+            print(f"UUID映射已保存，包含{entry['uuids']}个条目")
+        except Exception as e:
+            print(f"保存UUID映射失败: {e}")
+            saved = False
+        
+        if not saved:
+            # 已封存的日志段保留，下次检查点或重启时仍会包含这些变更
+            _remove_generation(generation)
+            return False
+        
+        # 所有文件落盘后切换清单，清单切换前崩溃时仍使用上一个完整版本并重放日志段
+        keep = max(1, settings.INDEX_SNAPSHOT_KEEP)
+        entries = manifest["generations"] + [entry]
+        with index_lock.write():
+            manifest = {"generation": generation, "generations": entries[-keep:]}
+            _write_manifest(manifest)
+            _set_generation(generation)
+        vector_log.discard_through(generation)
+        
+        for old_entry in entries[:-keep]:
+            _remove_generation(old_entry["generation"])
+        return True
+
+
+def list_snapshots() -> Dict[str, Any]:
+    """返回当前索引版本和保留的历史版本"""
+    return {"generation": manifest["generation"], "generations": manifest["generations"]}
+
+
+def rollback_indices(generation: Optional[int] = None) -> Dict[str, Any]:
+    """回滚到保留的某个索引版本，默认回滚到上一个版本
     
-    # 保存UUID映射
-    try:
-        with open(settings.UUID_MAP_PATH, 'wb') as f:
-            pickle.dump(uuid_map, f)
-        print(f"UUID映射已保存，包含{len(uuid_map)}个条目")
-    except Exception as e:
-        print(f"保存UUID映射失败: {e}")
+    比目标版本新的版本以及尚未写盘的变更日志都会被丢弃，随后重新加载索引
+    
+    参数:
+        generation: 目标版本号
+    """
+    global manifest, uuid_map, title_index, description_index, image_index
+    _require_writer()
+    with rebuild_lock, checkpoint_lock, index_lock.write():
+        current = manifest["generation"]
+        available = [entry["generation"] for entry in manifest["generations"]]
+        if generation is None:
+            older = [g for g in available if g < current]
+            if not older:
+                raise ValueError("没有可回滚的历史版本")
+            generation = max(older)
+        if generation not in available:
+            raise ValueError(f"索引版本{generation}不存在")
+        
+        discarded = [g for g in available if g > generation]
+        discarded_mutations = vector_log.mutations
+        manifest = {
+            "generation": generation,
+            "generations": [entry for entry in manifest["generations"] if entry["generation"] <= generation]
+        }
+        _write_manifest(manifest)
+        vector_log.truncate()
+        for g in discarded:
+            _remove_generation(g)
+        
+        # 重新加载目标版本
+        uuid_map = UuidIdMap()
+        title_index = description_index = image_index = None
+        init_indices()
+        print(f"向量索引已从版本{current}回滚到版本{generation}")
+    
+    return {
+        "previous_generation": current,
+        "generation": generation,
+        "discarded_generations": discarded,
+        "discarded_mutations": discarded_mutations
+    }
+
+
+def save_indices_if_needed() -> bool:
+    """变更日志积累到VECTOR_CHECKPOINT_MUTATIONS条时做一次检查点
+    
+    返回:
+        bool: 是否执行了检查点
+    """
+    if vector_log.mutations < settings.VECTOR_CHECKPOINT_MUTATIONS:
+        return False
+    return save_indices()
+
+
+class IndexCheckpointer:
+    """后台检查点线程
+    
+    写请求只追加变更日志并标记索引为脏，由后台线程在变更积累到
+    VECTOR_CHECKPOINT_MUTATIONS条，或最早一条未写盘的变更超过
+    VECTOR_CHECKPOINT_INTERVAL秒时统一写盘，请求耗时不再包含整个索引的写入
+    """
+    
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        # 最早一条未写盘变更的时间，无未写盘变更时为None
+        self.dirty_since: Optional[float] = None
+        self.last_flush_at: Optional[float] = None
+        self.last_flush_seconds: Optional[float] = None
+        self.flush_count = 0
+    
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+    
+    def start(self):
+        """启动后台线程，只读进程不做检查点"""
+        if self.running or read_only_process:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="index-checkpointer", daemon=True)
+        self._thread.start()
+        print(f"向量索引后台检查点已启动，间隔{settings.VECTOR_CHECKPOINT_INTERVAL}秒")
+    
+    def stop(self):
+        """停止后台线程并写盘所有未保存的变更"""
+        if self.running:
+            self._stopping.set()
+            self._wake.set()
+            self._thread.join()
+        self._thread = None
+        self.flush()
+    
+    def mark_dirty(self):
+        """记录有新的变更，达到条数阈值时立即唤醒后台线程"""
+        if self.dirty_since is None:
+            self.dirty_since = time.time()
+        if vector_log.mutations >= settings.VECTOR_CHECKPOINT_MUTATIONS:
+            self._wake.set()
+    
+    def flush(self) -> bool:
+        """立即写盘所有未保存的变更
+        
+        返回:
+            bool: 是否写盘成功（无变更时视为成功）
+        """
+        if read_only_process or (vector_log.mutations == 0 and not vector_log.segments()):
+            self.dirty_since = None
+            return True
+        start = time.time()
+        saved = save_indices()
+        if saved:
+            # 写盘期间新增的变更留给下一次检查点
+            self.dirty_since = start if vector_log.mutations else None
+            self.last_flush_at = time.time()
+            self.last_flush_seconds = self.last_flush_at - start
+            self.flush_count += 1
+        return saved
+    
+    def stats(self) -> Dict[str, Any]:
+        """返回检查点状态：上次写盘时间、未写盘变更数等"""
+        return {
+            "running": self.running,
+            "pending_mutations": vector_log.mutations,
+            "dirty_seconds": round(time.time() - self.dirty_since, 1) if self.dirty_since else 0,
+            "last_flush_at": (datetime.fromtimestamp(self.last_flush_at).isoformat()
+                              if self.last_flush_at else None),
+            "last_flush_seconds": round(self.last_flush_seconds, 3) if self.last_flush_seconds is not None else None,
+            "flush_count": self.flush_count,
+            "generation": manifest["generation"],
+            "interval_seconds": settings.VECTOR_CHECKPOINT_INTERVAL,
+            "max_pending_mutations": settings.VECTOR_CHECKPOINT_MUTATIONS
+        }
+    
+    def _run(self):
+        while not self._stopping.is_set():
+            timeout = settings.VECTOR_CHECKPOINT_INTERVAL
+            if self.dirty_since is not None:
+                timeout = max(0, self.dirty_since + settings.VECTOR_CHECKPOINT_INTERVAL - time.time())
+            self._wake.wait(timeout)
+            self._wake.clear()
+            if self._stopping.is_set():
+                break
+            
+            due = (self.dirty_since is not None
+                   and time.time() - self.dirty_since >= settings.VECTOR_CHECKPOINT_INTERVAL)
+            if due or vector_log.mutations >= settings.VECTOR_CHECKPOINT_MUTATIONS:
+                try:
+                    if not self.flush():
+                        # 写盘失败时推迟到下一个时间窗口重试
+                        self.dirty_since = time.time()
+                except Exception as e:
+                    print(f"向量索引后台检查点失败: {e}")
+                    self.dirty_since = time.time()
+
+
+checkpointer = IndexCheckpointer()
+
+
+def schedule_checkpoint():
+    """写操作完成后调用：后台检查点线程运行时交给它写盘，
+    未启动时（例如脚本中直接调用）按条数阈值同步做检查点
+    """
+    if checkpointer.running:
+        checkpointer.mark_dirty()
+    else:
+        save_indices_if_needed()
 
 
 def add_title_vector(uuid: str, title: str):
@@ -380,120 +2014,209 @@ def add_description_vector(uuid: str, description: str):
     return description_index.add_vector(uuid, description)
 
 
-def add_image_vector(uuid: str, image_path: str):
-    """将图像向量添加到索引"""
+def add_image_vector(uuid: str, image_path: str, cache_key: Optional[str] = None,
+                     image: Optional[Image.Image] = None):
+    """将图像向量添加到索引
+    
+    cache_key为图片文件内容哈希（images.hash_value）；image为已在内存中打开的图像，
+    传入时直接编码，不再读取image_path
+    """
     global image_index
     if image_index is None:
         init_indices()
-    return image_index.add_vector(uuid, image_path)
+    return image_index.add_vector(uuid, image if image is not None else image_path, cache_key=cache_key)
+
+
+def _get_index(index_type: str) -> VectorIndex:
+    """根据类型返回对应的向量索引，未初始化时先初始化"""
+    if title_index is None or description_index is None or image_index is None:
+        init_indices()
+    if index_type == "title":
+        return title_index
+    if index_type == "description":
+        return description_index
+    if index_type == "image":
+        return image_index
+    raise ValueError(f"未知的索引类型: {index_type}")
+
+
+def rebuild_indices(index_types: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """按配置的索引结构重建向量索引并保存
+    
+    参数:
+        index_types: 要重建的索引类型列表，默认重建全部
+    """
+    _require_writer()
+    # 各索引在锁外构建，只在替换时短暂持有写锁；同一时间只执行一次重建
+    with rebuild_lock:
+        results = [_get_index(index_type).rebuild_index()
+                   for index_type in (index_types or ["title", "description", "image"])]
+    save_indices()
+    return results
+
+
+def evaluate_recall(index_type: str, sample_size: int = 100, k: int = 10) -> Dict[str, Any]:
+    """评估指定索引相对于精确检索的召回率"""
+    _reload_if_changed()
+    return _get_index(index_type).evaluate_recall(sample_size, k)
+
+
+def remove_vector(uuid: str, index_type: str) -> bool:
+    """从指定索引中删除UUID对应的向量，其他索引不受影响"""
+    return _get_index(index_type).remove_vector(uuid)
 
 
 def delete_vectors(uuid: str):
-    """标记删除向量索引中的条目"""
-    if uuid in uuid_map:
-        # 在生产环境中，我们需要一个更复杂的删除策略
-        # 这里我们简单地从UUID映射中移除，但向量仍然在索引中
-        # 定期维护时可以重建索引来真正清理已删除的向量
-        del uuid_map[uuid]
-        return True
-    return False
+    """从所有向量索引中删除UUID对应的向量"""
+    _require_writer()
+    with index_lock.write():
+        if uuid in uuid_map:
+            for index_type in ("title", "description", "image"):
+                remove_vector(uuid, index_type)
+            uuid_map.discard(uuid)
+            vector_log.append(VectorLog.OP_FORGET, None, uuid)
+            return True
+        return False
 
 
-def search_by_title(query_text: str, limit: int = 20) -> List[Dict[str, Any]]:
-    """通过标题文本查询向量索引"""
+def search_by_title(query_text: str, limit: int = 20,
+                    allowed_uuids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    """通过标题文本查询向量索引，allowed_uuids不为None时只在这些UUID中搜索"""
+    _reload_if_changed()
     global title_index
     if title_index is None:
         init_indices()
-    return title_index.search(query_text, limit)
+    return title_index.search(query_text, limit, allowed_uuids)
 
 
-def search_by_description(query_text: str, limit: int = 20) -> List[Dict[str, Any]]:
-    """通过描述文本查询向量索引"""
+def search_by_description(query_text: str, limit: int = 20,
+                          allowed_uuids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    """通过描述文本查询向量索引，allowed_uuids不为None时只在这些UUID中搜索"""
+    _reload_if_changed()
     global description_index
     if description_index is None:
         init_indices()
-    return description_index.search(query_text, limit)
+    return description_index.search(query_text, limit, allowed_uuids)
 
 
-def search_by_image(image_path: str, limit: int = 20) -> List[Dict[str, Any]]:
-    """通过图像路径查询向量索引"""
+def search_by_image(image_path: str, limit: int = 20,
+                    allowed_uuids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    """通过图像路径查询向量索引，allowed_uuids不为None时只在这些UUID中搜索"""
+    _reload_if_changed()
     global image_index
     if image_index is None:
         init_indices()
-    return image_index.search(image_path, limit)
+    return image_index.search(image_path, limit, allowed_uuids)
 
 
-def search_by_vector(query_vector: np.ndarray, index_type: str = "image", limit: int = 20) -> List[Dict[str, Any]]:
+def search_by_vector(query_vector: np.ndarray, index_type: str = "image", limit: int = 20,
+                     allowed_uuids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
     """根据向量类型搜索相似向量
     
     参数:
         query_vector: 查询向量
         index_type: 要搜索的索引类型，可选值: "title", "description", "image"
         limit: 返回结果数量上限
+        allowed_uuids: 只在这些UUID中搜索，None表示不限制
     
     返回:
         List[Dict[str, Any]]: 相似结果列表
     """
     global title_index, description_index, image_index
+    _reload_if_changed()
     
     if index_type == "title":
         if title_index is None:
             init_indices()
-        return title_index.search_by_vector(query_vector, limit)
+        return title_index.search_by_vector(query_vector, limit, allowed_uuids)
     
     elif index_type == "description":
         if description_index is None:
             init_indices()
-        return description_index.search_by_vector(query_vector, limit)
+        return description_index.search_by_vector(query_vector, limit, allowed_uuids)
     
     else:  # 默认为image
         if image_index is None:
             init_indices()
-        return image_index.search_by_vector(query_vector, limit)
+        return image_index.search_by_vector(query_vector, limit, allowed_uuids)
 
 
-def search_by_uuid(uuid: str, limit: int = 20, search_type: str = "image") -> List[Dict[str, Any]]:
+def search_by_uuid(uuid: str, limit: int = 20, search_type: str = "image",
+                   allowed_uuids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
     """通过UUID查找相似内容
     
     参数:
         uuid: 要搜索的UUID
         limit: 返回结果数量上限
         search_type: 搜索类型，可选值: "title", "description", "image"
+        allowed_uuids: 只在这些UUID中搜索，None表示不限制
     """
-    global uuid_map, title_index, description_index, image_index
-    
-    if uuid not in uuid_map:
+    _reload_if_changed()
+    if title_index is None or description_index is None or image_index is None:
+        init_indices()
+    with index_lock.read():
+        ids = uuid_map.ids(uuid)
+    if not ids:
         return []
     
-    if search_type == "image" and uuid_map[uuid].get("image_id") is not None:
-        if image_index is None:
-            init_indices()
-        return image_index.search_by_id(uuid_map[uuid]["image_id"], limit)
-    
-    elif search_type == "title" and uuid_map[uuid].get("title_id") is not None:
-        if title_index is None:
-            init_indices()
-        return title_index.search_by_id(uuid_map[uuid]["title_id"], limit)
-    
-    elif search_type == "description" and uuid_map[uuid].get("description_id") is not None:
-        if description_index is None:
-            init_indices()
-        return description_index.search_by_id(uuid_map[uuid]["description_id"], limit)
+    if search_type in ("title", "description", "image") and ids.get(search_type) is not None:
+        return _get_index(search_type).search_by_id(ids[search_type], limit, allowed_uuids)
     
     # 默认使用图像向量
-    elif uuid_map[uuid].get("image_id") is not None:
-        if image_index is None:
-            init_indices()
-        return image_index.search_by_id(uuid_map[uuid]["image_id"], limit)
+    elif ids.get("image") is not None:
+        return _get_index("image").search_by_id(ids["image"], limit, allowed_uuids)
     
     return []
 
 
-def search_by_text(query_text: str, limit: int = 20) -> List[Dict[str, Any]]:
+def search_many(vectors: np.ndarray, index_types: Union[str, List[str]] = "image", k: int = 20,
+                allowed_uuids: Optional[Iterable[str]] = None) -> List[Dict[str, List[Dict[str, Any]]]]:
+    """批量向量搜索，每个索引只执行一次FAISS调用
+    
+    参数:
+        vectors: 查询向量矩阵 [n, dim]（单个向量也可以）
+        index_types: 要搜索的索引类型，每个查询都在这些索引中搜索
+        k: 每个查询在每个索引中返回的结果数量上限
+        allowed_uuids: 只在这些UUID中搜索，None表示不限制
+    
+    返回:
+        List[Dict[str, List[Dict[str, Any]]]]: 与查询向量一一对应，每项为 {索引类型: 结果列表}
+    """
+    _reload_if_changed()
+    if isinstance(index_types, str):
+        index_types = [index_types]
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    
+    # 过滤集合只物化一次，供各索引转换为向量ID
+    if allowed_uuids is not None and not isinstance(allowed_uuids, (list, tuple, set, PostFilter)):
+        allowed_uuids = list(allowed_uuids)
+    
+    batch = [{} for _ in range(len(vectors))]
+    for index_type in index_types:
+        for results, per_index in zip(batch, _get_index(index_type).search_many(vectors, k, allowed_uuids)):
+            results[index_type] = per_index
+    return batch
+
+
+def get_vector(uuid: str, index_type: str = "image") -> Optional[np.ndarray]:
+    """返回UUID在某个索引中已存的向量，不存在时返回None"""
+    _reload_if_changed()
+    index = _get_index(index_type)
+    with index_lock.read():
+        idx = uuid_map.get(uuid, index_type)
+        if idx is None:
+            return None
+        return index._stored_vectors(np.array([idx], dtype=np.int64))[0]
+
+
+def search_by_text(query_text: str, limit: int = 20,
+                   allowed_uuids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
     """通过文本查询标题和描述向量索引，并合并结果"""
-    # 分别查询标题和描述
-    title_results = search_by_title(query_text, limit)
-    desc_results = search_by_description(query_text, limit)
+    # 文本只编码一次，同时查询标题和描述
+    query_vector = _get_index("title")._get_vector(query_text)
+    matches = search_many(query_vector, ["title", "description"], limit, allowed_uuids)[0]
+    title_results = matches["title"]
+    desc_results = matches["description"]
     
     # 合并结果，按相似度排序
     all_results = {}
@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
@@ -9,7 +10,7 @@ import os
 from backend.routers import images, search, tags, metadata, ai, system
 from backend.config import settings  # 导入配置
 from backend.db import init_db  # 导入数据库初始化函数
-from backend.vector_db import init_indices  # 导入向量索引初始化函数
+from backend.vector_db import init_indices, checkpointer, release_writer_lock  # 导入向量索引初始化函数和后台检查点
 
 # 初始化数据库
 init_db()
@@ -17,11 +18,19 @@ init_db()
 # 初始化向量索引
 init_indices()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动后台检查点，关闭时写盘所有未保存的向量变更
+    checkpointer.start()
+    yield
+    checkpointer.stop()
+
 # 创建FastAPI应用
 app = FastAPI(
     title="SmartImageFinder API",
     description="SmartImageFinder API for image search and analysis",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # 配置CORS
@@ -109,5 +118,7 @@ async def root():
     
 
 if __name__ == "__main__":
+    # 重载模式下由子进程处理请求，当前监视进程释放向量索引写入锁交给子进程
+    release_writer_lock()
     # 启动FastAPI应用
     uvicorn.run("main:app", host=settings.HOST, port=settings.PORT, log_level="info",reload=True)
\ No newline at end of file